@@ -1,4 +1,5 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import gradio as gr
 import fastapi
 import uvicorn
@@ -8,16 +9,27 @@ import time
 from pydantic import BaseModel
 from datetime import datetime
 import pandas as pd
+import numpy as np
 import base64
 import io
 from PIL import Image
 import sys
 import webbrowser
 import re
+import unicodedata
+import math
+import hashlib
+import zlib
+from array import array
+import heapq
+import random
 import asyncio
+import atexit
+import subprocess
 from difflib import SequenceMatcher # Benzerlik hesabı için
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock 
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future
+from threading import Lock, Condition, Thread
 
 import openpyxl
 from pdf2image import convert_from_path
@@ -41,7 +53,30 @@ SEARCH_LOG_FILE = os.path.join(HISTORY_DIR, "search_history.jsonl")
 # Varsayılan ayarlar
 DEFAULT_CONFIG = {
     "api_key": "HENUZ_GIRILMEDI_LUTFEN_AYARLAR_SEKMESINI_KULLANIN",
-    "model_name": "gemini-1.5-pro-latest" 
+    "model_name": "gemini-1.5-pro-latest",
+    "classification_concurrency": 4,   # Sınıflandırma asistanında aynı anda işlenecek dosya sayısı
+    # Model başına dakikalık istek (rpm) / token (tpm) sınırı. Model adıyla ayrı ayar eklenebilir:
+    # "rate_limits": {"default": {...}, "gemini-1.5-flash": {"rpm": 15, "tpm": 1000000}}
+    "rate_limits": {"default": {"rpm": 60, "tpm": 1000000}},
+    "llm_max_retries": 5,              # 429 / 5xx hatalarında en fazla tekrar deneme
+    # Toplu kayıt işleminde eşzamanlı dosya sayısı sınırları (AIMD bu aralıkta ayarlar)
+    "batch_concurrency": {"min": 1, "max": 16, "initial": 4},
+    # Görsel tabanlı LLM yanıt önbelleği (llm_onbellek/ klasörü)
+    "llm_cache": {"enabled": True, "ttl_days": 30, "max_mb": 200},
+    # Modele gönderilmeden önce görsel küçültme / kırpma / kodlama ayarları
+    "image_optimizer": {"enabled": True, "max_long_edge": 2048, "grayscale": False,
+                        "crop_whitespace": True, "format": "JPEG", "quality": 85},
+    # PDF görüntüleme: eşzamanlı poppler süreci, hazır sayfa kuyruğu ve sayfa önbelleği (sayfa_onbellek/) sınırı
+    "raster": {"workers": 4, "queue_size": 8, "cache_mb": 500},
+    "pdf_text_layer": True,            # Dijital PDF'lerde görsel yerine metin katmanını gönder
+    "sds_local_first": True,           # SDS vergi taramasında önce yerel CAS + vergi indeksi (net sonuçta model çağrılmaz)
+    # İsim benzerliği araması: SequenceMatcher ile puanlanacak en fazla aday (ortak trigram sayısına göre).
+    # 0 = kısa liste yok; uzunluk sınırını geçen tüm adaylar puanlanır (eski tam taramayla birebir aynı sonuç).
+    "tax_name_shortlist": 50,
+    # SDS özeti / GTIP formu çıkarımında birden çok belgeyi tek istekte gönderme (1 = kapalı)
+    "document_batching": {"enabled": True, "max_documents": 4, "max_wait_ms": 300},
+    # cases.jsonl grup yazımı: ilk kayıttan sonra en fazla max_delay_ms beklenir, tek fsync ile en fazla max_group kayıt
+    "case_writer": {"max_delay_ms": 10, "max_group": 256}
 }
 
 def mask_api_key(api_key):
@@ -69,7 +104,8 @@ def log_classification_to_history(filename, product_name, composition, ai_respon
             "filename": filename,
             "product_name": product_name,
             "composition": composition,
-            "ai_response": ai_response_html
+            "ai_response": ai_response_html,
+            "search_key": fold_search_text(f"{filename} {product_name} {composition}")
         }
         with open(CLASSIFICATION_LOG_FILE, 'a', encoding='utf-8') as f:
             f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
@@ -82,49 +118,492 @@ def load_config():
         try:
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
                 app_config = json.load(f)
-            if "model_name" not in app_config: app_config["model_name"] = DEFAULT_CONFIG["model_name"]
+            # Eski config dosyalarında olmayan ayarlar varsayılanla tamamlanır
+            for key, value in DEFAULT_CONFIG.items():
+                app_config.setdefault(key, value)
             print(f"Yapılandırma yüklendi. Model: {app_config['model_name']}")
         except:
             app_config = DEFAULT_CONFIG.copy()
     else:
         save_config(app_config["api_key"], app_config["model_name"])
 
-def load_file_as_image(file_path):
+def get_classification_concurrency():
+    """config.json'daki eşzamanlı sınıflandırma sayısı (En az 1)."""
+    try:
+        return max(1, int(app_config.get("classification_concurrency", DEFAULT_CONFIG["classification_concurrency"])))
+    except (TypeError, ValueError):
+        return DEFAULT_CONFIG["classification_concurrency"]
+
+# --- PDF SAYFA GÖRÜNTÜLEME SERVİSİ (POPPLER HAVUZU + DİSK ÖNBELLEĞİ) ---
+# PDF sayfaları tek bir yerden görüntülenir. Her sayfa ayrı bir pdftoppm sürecinde çizilir
+# (aynı anda en fazla 'workers' süreç) ve PNG olarak doğrudan diske yazılır; Python belleğine
+# sadece kullanılacağı an yüklenir. Anahtar: dosya içeriğinin özeti + DPI + sayfa numarası.
+RASTER_CACHE_DIR = os.path.join(BASE_DIR, "sayfa_onbellek")
+SDS_RASTER_DPI = 150              # SDS özetinde okuma hızı için düşük DPI yeterli
+
+def get_poppler_path():
+    """Poppler klasörü: EXE içinde 'poppler_bin', projede 'poppler/Library/bin'; yoksa sistemdeki kullanılır."""
+    if getattr(sys, 'frozen', False):
+        # PyInstaller ile 'poppler_bin' adıyla paketlenir
+        return os.path.join(sys._MEIPASS, "poppler_bin")
+    poppler_path = os.path.join(BASE_DIR, "poppler", "Library", "bin")
+    return poppler_path if os.path.exists(poppler_path) else None
+
+class PdfRasterizer:
+    """Sınırlı poppler süreç havuzu ve LRU disk önbelleği ile PDF sayfası görüntüleme."""
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = Lock()
+        self._executor = None
+        self._pending = {}            # anahtar -> Future (aynı sayfa iki kez çizilmesin)
+        self._entries = None          # anahtar -> [son erişim, boyut]
+        self._pins = {}               # anahtar -> okuyan sayısı (Okunmakta olan sayfa LRU'dan silinmez)
+        self._file_hashes = {}        # (yol, boyut, mtime) -> içerik özeti
+
+    def settings(self):
+        settings = dict(DEFAULT_CONFIG["raster"])
+        settings.update(app_config.get("raster") or {})
+        return settings
+
+    def _pool(self):
+        # _pin_page içinde self._lock tutulurken çağrılır (kilit tekrar alınmaz)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, int(self.settings()["workers"])),
+                                                thread_name_prefix="poppler")
+        return self._executor
+
+    def file_hash(self, file_path):
+        st = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        if memo_key not in self._file_hashes:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            self._file_hashes[memo_key] = digest.hexdigest()
+        return self._file_hashes[memo_key]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _load_entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if not name.endswith(".png") or ".part" in name: continue
+                    try:
+                        st = os.stat(os.path.join(self.directory, name))
+                        self._entries[name[:-4]] = [st.st_mtime, st.st_size]
+                    except OSError: continue
+        return self._entries
+
+    def _render(self, file_path, dpi, page, key):
+        """Havuz iş parçacığında çalışır: pdftoppm sayfayı doğrudan önbellek klasörüne yazar."""
+        os.makedirs(self.directory, exist_ok=True)
+        paths = convert_from_path(file_path, dpi=dpi, first_page=page, last_page=page, poppler_path=get_poppler_path(),
+                                  output_folder=self.directory, fmt="png", single_file=True,
+                                  output_file=f"{key}.part", paths_only=True)
+        if not paths:
+            raise Exception("Sayfa görüntülenemedi")
+        os.replace(paths[0], self._path(key))
+        max_bytes = float(self.settings()["cache_mb"]) * 1024 * 1024
+        with self._lock:
+            entries = self._load_entries()
+            entries[key] = [time.time(), os.path.getsize(self._path(key))]
+            total = sum(size for _, size in entries.values())
+            if total > max_bytes:
+                for old_key, (_, size) in sorted(entries.items(), key=lambda kv: kv[1][0]):
+                    if total <= max_bytes * 0.9: break
+                    if old_key == key or self._pins.get(old_key): continue
+                    entries.pop(old_key, None)
+                    try: os.remove(self._path(old_key))
+                    except OSError: pass
+                    total -= size
+        return self._path(key)
+
+    def _pin_page(self, file_path, dpi=300, page=1):
+        """
+        Sayfayı önbellekte sabitler ve anahtarını döndürür; yoksa havuzda çizdirip bekler.
+        Sabitlenen sayfa _unpin_page çağrılana kadar LRU temizliğinde silinmez.
+        """
+        key = f"{self.file_hash(file_path)}_{int(dpi)}_{int(page)}"
+        while True:
+            with self._lock:
+                entries = self._load_entries()
+                if key in entries and os.path.exists(self._path(key)):
+                    now = time.time()
+                    try: os.utime(self._path(key), (now, now))
+                    except OSError: pass
+                    entries[key][0] = now
+                    self._pins[key] = self._pins.get(key, 0) + 1
+                    return key
+                future = self._pending.get(key)
+                owner = future is None
+                if owner:
+                    future = self._pool().submit(self._render, file_path, dpi, page, key)
+                    self._pending[key] = future
+            try:
+                future.result()
+            finally:
+                if owner:
+                    with self._lock:
+                        self._pending.pop(key, None)
+            # Çizilen sayfa döngü başında kilit altında sabitlenir (Arada silindiyse yeniden çizilir)
+
+    def _unpin_page(self, key):
+        with self._lock:
+            if self._pins.get(key, 0) > 1:
+                self._pins[key] -= 1
+            else:
+                self._pins.pop(key, None)
+
+    def open_page(self, file_path, dpi=300, page=1):
+        """Sayfayı belleğe yüklenmiş PIL görseli olarak döndürür (dosya tutamacı açık kalmaz)."""
+        key = self._pin_page(file_path, dpi, page)
+        try:
+            with Image.open(self._path(key)) as img:
+                img.load()
+                return img.copy()
+        finally:
+            self._unpin_page(key)
+
+pdf_rasterizer = PdfRasterizer(RASTER_CACHE_DIR)
+
+def load_document_image(file_path, dpi=300):
+    """PDF ise ilk sayfa görüntüsü (önbellekli), değilse görselin kendisi."""
+    if str(file_path).lower().endswith(".pdf"):
+        return pdf_rasterizer.open_page(file_path, dpi=dpi, page=1)
+    return Image.open(file_path)
+
+async def iter_document_images(file_paths, dpi=300, queue_size=None):
     """
-    Gelen dosya PDF ise ilk sayfasını JPG yapar.
-    Poppler yolunu dinamik olarak (EXE içinden veya proje klasöründen) bulur.
+    Dosyaları modele hazırlayıp (sıra, yol, belge, hata) olarak verir (async generator).
+    Belge load_document_for_llm çıktısıdır (metin katmanı veya görsel).
+    Dosyaları 'workers' kadar işçi sırayla alır ve sınırlı kuyruğa koyar: tüketici (LLM aşaması) yavaşsa
+    görüntüleme durur. Aynı anda en fazla workers belge hazırlanır ve queue_size belge kuyrukta bekler;
+    dosya sayısından bağımsızdır (dosya başına görev açılmaz).
     """
+    settings = pdf_rasterizer.settings()
+    queue = asyncio.Queue(maxsize=max(1, int(queue_size or settings["queue_size"])))
+    pending = iter(enumerate(file_paths))      # İşçiler arasında paylaşılır
+    done = object()
+
+    async def render():
+        # Görsel kuyruğa girene kadar işçi yeni dosya almaz (bekleyen görsel sayısı da sınırlı)
+        for index, file_path in pending:
+            try:
+                item = (index, file_path, await asyncio.to_thread(load_document_for_llm, file_path, dpi), None)
+            except Exception as e:
+                item = (index, file_path, None, e)
+            await queue.put(item)
+
+    async def produce():
+        try:
+            await asyncio.gather(*(render() for _ in range(max(1, int(settings["workers"])))))
+        finally:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
     try:
-        # --- POPPLER YOLUNU BELİRLEME ---
-        if getattr(sys, 'frozen', False):
-            # Eğer uygulama paketlenmişse (EXE olmuşsa) geçici klasöre bak
-            base_path = sys._MEIPASS
-            # PyInstaller ile 'poppler_bin' adıyla paketleyeceğiz
-            poppler_path = os.path.join(base_path, "poppler_bin")
-        else:
-            # Normal Python olarak çalışıyorsa proje klasörüne bak
-            # BURAYI KENDİ KLASÖR YAPINA GÖRE KONTROL ET
-            # Eğer klasör yapın: Proje/poppler/Library/bin ise:
-            poppler_path = os.path.join(BASE_DIR, "poppler", "Library", "bin")
-            
-            # Eğer bu yol yoksa (belki direkt bin altındadır), path vermeyelim sistemdekini denesin
-            if not os.path.exists(poppler_path):
-                poppler_path = None 
-
-        # Dosya uzantısını kontrol et
-        if file_path.lower().endswith(".pdf"):
-            # poppler_path parametresini buraya ekliyoruz
-            pages = convert_from_path(file_path, dpi=300, first_page=1, last_page=1, poppler_path=poppler_path)
-            if pages:
-                return pages[0] 
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        producer.cancel()
+
+# --- PDF METİN KATMANI (DİJİTAL PDF'LER İÇİN HIZLI YOL) ---
+# Tedarikçi SDS'lerinin çoğu dijital PDF'tir: metin katmanı varsa sayfa görüntülenmez,
+# metin (özellikle Bölüm 3 / Bileşim) modele düz metin olarak gönderilir. Taranmış belgelerde
+# (metin katmanı yok veya bozuk) görsel yolu kullanılmaya devam eder.
+TEXT_LAYER_MAX_PAGES = 6
+TEXT_LAYER_MIN_CHARS = 400            # Bundan az okunabilir karakter varsa taranmış belge sayılır
+TEXT_LAYER_MIN_ALNUM_RATIO = 0.55     # Bozuk font kodlamalarında metin çoğunlukla sembol olur
+TEXT_LAYER_MAX_CHARS = 16000          # Modele gönderilecek metin üst sınırı
+GEMINI_IMAGE_TILE = 768               # Gemini büyük görselleri 768x768 karolara böler
+SDS_SECTION3_START = re.compile(
+    r'(?im)^[^\n]{0,20}?\b(?:SECTION|B[ÖO]L[ÜU]M|KISIM|ABSCHNITT|RUBRIQUE)?\s*3\s*[:.)\-]?\s*[^\n]{0,40}?'
+    r'(?:COMPOSITION|B[İI]LE[ŞS][İI]M|[İI][ÇC]ER[İI]K|ZUSAMMENSETZUNG)')
+SDS_SECTION4_START = re.compile(
+    r'(?im)^[^\n]{0,20}?\b(?:SECTION|B[ÖO]L[ÜU]M|KISIM|ABSCHNITT|RUBRIQUE)?\s*4\s*[:.)\-]?\s*[^\n]{0,40}?'
+    r'(?:FIRST[\s-]*AID|[İI]LK\s*YARDIM|ERSTE[\s-]*HILFE|PREMIERS\s*SECOURS)')
+
+def extract_pdf_text_layer(file_path, max_pages=TEXT_LAYER_MAX_PAGES):
+    """Poppler'ın pdftotext aracıyla ilk sayfaların metin katmanını okur. Okunamazsa boş string döner."""
+    poppler_path = get_poppler_path()
+    command = os.path.join(poppler_path, "pdftotext") if poppler_path else "pdftotext"
+    try:
+        result = subprocess.run([command, "-layout", "-enc", "UTF-8", "-f", "1", "-l", str(max_pages), file_path, "-"],
+                                capture_output=True, timeout=60,
+                                creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+    except Exception as e:
+        print(f"Metin katmanı okunamadı ({os.path.basename(file_path)}): {e}")
+        return ""
+    return result.stdout.decode("utf-8", errors="replace") if result.returncode == 0 else ""
+
+def has_usable_text_layer(text):
+    """Yeterli miktarda, çoğunlukla harf/rakamdan oluşan metin varsa True."""
+    visible = [ch for ch in text if not ch.isspace()]
+    if len(visible) < TEXT_LAYER_MIN_CHARS or text.count("(cid:") > 20:
+        return False
+    return sum(ch.isalnum() for ch in visible) / len(visible) >= TEXT_LAYER_MIN_ALNUM_RATIO
+
+def extract_sds_composition(text):
+    """SDS metninden Bölüm 3 (Bileşim) kısmını döndürür; bulunamazsa boş string."""
+    # İçindekiler tablosu başta, "bkz. Bölüm 3" atıfları sonda olur: ardından Bölüm 4 başlığı
+    # gelen son eşleşme asıl bölümdür. Bölüm 4 hiç bulunamazsa ilk eşleşmeden itibaren sınırlı kısım alınır.
+    starts = list(SDS_SECTION3_START.finditer(text))
+    if not starts:
+        return ""
+    for start in reversed(starts):
+        end = SDS_SECTION4_START.search(text, start.end())
+        if end:
+            return text[start.start():end.start()].strip()
+    return text[starts[0].start(): starts[0].start() + 6000].strip()
+
+def build_text_layer_payload(text):
+    """Modele gidecek metin: önce Bölüm 3, ardından belgenin başı (ürün tanımı), toplam sınır içinde."""
+    text = re.sub(r'[ \t]+\n', '\n', re.sub(r'\n{3,}', '\n\n', text))
+    composition = extract_sds_composition(text)[:TEXT_LAYER_MAX_CHARS // 2]
+    head = text[:TEXT_LAYER_MAX_CHARS - len(composition)]
+    if composition:
+        return f"[BÖLÜM 3 - BİLEŞİM]\n{composition}\n\n[BELGENİN BAŞI]\n{head}"
+    return head
+
+def estimate_page_image_tokens():
+    """Aynı sayfanın görsel olarak gönderilseydi harcayacağı yaklaşık token (A4, optimizasyon boyutunda)."""
+    long_edge = int(get_image_optimizer_settings()["max_long_edge"] or 3508)
+    short_edge = round(long_edge / math.sqrt(2))
+    return math.ceil(long_edge / GEMINI_IMAGE_TILE) * math.ceil(short_edge / GEMINI_IMAGE_TILE) * LLM_IMAGE_TOKEN_ESTIMATE
+
+def load_document_for_llm(file_path, dpi=300):
+    """
+    Belgeyi modele gönderilecek biçimde hazırlar.
+    Dönen: {"kind": "text"|"image", "text"/"image", "prepare_seconds"}
+    Dijital PDF'lerde metin katmanı, diğerlerinde (taranmış PDF, fotoğraf) ilk sayfa görüntüsü kullanılır.
+    """
+    started = time.perf_counter()
+    if str(file_path).lower().endswith(".pdf") and app_config.get("pdf_text_layer", DEFAULT_CONFIG["pdf_text_layer"]):
+        text = extract_pdf_text_layer(file_path)
+        if has_usable_text_layer(text):
+            return {"kind": "text", "text": build_text_layer_payload(text), "prepare_seconds": time.perf_counter() - started}
+    image = load_document_image(file_path, dpi)
+    return {"kind": "image", "image": image, "prepare_seconds": time.perf_counter() - started}
+
+def document_llm_parts(prompt, document):
+    """İstem + belge (görsel ya da metin katmanı) parçaları."""
+    if document["kind"] == "text":
+        return [prompt, "AŞAĞIDAKİ METİN, BELGENİN (PDF) METİN KATMANIDIR. GÖRSEL YERİNE BUNU OKU:\n\n" + document["text"]]
+    return [prompt, document["image"]]
+
+_image_latency_lock = Lock()
+_image_latency_baseline = None        # istem -> [toplam ms, adet] (görselli başarılı istekler)
+
+def record_image_request_latency(prompt_name, total_ms):
+    with _image_latency_lock:
+        baseline = _load_image_latency_baseline()
+        entry = baseline.setdefault(prompt_name, [0.0, 0])
+        entry[0] += total_ms
+        entry[1] += 1
+
+def _load_image_latency_baseline():
+    """Metrik dosyasındaki görselli isteklerden istem bazında ortalama süre (ilk çağrıda bir kez okunur)."""
+    global _image_latency_baseline
+    if _image_latency_baseline is None:
+        _image_latency_baseline = {}
+        if os.path.exists(LLM_METRICS_FILE):
+            with open(LLM_METRICS_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except: continue
+                    if entry.get("status") == "ok" and entry.get("images"):
+                        stat = _image_latency_baseline.setdefault(entry.get("prompt", "-"), [0.0, 0])
+                        stat[0] += entry.get("total_ms", 0)
+                        stat[1] += 1
+    return _image_latency_baseline
+
+def format_text_layer_savings(document, file_stats, prompt_name):
+    """Metin yolundan geçen dosya için görsel yoluna göre token ve süre kazancı özeti."""
+    if not document or document["kind"] != "text":
+        return ""
+    text_tokens = estimate_token_count(document["text"])
+    image_tokens = estimate_page_image_tokens()
+    summary = f"📝 Metin katmanı: ~{text_tokens} token (görsel ~{image_tokens} token, tasarruf {image_tokens - text_tokens:+d})"
+    if file_stats and file_stats["calls"]:
+        text_ms = file_stats["request_seconds"] * 1000 / file_stats["calls"]
+        with _image_latency_lock:
+            total_ms, count = _load_image_latency_baseline().get(prompt_name, [0.0, 0])
+        if count:
+            summary += f" | istek {text_ms / 1000:.1f} sn (görsel ort. {total_ms / count / 1000:.1f} sn, kazanç {(total_ms / count - text_ms) / 1000:+.1f} sn)"
         else:
-            return Image.open(file_path)
-            
+            summary += f" | istek {text_ms / 1000:.1f} sn (görsel ölçümü henüz yok)"
+    return summary
+
+def load_file_as_image(file_path):
+    """
+    Gelen dosya PDF ise ilk sayfasını görüntüye çevirir (poppler havuzu + sayfa önbelleği).
+    Hata durumunda None döner.
+    """
+    try:
+        return load_document_image(file_path, dpi=300)
     except Exception as e:
         print(f"Dosya okuma hatası ({file_path}): {e}")
         # Hata durumunda kullanıcıya bilgi vermek için None dönüyoruz
         return None
 
+# --- GÖRSEL YÜK OPTİMİZASYONU (GEMINI'YE GÖNDERMEDEN ÖNCE) ---
+# Formu okumak için 300 DPI / kamera çözünürlüğü gerekmez. Görseller modele gitmeden önce
+# kenar boşlukları kırpılır, uzun kenarı sınırlanır, (isteğe bağlı) griye çevrilir ve JPEG/WebP kodlanır.
+# Ayarlar config.json -> "image_optimizer"; istek başına gönderilen bayt ve süre metrik dosyasına yazılır.
+LLM_METRICS_FILE = os.path.join(HISTORY_DIR, "llm_istek_metrikleri.jsonl")
+IMAGE_OPTIMIZER_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+WHITESPACE_THRESHOLD = 24         # Beyazdan bu kadar koyu pikseller içerik sayılır
+WHITESPACE_MARGIN = 16            # Kırpılan içeriğin etrafında bırakılan boşluk (px)
+
+def get_image_optimizer_settings():
+    settings = dict(DEFAULT_CONFIG["image_optimizer"])
+    settings.update(app_config.get("image_optimizer") or {})
+    return settings
+
+def crop_whitespace(image):
+    """Sayfanın etrafındaki beyaz boşluğu kırpar (taranmış formlarda kenarlar genelde boştur)."""
+    # Sınır kutusu küçültülmüş kopyada bulunur (tam çözünürlükte piksel taraması yavaştır)
+    factor = max(1, max(image.size) // 1000)
+    gray = image.convert("L").reduce(factor)
+    content = gray.point(lambda p: 255 if p < 255 - WHITESPACE_THRESHOLD else 0)
+    bbox = content.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = (v * factor for v in bbox)
+    bbox = (max(0, left - WHITESPACE_MARGIN), max(0, top - WHITESPACE_MARGIN),
+            min(image.width, right + WHITESPACE_MARGIN), min(image.height, bottom + WHITESPACE_MARGIN))
+    return image.crop(bbox) if bbox != (0, 0, image.width, image.height) else image
+
+def optimize_image_for_llm(image, settings=None):
+    """
+    PIL görselini ayarlara göre küçültüp kodlar.
+    Dönen: ({"mime_type", "data"} blob, bilgi sözlüğü {"original_size", "size", "bytes"})
+    """
+    settings = settings or get_image_optimizer_settings()
+    original_size = image.size
+    if image.mode in ("RGBA", "LA", "P"):
+        # Saydam alanlar beyaz zemine oturtulur (JPEG saydamlık desteklemez)
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    image = image.convert("L") if settings["grayscale"] else image.convert("RGB")
+    if settings["crop_whitespace"]:
+        image = crop_whitespace(image)
+    max_edge = int(settings["max_long_edge"] or 0)
+    if max_edge and max(image.size) > max_edge:
+        scale = max_edge / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+
+    fmt = str(settings["format"]).upper()
+    if fmt not in IMAGE_OPTIMIZER_MIME: fmt = "JPEG"
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=int(settings["quality"]), optimize=(fmt == "JPEG"))
+    data = buffer.getvalue()
+    return {"mime_type": IMAGE_OPTIMIZER_MIME[fmt], "data": data}, {"original_size": original_size, "size": image.size, "bytes": len(data)}
+
+def encode_image_unoptimized(image):
+    """Optimizasyon kapalıyken kütüphanenin göndereceği yükün aynısı: dosya baytları, yoksa kayıpsız WebP."""
+    filename = getattr(image, "filename", None)
+    if filename and os.path.isfile(filename) and image.format in ("JPEG", "PNG", "WEBP"):
+        with open(filename, "rb") as f:
+            data = f.read()
+        return {"mime_type": image.get_format_mimetype(), "data": data}
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", lossless=True)
+    return {"mime_type": "image/webp", "data": buffer.getvalue()}
+
+def prepare_llm_parts(parts):
+    """
+    İstek parçalarındaki PIL görsellerini kodlanmış bloblara çevirir.
+    Dönen: (gönderilecek parçalar, toplam bayt, görsel sayısı)
+    """
+    settings = get_image_optimizer_settings()
+    prepared, total_bytes, image_count = [], 0, 0
+    for part in (parts if isinstance(parts, list) else [parts]):
+        if isinstance(part, Image.Image):
+            blob = optimize_image_for_llm(part, settings)[0] if settings["enabled"] else encode_image_unoptimized(part)
+            prepared.append(blob)
+            total_bytes += len(blob["data"])
+            image_count += 1
+        else:
+            prepared.append(part)
+            if isinstance(part, str):
+                total_bytes += len(part.encode("utf-8"))
+    return (prepared if isinstance(parts, list) else prepared[0]), total_bytes, image_count
+
+_llm_metrics_lock = Lock()
+
+def record_llm_request_metric(entry):
+    """Her model isteğinin bayt / süre ölçümünü metrik dosyasına ekler (ayar denemeleri için)."""
+    try:
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        with _llm_metrics_lock:
+            with open(LLM_METRICS_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"Metrik yazılamadı: {e}")
+
+def run_image_optimizer_benchmark(folder=None):
+    """
+    TestGTIP örnekleri üzerinde farklı optimizasyon ayarlarının gönderilecek bayt ve hazırlık süresini karşılaştırır,
+    ardından metrik dosyasındaki gerçek istekleri ayar bazında özetler.
+    Komut satırı: python Application.py --benchmark-gorsel [klasör]
+    """
+    folder = folder or os.path.join(BASE_DIR, "TestGTIP")
+    files = sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                   if f.lower().endswith((".pdf", ".jpg", ".jpeg", ".png", ".webp"))) if os.path.isdir(folder) else []
+    images = [img for img in (load_file_as_image(f) for f in files) if img is not None]
+    print(f"Örnek klasörü: {folder} ({len(images)} görsel)")
+
+    current = get_image_optimizer_settings()
+    variants = [("Mevcut ayar", current)]
+    for label, changes in [("Uzun kenar 1600", {"max_long_edge": 1600}), ("Uzun kenar 1024", {"max_long_edge": 1024}),
+                           ("Gri tonlama", {"grayscale": True}), ("WebP", {"format": "WEBP"}),
+                           ("Kalite 70", {"quality": 70}), ("Kırpma kapalı", {"crop_whitespace": False})]:
+        variants.append((label, dict(current, **changes)))
+
+    if images:
+        t0 = time.perf_counter()
+        raw_bytes = sum(len(encode_image_unoptimized(img)["data"]) for img in images)
+        raw_ms = (time.perf_counter() - t0) * 1000 / len(images)
+        print(f"{'Ayar':<18}{'Toplam KB':>11}{'Ort. KB':>9}{'Ort. boyut':>13}{'ms/görsel':>11}")
+        print(f"{'Optimizasyonsuz':<18}{raw_bytes / 1024:>11.0f}{raw_bytes / 1024 / len(images):>9.0f}{'-':>13}{raw_ms:>11.0f}")
+        for label, settings in variants:
+            t0 = time.perf_counter()
+            infos = [optimize_image_for_llm(img, settings)[1] for img in images]
+            ms = (time.perf_counter() - t0) * 1000 / len(images)
+            total = sum(info["bytes"] for info in infos)
+            avg_w = sum(info["size"][0] for info in infos) // len(infos)
+            avg_h = sum(info["size"][1] for info in infos) // len(infos)
+            print(f"{label:<18}{total / 1024:>11.0f}{total / 1024 / len(images):>9.0f}{f'{avg_w}x{avg_h}':>13}{ms:>11.0f}")
+
+    # Gerçek isteklerin özeti (ayar değişikliklerinin gecikmeye etkisi)
+    groups = {}
+    if os.path.exists(LLM_METRICS_FILE):
+        with open(LLM_METRICS_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except: continue
+                if entry.get("status") != "ok": continue
+                group_key = (entry.get("prompt", "-"), json.dumps(entry.get("image_optimizer"), sort_keys=True))
+                groups.setdefault(group_key, []).append(entry)
+    if groups:
+        print("\nKayıtlı istekler (istem / optimizasyon ayarı):")
+        for (prompt_name, settings_json), entries in sorted(groups.items()):
+            count = len(entries)
+            print(f"- {prompt_name}: {count} istek | ort. {sum(e['bytes_sent'] for e in entries) / 1024 / count:.0f} KB | "
+                  f"API {sum(e['api_ms'] for e in entries) / count:.0f} ms | toplam {sum(e['total_ms'] for e in entries) / count:.0f} ms | {settings_json}")
+
 def check_tax_date_warning(date_input):
     """
     Tarihi kontrol eder, bugünden itibaren 1 yıldan (365 gün) az kaldıysa uyarı verir.
@@ -132,147 +611,1289 @@ def check_tax_date_warning(date_input):
     """
     if not date_input or str(date_input) == "nan" or str(date_input) == "-":
         return "-"
-    
-    try:
-        # Gelen veri datetime objesi ise string'e çevir, string ise temizle
-        date_str = str(date_input).replace("**", "").strip()
-        
-        # SORUNUN ÇÖZÜMÜ: "2025-12-31 00:00:00" gelirse boşluktan bölüp sadece ilk kısmı al
-        # Bu sayede saat bilgisinden kurtuluruz.
-        clean_date_part = date_str.split(" ")[0]
-        
-        # Tarih objesine çevir (Önce gün/ay/yıl dene, olmazsa yıl/ay/gün)
+
+    expiry_date = parse_review_date(date_input)
+    if expiry_date is None:
+        # Format çok farklıysa olduğu gibi döndür (En azından saati atıp göster)
+        return str(date_input).split(" ")[0]
+    return format_review_date_status(expiry_date, datetime.now().date())
+
+# Gözden geçirme tarihi için kabul edilen formatlar (Excel genelde Yıl-Ay-Gün verir)
+REVIEW_DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d", "%d.%m.%Y", "%d%m%Y"]
+TAX_EXPIRY_WARNING_DAYS = 365
+
+def parse_review_date(date_input):
+    """'2025-12-31 00:00:00', '31/12/2025', '31122025' gibi değerleri date objesine çevirir, olmazsa None."""
+    # "2025-12-31 00:00:00" gelirse boşluktan bölüp sadece ilk kısmı al (Saat bilgisinden kurtuluruz)
+    clean_date_part = str(date_input).replace("**", "").strip().split(" ")[0]
+    for fmt in REVIEW_DATE_FORMATS:
         try:
-            expiry_date = datetime.strptime(clean_date_part, "%d/%m/%Y")
-        except:
-            # Excel genelde Yıl-Ay-Gün verir
-            expiry_date = datetime.strptime(clean_date_part, "%Y-%m-%d")
-            
-        today = datetime.now()
-        diff = expiry_date - today
-        
-        # Ekranda görünecek temiz tarih (saatsiz)
-        display_date = expiry_date.strftime("%Y-%m-%d")
-        
-        # Kontroller
-        if diff.days < 0:
-            return f"⚫ {display_date} (SÜRESİ DOLMUŞ)"
-        elif diff.days < 365:
-            return f"🔴 {display_date} (KRİTİK - <1 YIL)"
-        
-        return display_date
-        
-    except Exception as e:
-        # Hata durumunda (format çok farklıysa) olduğu gibi döndür ama hatayı konsola bas
-        # print(f"Tarih hatası: {e}") 
-        return str(date_input).split(" ")[0] # En azından saati atıp göster
-    
-def search_tax_db_smart(cas_no, product_name):
+            return datetime.strptime(clean_date_part, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def normalize_review_date(date_input):
+    """Yükleme sırasında tarihi ISO (YYYY-MM-DD) formatına çevirir; çözülemezse değeri olduğu gibi bırakır."""
+    if not date_input or str(date_input) in ("nan", "-"):
+        return "-"
+    parsed = parse_review_date(date_input)
+    return parsed.isoformat() if parsed else str(date_input).strip()
+
+def format_review_date_status(expiry_date, today):
+    """
+    Rapor hücresindeki tarih metnini üretir.
+    Süresi dolmuşsa ⚫, 1 yıldan az kaldıysa 🔴 işareti eklenir.
+    (Eski saatli hesapla aynı: son gün dahil 'dolmuş', 365. gün dahil 'kritik' sayılır.)
+    """
+    days_left = (expiry_date - today).days
+    display_date = expiry_date.isoformat()
+    if days_left <= 0:
+        return f"⚫ {display_date} (SÜRESİ DOLMUŞ)"
+    elif days_left <= TAX_EXPIRY_WARNING_DAYS:
+        return f"🔴 {display_date} (KRİTİK - <1 YIL)"
+    return display_date
+
+# --- METİN NORMALİZASYONU (TÜRKÇE DUYARLI ARAMA ANAHTARLARI) ---
+# str.lower() 'İ' harfini 'i̇' (i + birleşik nokta) yapar; "SİLİKON" ile "silikon" eşleşmez.
+# Arama anahtarlarında I/İ/ı -> i, aksanlı harfler sade harfe (ş->s, ç->c, ğ->g, ö->o, ü->u) çevrilir,
+# ®/™/© işaretleri silinir. Emsal araması, vergi araması ve geçmiş filtreleri aynı anahtarı kullanır.
+TRADEMARK_SYMBOLS_PATTERN = re.compile(r"[®™©℠]")
+TURKISH_CASE_MAP = str.maketrans({"İ": "i", "I": "i", "ı": "i"})
+
+def fold_search_text(text):
+    """Metni arama anahtarına çevirir. Boşluk ve noktalama korunur (Alt metin aramaları için)."""
+    text = TRADEMARK_SYMBOLS_PATTERN.sub("", str(text)).translate(TURKISH_CASE_MAP)
+    if not text.isascii():
+        # NFKD: 'ş' -> 's' + birleşik işaret; birleşik işaretler atılır
+        text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return text.casefold()
+
+def compact_search_key(text):
+    """Arama anahtarının sadece harf/rakam kısmı ("Rheobyk-431" -> "rheobyk431")."""
+    return re.sub(r'[\W_]+', '', fold_search_text(text))
+
+# --- CAS NUMARASI İNDEKSİ (VERGİ LİSTESİ) ---
+# CAS RN formatı: 2-7 hane, 2 hane, 1 kontrol hanesi (Örn: 111-76-2).
+# (?<!\d) ve (?!\d) sayesinde 77-99-6 ararken 157577-99-6 eşleşmez.
+CAS_NUMBER_PATTERN = re.compile(r"(?<!\d)(\d{2,7}-\d{2}-\d)(?!\d)")
+
+def extract_cas_numbers(text):
+    """Metin içindeki CAS numaralarını (tekrarsız, geçiş sırasıyla) döndürür."""
+    if not text:
+        return []
+    found = []
+    for cas in CAS_NUMBER_PATTERN.findall(str(text)):
+        if cas not in found:
+            found.append(cas)
+    return found
+
+def get_file_signature(path):
+    """Dosyanın boyut + değişim zamanı imzası. Dosya yoksa None döner."""
+    try:
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+    except OSError:
+        return None
+
+def load_tax_records(path=None):
+    """Vergi listesi (JSONL) dosyasındaki tüm kayıtları sırasıyla liste olarak döndürür."""
+    path = path or TAX_DB_FILE
+    records = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except: continue
+    return records
+
+def build_tax_cas_index(records):
+    """
+    Her kaydın 'tanim' alanındaki CAS numaralarını çıkarıp
+    CAS -> [kayıt sırası] sözlüğü oluşturur (Dosya sırası korunur).
+    """
+    index = {}
+    for pos, rec in enumerate(records):
+        for cas in extract_cas_numbers(rec.get("tanim", "")):
+            index.setdefault(cas, []).append(pos)
+    return index
+
+class TaxSnapshot:
+    """
+    Vergi listesinin belirli bir dosya imzasına ait değişmez kopyası.
+    Kayıtlar ve CAS indeksi hazır gelir; diğer indeksler snapshot dosyasından
+    gelir ya da ilk ihtiyaçta bir kez kurulur.
+    """
+    def __init__(self, records, cas_index, signature, derived=None):
+        self.records = records
+        self.cas_index = cas_index
+        self.signature = signature
+        self._derived = dict(derived or {})
+        self._derived_lock = Lock()
+
+    def derived(self, name, builder):
+        """'name' adlı yapıyı ilk çağrıda builder(records) ile kurar, sonraki çağrılarda önbellekten verir."""
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self.records)
+            return self._derived[name]
+
+class TaxDatabase:
+    """
+    Vergi listesinin süreç genelinde paylaşılan, thread-safe bellek içi önbelleği.
+    Dosya bir kez okunur; boyutu/değişim zamanı değişince veya invalidate() çağrılınca yeniden yüklenir.
+    share verilirse (TaxVersionStore.share_records) okunan kayıtlar sürüm havuzundaki nesnelerle paylaştırılır.
+    """
+    def __init__(self, path, share=None):
+        self.path = path
+        self.share = share
+        self._lock = Lock()
+        self._snapshot = None
+        self._stale = False
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+    def snapshot(self):
+        """Güncel TaxSnapshot nesnesini döndürür (Gerekirse dosyayı yeniden okur)."""
+        signature = get_file_signature(self.path)
+        with self._lock:
+            current = self._snapshot
+            if current is not None and not self._stale and current.signature == signature:
+                self.stats["hits"] += 1
+                return current
+
+            self.stats["misses"] += 1
+            if current is not None:
+                self.stats["reloads"] += 1
+
+            # Önce derlenmiş snapshot denenir, güncel değilse JSONL okunur ve snapshot yenilenir
+            loaded = load_tax_snapshot(self.path, signature)
+            source = "snapshot"
+            if loaded is None:
+                source = "JSONL"
+                records = load_tax_records(self.path)
+                cas_index = build_tax_cas_index(records)
+                loaded = TaxSnapshot(records, cas_index, signature)
+                if signature:
+                    try: write_tax_snapshot(records, self.path, signature, cas_index)
+                    except Exception as e: print(f"Vergi snapshot yazılamadı: {e}")
+            if self.share is not None:
+                # Snapshot yayınlanmadan önce (Türetilmiş indeksler kayıt nesnelerine bağlı değildir)
+                loaded.records = self.share(loaded.records)
+            self._snapshot = loaded
+            self._stale = False
+            print(f"Vergi veritabanı belleğe yüklendi ({source}): {len(loaded.records)} kayıt (Önbellek: {self.stats})")
+            return self._snapshot
+
+    def invalidate(self):
+        """Bir sonraki erişimde listenin diskten yeniden okunmasını sağlar."""
+        with self._lock:
+            self._stale = True
+
+    def get_stats(self):
+        """İsabet / ıskalama / yeniden yükleme sayaçlarının kopyasını döndürür."""
+        with self._lock:
+            return dict(self.stats)
+
+def format_tax_db_stats():
+    stats = tax_db.get_stats()
+    return f"Önbellek: {stats['hits']} isabet / {stats['misses']} ıskalama / {stats['reloads']} yeniden yükleme"
+
+def lookup_tax_by_cas(cas_no, records, cas_index):
+    """
+    CAS numarası ile vergi kaydını indeksten (hash araması) bulur.
+    Girdide birden fazla CAS varsa ilk eşleşen döner.
+    """
+    for cas in extract_cas_numbers(cas_no):
+        positions = cas_index.get(cas)
+        if positions and positions[0] < len(records):
+            return records[positions[0]]
+    return None
+
+# --- İSİM BENZERLİĞİ İÇİN TRIGRAM İNDEKSİ ---
+# Varsayılanlar eski davranışı birebir üretir: tam içerme 60 puan,
+# %75 üzeri benzerlik int(oran * 50) puan, kabul için puan > 50 olmalı.
+TAX_NAME_SUBSTRING_SCORE = 60
+TAX_NAME_SIMILARITY_WEIGHT = 50
+TAX_NAME_MIN_SIMILARITY = 0.75
+TAX_NAME_MIN_SCORE = 50
+TAX_NAME_SHORTLIST = 50           # SequenceMatcher ile puanlanacak en fazla aday sayısı (config: tax_name_shortlist)
+
+def get_tax_name_shortlist():
+    """config.json -> tax_name_shortlist. 0 veya boş: kısa liste uygulanmaz (tam tarama)."""
+    try:
+        return max(0, int(app_config.get("tax_name_shortlist", TAX_NAME_SHORTLIST) or 0))
+    except (TypeError, ValueError):
+        return TAX_NAME_SHORTLIST
+
+def char_trigrams(text):
+    """Metnin 3'lü karakter parçalarını (küme) döndürür."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TaxTrigramIndex:
+    """
+    Vergi tanımları üzerinde karakter trigram indeksi.
+    Adaylar önce trigram ortaklığı ve uzunluk sınırıyla elenir,
+    pahalı SequenceMatcher sadece kısa listeye uygulanır.
+    """
+    def __init__(self, records):
+        self.texts = [fold_search_text(rec.get("tanim", "")) for rec in records]   # Arama anahtarları
+        self.postings = {}     # trigram -> [kayıt sırası]
+        for pos, text in enumerate(self.texts):
+            for gram in char_trigrams(text):
+                self.postings.setdefault(gram, []).append(pos)
+
+    def to_state(self):
+        """Snapshot dosyası için sade (JSON'a yazılabilir) durum."""
+        return {"texts": self.texts, "postings": pack_postings(self.postings)}
+
+    @classmethod
+    def from_state(cls, state, records):
+        index = cls.__new__(cls)
+        index.texts = state["texts"]
+        index.postings = unpack_postings(state["postings"])
+        return index
+
+    def search(self, name, top_k=5,
+               min_similarity=TAX_NAME_MIN_SIMILARITY,
+               substring_score=TAX_NAME_SUBSTRING_SCORE,
+               similarity_weight=TAX_NAME_SIMILARITY_WEIGHT,
+               shortlist=None):
+        """
+        İsme en çok benzeyen kayıtları döndürür: [(puan, benzerlik oranı, kayıt sırası)].
+        Eşit puanda dosyada önce gelen kayıt önce gelir.
+        shortlist: SequenceMatcher'a girecek en fazla aday (None: config, 0: hepsi). Kısa liste, eşiği
+        geçebilecek bir kaydı ortak trigram sayısı düşük olduğu için dışarıda bırakabilir; 0 ile
+        sonuçlar tam SequenceMatcher taramasıyla aynıdır.
+        """
+        if shortlist is None:
+            shortlist = get_tax_name_shortlist()
+        target = fold_search_text(name or "").strip()
+        if not target:
+            return []
+
+        grams = char_trigrams(target)
+        shared = {}    # kayıt sırası -> ortak trigram sayısı
+        for gram in grams:
+            for pos in self.postings.get(gram, ()):
+                shared[pos] = shared.get(pos, 0) + 1
+
+        results = {}
+
+        # 1. Tam içerme: hedef metin kayıtta geçiyorsa tüm trigramları da geçer
+        if grams:
+            for pos, count in shared.items():
+                if count == len(grams) and target in self.texts[pos]:
+                    results[pos] = (substring_score, 1.0)
+        else:
+            for pos, text in enumerate(self.texts):
+                if target in text:
+                    results[pos] = (substring_score, 1.0)
+
+        # 2. Benzerlik: ratio = 2*M/(n+m) <= 2*min(n,m)/(n+m) olduğundan
+        # uzunluğu bu sınırın dışında kalan kayıtlar eşiği hiçbir zaman geçemez.
+        n = len(target)
+        min_len = n * min_similarity / (2 - min_similarity)
+        max_len = n * (2 - min_similarity) / min_similarity if min_similarity > 0 else float("inf")
+        if shortlist:
+            candidates = [
+                (count, -pos) for pos, count in shared.items()
+                if pos not in results and min_len <= len(self.texts[pos]) <= max_len
+            ]
+            candidates = [-neg_pos for _, neg_pos in heapq.nlargest(shortlist, candidates)]
+        else:
+            # Tam tarama: ortak trigramı olmayanlar dahil uzunluk sınırındaki tüm kayıtlar
+            candidates = [pos for pos, text in enumerate(self.texts)
+                          if pos not in results and min_len <= len(text) <= max_len]
+        for pos in candidates:
+            ratio = SequenceMatcher(None, target, self.texts[pos]).ratio()
+            if ratio > min_similarity:
+                results[pos] = (int(ratio * similarity_weight), ratio)
+
+        ranked = sorted(results.items(), key=lambda item: (-item[1][0], item[0]))[:top_k]
+        return [(score, ratio, pos) for pos, (score, ratio) in ranked]
+
+    def first_containing(self, name):
+        """İsmi (arama anahtarı olarak) içeren ilk kaydın sırasını döndürür, yoksa -1."""
+        target = fold_search_text(name or "")
+        grams = char_trigrams(target)
+        if not grams:
+            return next((pos for pos, text in enumerate(self.texts) if target in text), -1)
+        # Adaylar: en seyrek trigramı içeren kayıtlar (dosya sırasıyla)
+        rarest = min(grams, key=lambda g: len(self.postings.get(g, ())))
+        for pos in self.postings.get(rarest, ()):
+            if target in self.texts[pos]:
+                return pos
+        return -1
+
+def search_tax_db_by_name(product_name, top_k=5, min_similarity=TAX_NAME_MIN_SIMILARITY, snapshot=None):
+    """Vergi listesinde isme göre en benzer kayıtları puanlarıyla döndürür: [(puan, oran, kayıt)]."""
+    snapshot = snapshot or tax_db.snapshot()
+    trigram_index = snapshot.derived("trigram", TaxTrigramIndex)
+    return [
+        (score, ratio, snapshot.records[pos])
+        for score, ratio, pos in trigram_index.search(product_name, top_k=top_k, min_similarity=min_similarity)
+    ]
+
+def search_tax_db_smart(cas_no, product_name,
+                        min_similarity=TAX_NAME_MIN_SIMILARITY, min_score=TAX_NAME_MIN_SCORE, as_of=None):
     """
     Vergi listesinde CAS numarası veya Kimyasal isme göre arama yapar.
-    CAS numarası eşleşmesi önceliklidir.
+    CAS numarası eşleşmesi önceliklidir (CAS indeksi üzerinden kesin eşleşme).
+    as_of (date) verilirse o tarihte yürürlükte olan liste sürümünde arar.
     """
     if not os.path.exists(TAX_DB_FILE):
         return None
 
-    best_match = None
-    highest_score = 0
+    snapshot = get_tax_snapshot(as_of)
+    if snapshot is None:
+        return None
+    records = snapshot.records
+
+    # 1. KRİTER: CAS Numarası Eşleşmesi (Kesin Eşleşme)
+    # Vergi dosyasında genelde "CAS RN 111-76-2" yazar. "(848)" gibi kısa/hatalı değerler
+    # CAS formatına uymadığı için indekste aranmaz.
+    cas_record = lookup_tax_by_cas(cas_no, records, snapshot.cas_index)
+    if cas_record:
+        return cas_record
+
+    # 2. KRİTER: İsim Benzerliği (CAS yoksa veya bulunamadıysa) - Trigram indeksi ile
+    matches = search_tax_db_by_name(product_name, top_k=1, min_similarity=min_similarity, snapshot=snapshot)
+    if matches and matches[0][0] > min_score:
+        return matches[0][2]
+    return None
+
+# --- VERGİ TANIMLARI İÇİN BM25 TERİM İNDEKSİ ---
+TAX_CONTEXT_TOKEN_BUDGET = 1500   # Prompt'a eklenecek vergi bağlamının yaklaşık token sınırı
+TAX_CONTEXT_TOP_K = 15            # Her ürün için alınacak en alakalı satır sayısı
+
+def tokenize_tax_text(text, min_len=3):
+    """Metni arama anahtarı kelimelerine böler, çok kısa kelimeleri (ve, ile vb.) atar."""
+    return [w for w in re.findall(r'\w+', fold_search_text(text)) if len(w) >= min_len]
+
+def estimate_token_count(text):
+    """Kaba token tahmini (~4 karakter = 1 token). API çağrısı yapmadan bütçe hesabı için."""
+    return max(1, len(text) // 4)
+
+class TaxTermIndex:
+    """
+    Vergi tanımları ('tanim') üzerinde ters indeks. Sorgular BM25 ile puanlanır,
+    sadece sorgu terimlerini içeren satırlara dokunulur.
+    """
+    def __init__(self, records, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}      # terim -> [kayıt sırası]
+        self.term_freqs = {}    # terim -> [terim frekansı] (postings ile aynı sırada)
+        self.doc_lengths = []
+        for pos, rec in enumerate(records):
+            terms = tokenize_tax_text(rec.get("tanim", ""))
+            self.doc_lengths.append(len(terms))
+            counts = {}
+            for t in terms:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                self.postings.setdefault(t, []).append(pos)
+                self.term_freqs.setdefault(t, []).append(tf)
+        self.doc_count = len(self.doc_lengths)
+        self.avg_doc_length = (sum(self.doc_lengths) / self.doc_count) if self.doc_count else 0
+        self._expansions = {}
+
+    def to_state(self):
+        """Snapshot dosyası için sade (JSON'a yazılabilir) durum."""
+        return {
+            "k1": self.k1, "b": self.b,
+            "postings": pack_postings(self.postings),
+            "term_freqs": pack_postings(self.term_freqs),
+            "doc_lengths": array('I', self.doc_lengths),
+        }
 
-    # CAS Temizliği: (848) -> 848, boşlukları sil
-    clean_cas = str(cas_no).replace("(", "").replace(")", "").strip() if cas_no else ""
-    
-    # Eğer CAS numarası çok kısaysa (örn: "2", "3") hatalı eşleşmeyi önlemek için CAS araması yapma
-    is_valid_cas = len(clean_cas) > 4 and "-" in clean_cas
+    @classmethod
+    def from_state(cls, state):
+        index = cls.__new__(cls)
+        index.k1 = state["k1"]
+        index.b = state["b"]
+        index.postings = unpack_postings(state["postings"])
+        index.term_freqs = unpack_postings(state["term_freqs"])
+        index.doc_lengths = state["doc_lengths"]
+        index.doc_count = len(index.doc_lengths)
+        index.avg_doc_length = (sum(index.doc_lengths) / index.doc_count) if index.doc_count else 0
+        index._expansions = {}
+        return index
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def expand_term(self, term, partial_weight=0.5):
+        """
+        Sorgu terimini indeksteki terimlere genişletir: [(terim, ağırlık)].
+        Kimyasal isimler bitişik yazıldığı için (heksan -> dimetilheksan) 5+ harfli terimleri
+        İÇEREN kelimeler de düşük ağırlıkla alınır.
+        """
+        if term not in self._expansions:
+            expanded = [(term, 1.0)] if term in self.postings else []
+            if len(term) >= 5:
+                expanded += [(t, partial_weight) for t in self.postings if term in t and t != term]
+            self._expansions[term] = expanded
+        return self._expansions[term]
+
+    def search(self, query_terms, top_k=TAX_CONTEXT_TOP_K):
+        """Sorgu terimleri için en yüksek BM25 puanlı [(puan, kayıt sırası)] listesini döndürür."""
+        if not self.doc_count:
+            return []
+        scores = {}
+        index_terms = {}
+        for q in set(query_terms):
+            for term, weight in self.expand_term(q):
+                index_terms[term] = max(weight, index_terms.get(term, 0.0))
+        for term, weight in index_terms.items():
+            idf = self.idf(term) * weight
+            for pos, tf in zip(self.postings[term], self.term_freqs[term]):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[pos] / self.avg_doc_length)
+                scores[pos] = scores.get(pos, 0.0) + idf * (tf * (self.k1 + 1)) / (tf + norm)
+        return heapq.nlargest(top_k, ((score, pos) for pos, score in scores.items()))
+
+# --- DERLENMİŞ VERGİ LİSTESİ (SNAPSHOT) ---
+# JSONL değişim formatı olarak kalır. Yükleme sırasında yanına kolon bazlı (columnar) bir
+# snapshot yazılır; içinde hazır CAS / BM25 / trigram indeksleri bulunur.
+# Dosya yalnızca veri içerir (pickle değil): 1. satır JSON başlık (format, sürüm, kaynak imzası,
+# gövdenin SHA-256 özeti), kalanı JSON gövde; tamsayı dizileri base64 olarak saklanır.
+# Başlık/özet/imza tutmazsa veya okuma herhangi bir hata verirse snapshot yok sayılır, JSONL'den yeniden kurulur.
+TAX_SNAPSHOT_FORMAT = "gtip-vergi-snapshot"
+TAX_SNAPSHOT_VERSION = 3          # 3: pickle yerine JSON başlık + SHA-256 özetli JSON gövde
+TAX_RECORD_FIELDS = ["gtp", "tanim", "gv_oran", "dipnot", "gecerlilik"]
+
+def pack_postings(postings):
+    """{anahtar: [tamsayılar]} yapısını tek bir düz diziye (array) paketler; snapshot yüklemesi hızlanır."""
+    keys = list(postings)
+    offsets = array('I', [0])
+    values = array('I')
+    for key in keys:
+        values.extend(postings[key])
+        offsets.append(len(values))
+    return {"keys": keys, "offsets": offsets, "values": values}
+
+class PackedPostings:
+    """
+    pack_postings çıktısı üzerinde salt-okunur sözlük görünümü.
+    Listeler yükleme anında değil, erişildikçe diziden dilimlenir.
+    """
+    def __init__(self, packed):
+        self._slots = {key: i for i, key in enumerate(packed["keys"])}
+        self._offsets = packed["offsets"]
+        self._values = packed["values"]
+
+    def __getitem__(self, key):
+        i = self._slots[key]
+        return self._values[self._offsets[i]:self._offsets[i + 1]]
+
+    def get(self, key, default=None):
+        return self[key] if key in self._slots else default
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+def unpack_postings(packed):
+    return PackedPostings(packed)
+
+def get_tax_snapshot_path(jsonl_path):
+    return os.path.splitext(jsonl_path)[0] + ".snapshot"
+
+def records_to_columns(records):
+    """Kayıt listesini {alan: [değerler]} kolon yapısına çevirir. Eksik alanlar None olarak tutulur."""
+    fields = list(TAX_RECORD_FIELDS)
+    for rec in records:
+        for key in rec:
+            if key not in fields:
+                fields.append(key)
+    return {field: [rec.get(field) for rec in records] for field in fields}
+
+def columns_to_records(columns):
+    """records_to_columns işleminin tersi (None olan alanlar kayda eklenmez)."""
+    fields = list(columns)
+    count = len(columns[fields[0]]) if fields else 0
+    return [
+        {field: columns[field][i] for field in fields if columns[field][i] is not None}
+        for i in range(count)
+    ]
+
+def _encode_snapshot_value(value):
+    """array('I') gibi tamsayı dizilerini JSON'a yazılabilir {"__array__": tip, "b64": veri} biçimine çevirir."""
+    if isinstance(value, array):
+        return {"__array__": value.typecode, "b64": base64.b64encode(value.tobytes()).decode("ascii")}
+    if isinstance(value, dict):
+        return {key: _encode_snapshot_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode_snapshot_value(item) for item in value]
+    return value
+
+def _decode_snapshot_object(obj):
+    if "__array__" in obj and len(obj) == 2:
+        decoded = array(obj["__array__"])
+        decoded.frombytes(base64.b64decode(obj["b64"]))
+        return decoded
+    return obj
+
+def write_tax_snapshot(records, jsonl_path, signature, cas_index=None, index_states=None):
+    """
+    Kayıtları ve hazır arama indekslerini sürümlü snapshot dosyasına yazar (atomik).
+    index_states verilirse (patch_tax_indexes çıktısı) indeksler yeniden kurulmaz.
+    """
+    if index_states is None:
+        index_states = {
+            "cas": cas_index if cas_index is not None else build_tax_cas_index(records),
+            "bm25": TaxTermIndex(records).to_state(),
+            "trigram": TaxTrigramIndex(records).to_state(),
+        }
+    body = json.dumps(_encode_snapshot_value({
+        "columns": records_to_columns(records),
+        "indexes": index_states,
+    }), ensure_ascii=False).encode("utf-8")
+    header = {
+        "format": TAX_SNAPSHOT_FORMAT,
+        "version": TAX_SNAPSHOT_VERSION,
+        "source_signature": signature,
+        "byteorder": sys.byteorder,
+        "sha256": hashlib.sha256(body).hexdigest(),
+    }
+    snapshot_path = get_tax_snapshot_path(jsonl_path)
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(body)
+    os.replace(tmp_path, snapshot_path)
+
+def load_tax_snapshot(jsonl_path, signature):
+    """Snapshot güncelse TaxSnapshot döndürür; yoksa, eskiyse veya bozuksa None."""
+    snapshot_path = get_tax_snapshot_path(jsonl_path)
+    if not signature or not os.path.exists(snapshot_path):
+        return None
+    try:
+        with open(snapshot_path, 'rb') as f:
+            header = json.loads(f.readline())
+            if (header.get("format") != TAX_SNAPSHOT_FORMAT
+                    or header.get("version") != TAX_SNAPSHOT_VERSION
+                    or header.get("source_signature") != signature
+                    or header.get("byteorder") != sys.byteorder):
+                return None
+            body = f.read()
+        if hashlib.sha256(body).hexdigest() != header.get("sha256"):
+            print("Vergi snapshot özeti tutmuyor, JSONL kullanılacak.")
+            return None
+        payload = json.loads(body, object_hook=_decode_snapshot_object)
+        records = columns_to_records(payload["columns"])
+        indexes = payload["indexes"]
+        return TaxSnapshot(records, indexes["cas"], signature, derived={
+            "bm25": TaxTermIndex.from_state(indexes["bm25"]),
+            "trigram": TaxTrigramIndex.from_state(indexes["trigram"], records),
+        })
+    except Exception as e:
+        print(f"Vergi snapshot okunamadı, JSONL kullanılacak: {e}")
+        return None
+
+# --- SÜRÜMLÜ VERGİ LİSTESİ (DIFF İLE GÜNCELLEME) ---
+# Her yükleme bir sürüm olarak saklanır. Kayıtlar içerik hash'iyle tek bir havuzda (kayitlar.jsonl)
+# bir kez tutulur, sürüm dosyası sadece hash listesidir. Güncel liste değişince indeksler baştan
+# kurulmaz: sadece eklenen/değişen kayıtlar işlenir, kaldırılanlar indeksten düşülür.
+def record_content_hash(record):
+    """Kaydın alan sırasından bağımsız içerik hash'i."""
+    payload = json.dumps(record, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
-    target_name = product_name.lower().strip() if product_name else ""
+def list_content_hash(record_hashes):
+    """Listenin (kayıt sırası dahil) içerik hash'i. Aynı içerikli tekrar yüklemeleri tespit etmek için."""
+    return hashlib.sha256("\n".join(record_hashes).encode("utf-8")).hexdigest()
+
+def diff_tax_records(old_hashes, new_hashes):
+    """
+    İki sürümü içerik hash'leri üzerinden eşleştirir.
+    Dönüş: (pos_map, added_positions)
+      pos_map[eski sıra] = yeni sıra (kaldırıldıysa -1)
+      added_positions   = yeni listede karşılığı olmayan (yeni veya değişmiş) kayıtların sırası
+    """
+    available = {}
+    for old_pos in range(len(old_hashes) - 1, -1, -1):
+        available.setdefault(old_hashes[old_pos], []).append(old_pos)
+
+    pos_map = [-1] * len(old_hashes)
+    added_positions = []
+    for new_pos, h in enumerate(new_hashes):
+        candidates = available.get(h)
+        if candidates:
+            pos_map[candidates.pop()] = new_pos
+        else:
+            added_positions.append(new_pos)
+    return pos_map, added_positions
+
+def summarize_tax_diff(old_records, new_records, pos_map, added_positions):
+    """Fark özetini döndürür: eklenen / değişen (aynı GTP, farklı içerik) / kaldırılan kayıt sayıları."""
+    removed_gtps = {}
+    for old_pos, new_pos in enumerate(pos_map):
+        if new_pos < 0:
+            gtp = old_records[old_pos].get("gtp")
+            removed_gtps[gtp] = removed_gtps.get(gtp, 0) + 1
+    changed = 0
+    for new_pos in added_positions:
+        gtp = new_records[new_pos].get("gtp")
+        if removed_gtps.get(gtp):
+            removed_gtps[gtp] -= 1
+            changed += 1
+    return {
+        "added": len(added_positions) - changed,
+        "changed": changed,
+        "removed": sum(1 for p in pos_map if p < 0) - changed,
+    }
+
+def patch_postings(postings, pos_map, added_postings, keep_order, freqs=None, added_freqs=None):
+    """
+    Eski sürümün ters indeksini yeni sürüme taşır: kaldırılan kayıtlar düşülür, kalanların
+    sırası pos_map ile güncellenir, sadece eklenen kayıtların girdileri eklenir.
+    freqs verilirse (BM25 terim frekansları) postings ile paralel olarak taşınır.
+    Listeler dosya sırasında (artan) kalır.
+    """
+    new_postings = {}
+    new_freqs = {} if freqs is not None else None
+    for key in postings:
+        old_positions = postings[key]
+        if freqs is None:
+            moved = [pos_map[p] for p in old_positions if pos_map[p] >= 0]
+            if moved:
+                new_postings[key] = moved
+        else:
+            pairs = [(pos_map[p], tf) for p, tf in zip(old_positions, freqs[key]) if pos_map[p] >= 0]
+            if pairs:
+                new_postings[key] = [p for p, _ in pairs]
+                new_freqs[key] = [tf for _, tf in pairs]
+
+    for key, positions in added_postings.items():
+        new_postings.setdefault(key, []).extend(positions)
+        if new_freqs is not None:
+            new_freqs.setdefault(key, []).extend(added_freqs[key])
+
+    # Kalan kayıtların göreli sırası değişmediyse sadece ekleme yapılan listeler sıralanır
+    for key in (added_postings if keep_order else list(new_postings)):
+        positions = new_postings[key]
+        order = sorted(range(len(positions)), key=positions.__getitem__)
+        new_postings[key] = [positions[i] for i in order]
+        if new_freqs is not None:
+            new_freqs[key] = [new_freqs[key][i] for i in order]
+    return new_postings, new_freqs
+
+def patch_tax_indexes(base_snapshot, new_records, pos_map, added_positions):
+    """
+    Eski snapshot'ın CAS / BM25 / trigram indekslerini yeni kayıt listesine taşır.
+    Sadece eklenen kayıtlar tokenize edilir. Dönüş: write_tax_snapshot için indeks durumları.
+    """
+    kept = [p for p in pos_map if p >= 0]
+    keep_order = all(a < b for a, b in zip(kept, kept[1:]))
+    added_records = [new_records[p] for p in added_positions]
+
+    def to_global(postings):
+        return {key: [added_positions[i] for i in positions] for key, positions in postings.items()}
+
+    cas_index, _ = patch_postings(base_snapshot.cas_index, pos_map,
+                                  to_global(build_tax_cas_index(added_records)), keep_order)
+
+    old_terms = base_snapshot.derived("bm25", TaxTermIndex)
+    added_terms = TaxTermIndex(added_records, old_terms.k1, old_terms.b)
+    term_postings, term_freqs = patch_postings(
+        old_terms.postings, pos_map, to_global(added_terms.postings), keep_order,
+        freqs=old_terms.term_freqs, added_freqs=added_terms.term_freqs)
+    doc_lengths = array('I', [0]) * len(new_records)
+    for old_pos, new_pos in enumerate(pos_map):
+        if new_pos >= 0:
+            doc_lengths[new_pos] = old_terms.doc_lengths[old_pos]
+    for local_pos, new_pos in enumerate(added_positions):
+        doc_lengths[new_pos] = added_terms.doc_lengths[local_pos]
+
+    old_grams = base_snapshot.derived("trigram", TaxTrigramIndex)
+    added_grams = TaxTrigramIndex(added_records)
+    gram_postings, _ = patch_postings(old_grams.postings, pos_map, to_global(added_grams.postings), keep_order)
+    gram_texts = [None] * len(new_records)
+    for old_pos, new_pos in enumerate(pos_map):
+        if new_pos >= 0:
+            gram_texts[new_pos] = old_grams.texts[old_pos]
+    for local_pos, new_pos in enumerate(added_positions):
+        gram_texts[new_pos] = added_grams.texts[local_pos]
+
+    return {
+        "cas": cas_index,
+        "bm25": {
+            "k1": old_terms.k1, "b": old_terms.b,
+            "postings": pack_postings(term_postings),
+            "term_freqs": pack_postings(term_freqs),
+            "doc_lengths": doc_lengths,
+        },
+        "trigram": {"texts": gram_texts, "postings": pack_postings(gram_postings)},
+    }
 
-    with open(TAX_DB_FILE, 'r', encoding='utf-8') as f:
-        for line in f:
+class TaxVersionStore:
+    """
+    Vergi listesi sürüm geçmişi (manifest.json + sürüm başına hash listesi + ortak kayıt havuzu).
+    Aynı içerikli kayıt bellekte tek nesnedir: havuzdan kurulan sürümler havuz nesnelerini kullanır,
+    güncel liste (tax_db) de share_records ile aynı nesnelere bağlanır. Havuz güncel listeden sonra
+    okunursa güncel listenin nesnelerini benimser; böylece hangisi önce yüklenirse yüklensin kayıt iki kez tutulmaz.
+    Geçmiş tarihli sorgular için sürümler ilk ihtiyaçta TaxSnapshot olarak kurulur.
+    Manifest, dosya imzası (boyut + mtime) değişmedikçe diskten yeniden okunmaz.
+    """
+    MAX_CACHED_SNAPSHOTS = 4
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.pool_path = os.path.join(directory, "kayitlar.jsonl")
+        self._lock = Lock()
+        self._pool = None         # hash -> kayıt (ilk ihtiyaçta okunur)
+        self._shared = {}         # hash -> güncel listenin kayıt nesnesi (Havuz okunurken benimsenir)
+        self._snapshots = {}      # sürüm no -> TaxSnapshot
+        self._manifest = None     # (dosya imzası, manifest) - son okunan/yazılan
+        self.manifest_reads = 0   # Diskten manifest okuma sayısı
+
+    # --- Disk işlemleri ---
+    @staticmethod
+    def _copy_manifest(manifest):
+        # Çağıranlar sürüm listesine ekleme yapar; önbellekteki nesne kaydedilene kadar değişmemeli
+        return {**manifest, "versions": [dict(v) for v in manifest["versions"]]}
+
+    def _load_manifest(self):
+        signature = get_file_signature(self.manifest_path)
+        if signature is None:
+            return {"versions": []}
+        if self._manifest is not None and self._manifest[0] == signature:
+            return self._copy_manifest(self._manifest[1])
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.manifest_reads += 1
+        except Exception as e:
+            print(f"Sürüm manifesti okunamadı: {e}")
+            return {"versions": []}
+        self._manifest = (signature, manifest)
+        return self._copy_manifest(manifest)
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest = (get_file_signature(self.manifest_path), self._copy_manifest(manifest))
+
+    def _version_path(self, version_id):
+        return os.path.join(self.directory, f"v{version_id:04d}.json")
+
+    def _load_pool(self):
+        if self._pool is None:
+            self._pool = {}
+            if os.path.exists(self.pool_path):
+                with open(self.pool_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            self._pool[entry["h"]] = self._shared.get(entry["h"], entry["r"])
+                        except: continue
+        return self._pool
+
+    def _load_hashes(self, version):
+        with open(self._version_path(version["id"]), 'r', encoding='utf-8') as f:
+            return json.load(f)["hashes"]
+
+    def _bootstrap(self, manifest):
+        """Sürüm geçmişi yokken mevcut vergi_listesi.jsonl dosyasını 1. sürüm olarak kaydeder."""
+        if manifest["versions"] or not os.path.exists(TAX_DB_FILE):
+            return
+        meta = {}
+        if os.path.exists(TAX_META_FILE):
             try:
-                record = json.loads(line)
-                desc = record.get("tanim", "").lower()
-                gtp = record.get("gtp", "")
-                
-                score = 0
-                
-                # 1. KRİTER: CAS Numarası Eşleşmesi (Kesin Eşleşme)
-                # Vergi dosyasında genelde "CAS RN 111-76-2" yazar. 
-                if is_valid_cas and clean_cas in desc:
-                    score += 100 
-                
-                # 2. KRİTER: İsim Benzerliği (CAS yoksa veya bulunamadıysa)
-                elif target_name:
-                    # Tam eşleşme kontrolü
-                    if target_name in desc:
-                         score += 60
-                    else:
-                        # SequenceMatcher yavaş olabilir, basit string kontrolü daha hızlıdır toplu işlemde
-                        # Ancak yine de yüksek benzerlik için tutuyoruz
-                        match_ratio = SequenceMatcher(None, target_name, desc).ratio()
-                        if match_ratio > 0.75: # %75 üzeri benzerlik
-                            score += int(match_ratio * 50)
-                
-                if score > highest_score and score > 50: 
-                    highest_score = score
-                    best_match = record
-                    # CAS bulduysak döngüyü kırabiliriz, en kesin bilgi odur
-                    if score >= 100: 
-                        break
+                with open(TAX_META_FILE, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except: pass
+        try:
+            valid_from = datetime.strptime(meta.get("upload_date", ""), "%d.%m.%Y %H:%M").date()
+        except ValueError:
+            valid_from = datetime.fromtimestamp(os.path.getmtime(TAX_DB_FILE)).date()
+        self._add(manifest, load_tax_records(TAX_DB_FILE), meta.get("filename", os.path.basename(TAX_DB_FILE)), valid_from)
+
+    def _add(self, manifest, records, filename, valid_from):
+        pool = self._load_pool()
+        hashes = [record_content_hash(rec) for rec in records]
+        new_entries = {}
+        for h, rec in zip(hashes, records):
+            if h not in pool and h not in new_entries:
+                new_entries[h] = rec
+
+        os.makedirs(self.directory, exist_ok=True)
+        if new_entries:
+            with open(self.pool_path, 'a', encoding='utf-8') as f:
+                for h, rec in new_entries.items():
+                    f.write(json.dumps({"h": h, "r": rec}, ensure_ascii=False) + "\n")
+            pool.update(new_entries)
+
+        version = {
+            "id": max([v["id"] for v in manifest["versions"]], default=0) + 1,
+            "filename": filename,
+            "upload_date": datetime.now().strftime("%d.%m.%Y %H:%M"),
+            "valid_from": valid_from.isoformat(),
+            "content_hash": list_content_hash(hashes),
+            "total_records": len(records),
+        }
+        with open(self._version_path(version["id"]), 'w', encoding='utf-8') as f:
+            json.dump({"hashes": hashes}, f)
+        manifest["versions"].append(version)
+        self._save_manifest(manifest)
+        return version, hashes
 
-            except: continue
-            
-    return best_match
+    def share_records(self, records):
+        """
+        Güncel listenin kayıtlarını havuzla paylaştırır (tax_db yüklenirken çağrılır).
+        Havuz yüklüyse aynı içerikli kayıtlar havuzdaki nesnelerle değiştirilir; yüklü değilse
+        nesneler hatırlanır ve havuz okunurken kendi kopyası yerine bunlar kullanılır.
+        """
+        hashes = [record_content_hash(rec) for rec in records]
+        with self._lock:
+            if self._pool is not None:
+                records = [self._pool.get(h, rec) for h, rec in zip(hashes, records)]
+            else:
+                records = list(records)
+            self._shared = dict(zip(hashes, records))
+        return records
+
+    # --- Sorgular ---
+    @staticmethod
+    def _find(manifest, as_of):
+        """as_of tarihinde yürürlükte olan sürüm (Aynı tarihte birden fazla varsa son yüklenen)."""
+        as_of_text = as_of.isoformat()
+        valid = [v for v in manifest["versions"] if v["valid_from"] <= as_of_text]
+        return max(valid, key=lambda v: (v["valid_from"], v["id"])) if valid else None
+
+    def list_versions(self):
+        with self._lock:
+            manifest = self._load_manifest()
+            self._bootstrap(manifest)
+            return list(manifest["versions"])
+
+    def find_version(self, as_of=None):
+        with self._lock:
+            manifest = self._load_manifest()
+            self._bootstrap(manifest)
+            return self._find(manifest, as_of or datetime.now().date())
+
+    def version_records(self, version):
+        """Sürümün kayıtlarını sırasıyla döndürür (Havuzdaki ortak nesneler)."""
+        with self._lock:
+            pool = self._load_pool()
+            return [pool[h] for h in self._load_hashes(version)]
+
+    def snapshot_for(self, version):
+        """Geçmiş bir sürümün TaxSnapshot'ı (İndeksler ilk ihtiyaçta kurulur)."""
+        with self._lock:
+            cached = self._snapshots.get(version["id"])
+        if cached is not None:
+            return cached
+        records = self.version_records(version)
+        snapshot = TaxSnapshot(records, build_tax_cas_index(records), ["surum", version["id"]])
+        with self._lock:
+            if len(self._snapshots) >= self.MAX_CACHED_SNAPSHOTS:
+                self._snapshots.pop(next(iter(self._snapshots)))
+            self._snapshots[version["id"]] = snapshot
+        return snapshot
+
+    # --- Yükleme ---
+    def add_version(self, records, filename, valid_from):
+        """
+        Listeyi yeni sürüm olarak ekler. Dönüş: (sürüm, fark özeti, kayıtlar).
+        İçerik, yürürlük tarihindeki sürümle aynıysa hiçbir şey yazılmaz, fark özeti None döner.
+        Dönen kayıt listesinde değişmeyen kayıtlar havuzdaki mevcut nesnelerdir.
+        """
+        with self._lock:
+            manifest = self._load_manifest()
+            self._bootstrap(manifest)
+            base = self._find(manifest, valid_from)
+            hashes = [record_content_hash(rec) for rec in records]
+            if base is not None and base["content_hash"] == list_content_hash(hashes):
+                return base, None, None
+
+            if base is not None:
+                base_hashes = self._load_hashes(base)
+                base_records = [self._load_pool()[h] for h in base_hashes]
+                pos_map, added_positions = diff_tax_records(base_hashes, hashes)
+                diff = summarize_tax_diff(base_records, records, pos_map, added_positions)
+            else:
+                diff = {"added": len(records), "changed": 0, "removed": 0}
+
+            version, _ = self._add(manifest, records, filename, valid_from)
+            version.update(diff)
+            self._save_manifest(manifest)
+            pool = self._load_pool()
+            return version, diff, [pool[h] for h in hashes]
+
+def get_tax_snapshot(as_of=None):
+    """
+    İstenen tarihte yürürlükte olan listenin snapshot'ı. as_of verilmezse güncel liste.
+    O tarihte yürürlükte liste yoksa None döner.
+    """
+    if as_of is None:
+        return tax_db.snapshot()
+    version = tax_versions.find_version(as_of)
+    if version is None:
+        return None
+    active = tax_versions.find_version()
+    if active is not None and active["id"] == version["id"]:
+        return tax_db.snapshot()
+    return tax_versions.snapshot_for(version)
+
+# --- GEÇERLİLİK DURUMU: GÜNLÜK HAZIR GÖRÜNÜM ---
+def build_tax_expiry_view(records, today):
+    """
+    Tüm kayıtların rapor tarih metnini ve süresi dolmuş / 365 gün içinde dolacak
+    kayıtların listesini bir kez hesaplar (Günde bir yenilenir).
+    """
+    displays = []
+    expiring = []    # (tarih, kayıt sırası) - tarihe göre sıralı
+    for pos, rec in enumerate(records):
+        raw_date = rec.get("gecerlilik", "-")
+        expiry = parse_review_date(raw_date) if raw_date and str(raw_date) not in ("nan", "-") else None
+        if expiry is None:
+            displays.append(check_tax_date_warning(raw_date))
+            continue
+        displays.append(format_review_date_status(expiry, today))
+        if (expiry - today).days <= TAX_EXPIRY_WARNING_DAYS:
+            expiring.append((expiry, pos))
+    expiring.sort()
+    return {
+        "date": today,
+        "displays": displays,
+        "expiring": expiring,
+        # İçerik hash'i -> kayıt sırası (Nesne kimliğine bağlı değil; aynı içerikli kopyalar da bulunur)
+        "positions_by_hash": {record_content_hash(rec): pos for pos, rec in reversed(list(enumerate(records)))},
+    }
+
+def get_tax_expiry_view(snapshot=None):
+    """
+    Snapshot'a ait günlük geçerlilik görünümünü döndürür; gün değiştiyse yeniden hesaplar.
+    Görünüm snapshot'a bağlı bir kilitle okunur/değiştirilir (Aynı snapshot worker thread'lerinden paylaşılır).
+    """
+    snapshot = snapshot or tax_db.snapshot()
+    today = datetime.now().date()
+    holder = snapshot.derived("expiry_view", lambda records: {"lock": Lock(), "view": None})
+    with holder["lock"]:
+        view = holder["view"]
+        if view is None or view["date"] != today:
+            view = build_tax_expiry_view(snapshot.records, today)
+            holder["view"] = view
+        return view
+
+def tax_validity_display(record, snapshot=None):
+    """Kaydın tarih/uyarı metnini hazır görünümden alır (Tarih ayrıştırma yapılmaz)."""
+    snapshot = snapshot or tax_db.snapshot()
+    view = get_tax_expiry_view(snapshot)
+    pos = view["positions_by_hash"].get(record_content_hash(record))
+    if pos is not None:
+        return view["displays"][pos]
+    return check_tax_date_warning(record.get("gecerlilik"))
 
 # --- YARDIMCI FONKSİYON: GEMINI BATCH ANALİZİ ---
 # --- YENİ YARDIMCI: AKILLI BAĞLAM FİLTRESİ (PRE-FILTER) ---
-def get_smart_tax_context(batch_products, full_tax_db_path):
+def get_smart_tax_context(batch_products, full_tax_db_path, token_budget=TAX_CONTEXT_TOKEN_BUDGET):
     """
     2000 satırlık listeyi her seferinde göndermek yerine,
-    sadece ürün isimleriyle kelime bazlı eşleşen vergi satırlarını seçer.
-    Böylece prompt boyutu %95 azalır.
+    her ürün için BM25 ile en alakalı vergi satırlarını seçer.
+    Ürünlerin sıralı listeleri sırayla harmanlanır (en alakalılar önce) ve
+    toplam bağlam token bütçesini aşmayacak şekilde kesilir.
     """
     if not os.path.exists(full_tax_db_path):
         return ""
 
-    # 1. Batch içindeki tüm ürünlerin isminden ANAHTAR KELİMELERİ çıkar
-    search_keywords = set()
+    # Paylaşılan bellek içi liste ve önceden kurulmuş terim indeksi kullanılır.
+    # Not: Eşleştirme kaydın ham JSON satırında değil, yalnızca 'tanim' alanında yapılır
+    # (GTIP kodu, tarih vb. alanlardaki rakam/kelimeler artık ürün kelimeleriyle eşleşmez).
+    snapshot = get_tax_database(full_tax_db_path).snapshot()
+    term_index = snapshot.derived("bm25", TaxTermIndex)
+
+    # 1. Her ürün için ayrı sıralı liste çıkar (Ürün adı + bileşen isimleri)
+    ranked_lists = []
     for prod in batch_products:
-        # Ürün adı ve bileşen isimlerini birleştir
-        text_blob = f"{prod['name']} {' '.join(prod['ingredients'])}".lower()
-        # Alfanümerik olmayanları sil, kelimelere ayır
-        words = re.findall(r'\w+', text_blob)
+        text_blob = f"{prod['name']} {' '.join(prod['ingredients'])}"
         # 3 harften kısa kelimeleri (ve, ile, vb.) ele
-        search_keywords.update([w for w in words if len(w) > 3])
+        query_terms = tokenize_tax_text(text_blob, min_len=4)
+        if query_terms:
+            ranked_lists.append(term_index.search(query_terms))
 
+    # 2. Listeleri sırayla harmanla: önce her ürünün 1. sonucu, sonra 2. sonucu...
     relevant_lines = []
-    
-    # 2. Vergi listesini tara: Anahtar kelimelerden HERHANGİ BİRİ geçiyor mu?
-    try:
-        with open(full_tax_db_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line_lower = line.lower()
-                # Eğer vergi satırında, ürünün anahtar kelimelerinden biri geçiyorsa al
-                if any(k in line_lower for k in search_keywords):
-                    rec = json.loads(line)
-                    relevant_lines.append(f"- {rec.get('tanim')} (GTIP: {rec.get('gtp')})")
-    except:
-        pass
-    
+    seen = set()
+    used_tokens = 0
+    for rank in range(max((len(r) for r in ranked_lists), default=0)):
+        for ranked in ranked_lists:
+            if rank >= len(ranked):
+                continue
+            pos = ranked[rank][1]
+            if pos in seen:
+                continue
+            seen.add(pos)
+            rec = snapshot.records[pos]
+            line = f"- {rec.get('tanim')} (GTIP: {rec.get('gtp')})"
+            line_tokens = estimate_token_count(line)
+            if used_tokens + line_tokens > token_budget:
+                continue
+            used_tokens += line_tokens
+            relevant_lines.append(line)
+
     # Eğer hiç eşleşme bulamazsa boş dönmesin, AI şaşırır.
     # En azından "Genel kimyasallar" uyarısı ekleyelim veya boş bırakalım.
     if not relevant_lines:
         return "Bu ürün grubu için özel bir vergi kaydı bulunamadı. Genel kimya bilginle yorumla."
-    
-    # Çok fazla eşleşme varsa (örn: 'Asit' kelimesi 500 yerde geçiyorsa) limiti sınırla
-    return "\n".join(relevant_lines[:50]) # Maksimum 50 en alakalı satır gönder
+
+    return "\n".join(relevant_lines)
+
+# --- VERGİ ANALİZ RAPORU: BİRLEŞTİRME (JOIN) ADIMLARI ---
+TAX_REPORT_COLUMNS = [
+    "MALZEME KODU", "ÜRÜN ADI", "BİLEŞEN", "CAS NO", "ORAN (%)", "VERGİ DURUMU",
+    "G.T.İ.P.", "VERGİ ORANI", "GEÇERLİLİK TARİHİ", "VERGİ TANIMI"
+]
+
+def _series_as_clean_str(series):
+    """Sütunu eski str(değer).strip() davranışıyla string'e çevirir (Boş hücre -> 'nan')."""
+    return series.astype(object).where(series.notna(), "nan").astype(str).str.strip()
+
+def match_ingredients_to_tax(df_ing, cols, tax_snapshot, order_offset=0, only_codes=None):
+    """
+    Bileşen satırlarını ('*' tipli) vergi kayıtlarıyla eşleştirir.
+    Çıktı kolonları: code, cas, name, pct, ing_order, tax_pos (-1 = eşleşme yok).
+    only_codes verilirse sadece o ürün kodlarına ait satırlar tutulur (akışlı okuma için).
+    """
+    ing = pd.DataFrame({
+        "code": _series_as_clean_str(df_ing[cols["product"]]),
+        "type": _series_as_clean_str(df_ing[cols["type"]]),
+        "cas": _series_as_clean_str(df_ing[cols["cas"]]),
+        "name": _series_as_clean_str(df_ing[cols["desc"]]),
+        "pct": _series_as_clean_str(df_ing[cols["pct"]]),
+    })
+    # Sıra numarası filtreden önce verilir; parçalar arasında da artan kalır
+    ing["ing_order"] = range(order_offset, order_offset + len(ing))
+    keep = ing["type"].str.contains("*", regex=False)
+    if only_codes is not None:
+        keep &= ing["code"].isin(only_codes)
+    ing = ing[keep].drop(columns="type")
+
+    # CAS anahtarı ile vergi kaydı birleştirmesi (Hücredeki ilk indeks eşleşmesi alınır)
+    clean_cas = ing["cas"].str.replace("(", "", regex=False).str.replace(")", "", regex=False).str.strip()
+    ing["tax_pos"] = -1
+    cas_candidates = clean_cas[clean_cas.str.len() > 4]
+    if len(cas_candidates) and tax_snapshot.cas_index:
+        tokens = cas_candidates.str.extractall(CAS_NUMBER_PATTERN)[0].rename("cas_key").reset_index()
+        cas_keys = tax_snapshot.derived("cas_key_frame", lambda records: pd.DataFrame({
+            "cas_key": list(tax_snapshot.cas_index.keys()),
+            "cas_pos": [positions[0] for positions in tax_snapshot.cas_index.values()],
+        }))
+        hits = tokens.merge(cas_keys, on="cas_key", how="inner")
+        if len(hits):
+            first_hits = hits.sort_values(["level_0", "match"]).groupby("level_0")["cas_pos"].first()
+            ing.loc[first_hits.index, "tax_pos"] = first_hits.values
+
+    # CAS ile bulunamayanlar için isim araması (Tekil isimler üzerinden, ilk içeren kayıt)
+    name_lower = ing["name"].map(fold_search_text)
+    needs_name = (ing["tax_pos"] < 0) & (name_lower.str.len() > 3)
+    if needs_name.any():
+        trigram_index = tax_snapshot.derived("trigram", TaxTrigramIndex)
+        name_hits = {name: trigram_index.first_containing(name) for name in name_lower[needs_name].unique()}
+        ing.loc[needs_name, "tax_pos"] = name_lower[needs_name].map(name_hits).fillna(-1).astype(int)
+
+    return ing
+
+def join_orders_with_ingredients(df_orders, cols, ing_matched, tax_snapshot):
+    """
+    Sipariş satırlarını eşleşmiş bileşenlerle birleştirip rapor satırlarını üretir.
+    Sipariş sırası, sonra bileşen sırası korunur. Çıktı: (rapor DataFrame'i, eşleşme sayısı)
+    """
+    records = tax_snapshot.records
+    expiry_view = get_tax_expiry_view(tax_snapshot)
+    orders = pd.DataFrame({
+        "MALZEME KODU": _series_as_clean_str(df_orders[cols["order"]]),
+        "ÜRÜN ADI": (_series_as_clean_str(df_orders["Malzeme Tanım"]) if "Malzeme Tanım" in df_orders.columns
+                     else pd.Series("", index=df_orders.index)),
+    })
+    orders["order_idx"] = range(len(orders))
+    joined = orders.merge(ing_matched, left_on="MALZEME KODU", right_on="code", how="left")
+    joined = joined.sort_values(["order_idx", "ing_order"], kind="stable").reset_index(drop=True)
+
+    # Vergi kaydı kolonları: sadece eşleşen TEKİL kayıtlar için (tarih durumu günlük görünümden okunur)
+    joined["tax_pos"] = joined["tax_pos"].fillna(-1).astype(int)
+    matched_positions = joined.loc[joined["tax_pos"] >= 0, "tax_pos"].unique()
+    tax_cols = pd.DataFrame({
+        "tax_pos": matched_positions,
+        "G.T.İ.P.": [records[p].get("gtp", "-") for p in matched_positions],
+        "VERGİ ORANI": [f"%{records[p].get('gv_oran', '0')}" for p in matched_positions],
+        "GEÇERLİLİK TARİHİ": [expiry_view["displays"][p] for p in matched_positions],
+        "VERGİ TANIMI": [records[p].get("tanim", "") for p in matched_positions],
+    })
+    joined = joined.merge(tax_cols, on="tax_pos", how="left")
+
+    has_ingredient = joined["code"].notna()
+    has_record = joined["tax_pos"] >= 0
+    joined["VERGİ DURUMU"] = "ESLESME YOK"
+    joined.loc[has_record, "VERGİ DURUMU"] = "⚠️ VERGİ LİSTESİNDE"
+    for col in ["G.T.İ.P.", "VERGİ ORANI", "GEÇERLİLİK TARİHİ", "VERGİ TANIMI"]:
+        joined[col] = joined[col].where(has_record, "-")
+    joined = joined.rename(columns={"name": "BİLEŞEN", "cas": "CAS NO", "pct": "ORAN (%)"})
+
+    # Bileşen listesinde olmayan ürünler
+    missing = ~has_ingredient
+    joined.loc[missing, "BİLEŞEN"] = "LİSTEDE YOK"
+    joined.loc[missing, ["CAS NO", "G.T.İ.P.", "VERGİ DURUMU"]] = "-"
+    joined.loc[missing, ["ORAN (%)", "VERGİ ORANI", "GEÇERLİLİK TARİHİ", "VERGİ TANIMI"]] = None
+
+    return joined[TAX_REPORT_COLUMNS], int(has_record.sum())
+
+def build_tax_report_vectorized(df_orders, df_ing, cols, tax_snapshot):
+    """
+    Sipariş x Bileşen x Vergi kaydı birleştirmesini pandas merge/groupby ile yapar.
+    Vergi araması satır başına değil, TEKİL CAS / isim başına bir kez yapılır.
+    Çıktı: (rapor DataFrame'i, vergi eşleşmesi sayısı)
+    """
+    ing_matched = match_ingredients_to_tax(df_ing, cols, tax_snapshot)
+    return join_orders_with_ingredients(df_orders, cols, ing_matched, tax_snapshot)
+
+# --- BÜYÜK DOSYALAR İÇİN AKIŞLI (STREAMING) OKUMA ---
+TAX_STREAM_CHUNK_ROWS = 5000                      # Her parçada işlenecek satır sayısı
+TAX_STREAM_MIN_FILE_BYTES = 5 * 1024 * 1024       # Bu boyutu aşan yüklemeler parça parça okunur
+
+def iter_table_chunks(path, chunk_rows=None, csv_sep=","):
+    """
+    Excel (openpyxl read-only) veya CSV dosyasını sabit boyutlu DataFrame parçaları halinde okur.
+    Değerler pd.read_excel(dtype=str) gibi string'e çevrilir, boş hücreler NaN kalır.
+    Bellekte aynı anda en fazla bir parça tutulur.
+    """
+    chunk_rows = chunk_rows or TAX_STREAM_CHUNK_ROWS
+    workbook = None
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except Exception:
+        workbook = None
+
+    if workbook is not None:
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(c).strip() if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+            width = len(columns)
+            buffer = []
+            for row in rows:
+                if all(v is None for v in row):
+                    continue
+                values = [None if v is None else str(v) for v in row[:width]]
+                values += [None] * (width - len(values))
+                buffer.append(values)
+                if len(buffer) >= chunk_rows:
+                    yield pd.DataFrame(buffer, columns=columns, dtype=object)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=columns, dtype=object)
+        finally:
+            workbook.close()
+        return
+
+    # Excel değilse CSV olarak parça parça oku (sep=None -> ayırıcıyı otomatik bul)
+    csv_kwargs = {"sep": None, "engine": "python"} if csv_sep is None else {"sep": csv_sep}
+    for chunk in pd.read_csv(path, dtype=str, chunksize=chunk_rows, **csv_kwargs):
+        chunk.columns = chunk.columns.str.strip()
+        yield chunk
+
+def detect_tax_analysis_columns(order_columns, ing_columns):
+    """Sipariş ve bileşen dosyalarındaki kolon adlarını bulur (Malzeme / Product code / CAS / Type / Percent)."""
+    return {
+        "order": next((c for c in order_columns if "Malzeme" in c), None),
+        "product": next((c for c in ing_columns if "Product code" in c), None),
+        "type": next((c for c in ing_columns if "Type" in c), None),
+        "cas": next((c for c in ing_columns if "CAS" in c), None),
+        "desc": next((c for c in ing_columns if "Standard description" in c), None),
+        "pct": next((c for c in ing_columns if "Percent" in c), None),
+    }
+
+def run_tax_analysis_streaming(order_path, ing_path, tax_snapshot, output_path, progress=None):
+    """
+    Büyük sipariş/bileşen dosyalarını sabit boyutlu parçalarla işler ve raporu
+    openpyxl write-only modunda satır satır yazar. Bellekte sadece siparişte geçen
+    ürünlere ait bileşenler ve o anki parça tutulur.
+    Bellek sınırı: sipariş/bileşen SATIR sayısından bağımsızdır, ancak iki yapı dosyayla değil ürün
+    kataloğuyla büyür: siparişteki TEKİL ürün kodları kümesi ve bu ürünlerin bileşen satırları
+    (ürün başına birkaç satır). Tutulan miktar işlem günlüğüne yazılır.
+    Çıktı: (log_html, sipariş satırı sayısı, eşleşme sayısı, rapor satırı sayısı) veya kolon hatasında None.
+    """
+    def report(done_rows, stage):
+        if progress is not None:
+            progress((done_rows, None), desc=f"{stage}: {done_rows} satır işlendi", unit="satır")
+
+    log_html = f"📥 Akışlı mod: dosyalar {TAX_STREAM_CHUNK_ROWS} satırlık parçalarla okunuyor.<br>"
+
+    # 1. Sipariş kodları (Sadece kod kümesi tutulur)
+    order_codes = set()
+    order_columns = None
+    done = 0
+    for chunk in iter_table_chunks(order_path, csv_sep=None):
+        order_columns = order_columns or list(chunk.columns)
+        order_col = next((c for c in order_columns if "Malzeme" in c), None)
+        if not order_col:
+            return None
+        order_codes.update(_series_as_clean_str(chunk[order_col]))
+        done += len(chunk)
+        report(done, "Sipariş listesi")
+
+    # 2. Bileşenler: parça parça eşleştir, sadece siparişte geçen ürünleri tut
+    cols = None
+    matched_parts = []
+    done = 0
+    for chunk_no, chunk in enumerate(iter_table_chunks(ing_path), start=1):
+        if cols is None:
+            cols = detect_tax_analysis_columns(order_columns or [], list(chunk.columns))
+            if not cols["order"] or not cols["product"]:
+                return None
+        matched_parts.append(match_ingredients_to_tax(chunk, cols, tax_snapshot, order_offset=done, only_codes=order_codes))
+        done += len(chunk)
+        report(done, "Bileşen listesi")
+        log_html += f"• Bileşen parçası {chunk_no}: {done} satır okundu.<br>"
+    if cols is None:
+        return None
+
+    ing_matched = pd.concat(matched_parts, ignore_index=True) if matched_parts else match_ingredients_to_tax(
+        pd.DataFrame(columns=[cols["product"], cols["type"], cols["cas"], cols["desc"], cols["pct"]]), cols, tax_snapshot)
+    log_html += f"🧮 Bellekte tutulan: {len(order_codes)} tekil ürün kodu, {len(ing_matched)} bileşen satırı.<br>"
+
+    # 3. Siparişleri tekrar parça parça oku, raporu satır satır yaz
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(TAX_REPORT_COLUMNS)
+    order_count, matched_count, report_rows = 0, 0, 0
+    for chunk in iter_table_chunks(order_path, csv_sep=None):
+        part, part_matched = join_orders_with_ingredients(chunk, cols, ing_matched, tax_snapshot)
+        for values in part.astype(object).where(part.notna(), None).itertuples(index=False, name=None):
+            sheet.append(list(values))
+        order_count += len(chunk)
+        matched_count += part_matched
+        report_rows += len(part)
+        report(order_count, "Rapor")
+    workbook.save(output_path)
+
+    return log_html, order_count, matched_count, report_rows
 
 # --- GÜNCELLENMİŞ AI FONKSİYONU ---
 # --- YENİ EKLENECEK FONKSİYON: EXCEL TABANLI ANALİZ ---
 # --- OPTİMİZE EDİLMİŞ VERGİ ANALİZ FONKSİYONU ---
-def process_tax_analysis_structured(order_file, ingredients_file):
+def process_tax_analysis_structured(order_file, ingredients_file, as_of_text="", progress=gr.Progress()):
     """
     HIZLI VERSİYON (GÜNCELLENDİ): 
     - Regex ile kesin CAS eşleşmesi yapar (Örn: 77-99-6 ararken 157577-99-6'yı bulmaz).
+    - Analiz tarihi girilirse o tarihte yürürlükte olan liste sürümü kullanılır.
+    - Gruplama ve sipariş/vergi birleştirmesi pandas merge ile vektörel yapılır.
+    - Büyük dosyalar (TAX_STREAM_MIN_FILE_BYTES üzeri) sabit boyutlu parçalarla akışlı işlenir.
     - Geçerlilik tarihi 1 yıldan az ise kırmızı uyarı ekler.
     - Dosya ismine okunabilir tarih/saat ekler.
     """
@@ -283,17 +1904,43 @@ def process_tax_analysis_structured(order_file, ingredients_file):
     
     try:
         # --- ADIM 0: VERGİ LİSTESİNİ HAFIZAYA YÜKLEME (CACHE) ---
-        tax_list_linear = []     # Düz liste
-        
-        if os.path.exists(TAX_DB_FILE):
-            with open(TAX_DB_FILE, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        rec = json.loads(line)
-                        tax_list_linear.append(rec) 
-                    except: continue
-        
-        log_buffer += f"✅ Vergi Veritabanı Önbelleğe Alındı ({len(tax_list_linear)} kayıt).<br>"
+        # Liste süreç genelinde bellekte tutulur, dosya değişmedikçe yeniden okunmaz.
+        as_of = None
+        if as_of_text and str(as_of_text).strip():
+            as_of = parse_review_date(as_of_text)
+            if as_of is None:
+                return f"⚠️ Analiz tarihi anlaşılamadı: '{as_of_text}' (Örn: 15.01.2023)", None
+        tax_snapshot = get_tax_snapshot(as_of)
+        if tax_snapshot is None:
+            return f"❌ {as_of.strftime('%d.%m.%Y')} tarihinde yürürlükte olan bir vergi listesi sürümü yok.", None
+
+        log_buffer += f"✅ Vergi Veritabanı Önbelleğe Alındı ({len(tax_snapshot.records)} kayıt, {format_tax_db_stats()}).<br>"
+        if as_of is not None:
+            version = tax_versions.find_version(as_of)
+            log_buffer += f"📅 {as_of.strftime('%d.%m.%Y')} tarihli liste: v{version['id']} ({version['filename']}, yürürlük {version['valid_from']})<br>"
+
+        # --- DEĞİŞİKLİK BURADA: Okunabilir Tarih/Saat ---
+        tarih_saat = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output_filename = f"Vergi_Analiz_Raporu_{tarih_saat}.xlsx"
+        output_path = os.path.join(BASE_DIR, output_filename)
+        # -----------------------------------------------
+
+        # --- BÜYÜK DOSYA: AKIŞLI MOD ---
+        largest_upload = max(os.path.getsize(order_file.name), os.path.getsize(ingredients_file.name))
+        if largest_upload >= TAX_STREAM_MIN_FILE_BYTES:
+            result = run_tax_analysis_streaming(order_file.name, ingredients_file.name, tax_snapshot, output_path, progress)
+            if result is None:
+                return "❌ Gerekli sütunlar (Malzeme / Product code) bulunamadı.", None
+            stream_log, order_count, matched_count, report_rows = result
+            if not report_rows:
+                if os.path.exists(output_path): os.remove(output_path)
+                return "❌ Rapor oluşturulacak veri bulunamadı.", None
+
+            log_buffer += stream_log
+            log_buffer += f"<br>✅ <b>İşlem Tamamlandı.</b><br>"
+            log_buffer += f"📦 Taranan Ürün: {order_count}<br>"
+            log_buffer += f"🎯 Vergi Eşleşmesi: {matched_count}<br>"
+            return log_buffer, output_path
 
         # --- ADIM 1: SİPARİŞ VE BİLEŞEN DOSYALARINI OKUMA ---
         try:
@@ -310,115 +1957,16 @@ def process_tax_analysis_structured(order_file, ingredients_file):
         df_ing.columns = df_ing.columns.str.strip()
 
         # Kolonları Bul
-        order_col = next((c for c in df_orders.columns if "Malzeme" in c), None)
-        ing_prod_col = next((c for c in df_ing.columns if "Product code" in c), None)
-        ing_type_col = next((c for c in df_ing.columns if "Type" in c), None)
-        ing_cas_col = next((c for c in df_ing.columns if "CAS" in c), None)
-        ing_desc_col = next((c for c in df_ing.columns if "Standard description" in c), None)
-        ing_pct_col = next((c for c in df_ing.columns if "Percent" in c), None)
-
-        if not order_col or not ing_prod_col: 
-            return "❌ Gerekli sütunlar (Malzeme / Product code) bulunamadı.", None
+        cols = detect_tax_analysis_columns(df_orders.columns, df_ing.columns)
 
-        # --- ADIM 2: BİLEŞENLERİ GRUPLAMA ---
-        product_map = {}
-        for _, row in df_ing.iterrows():
-            p_code = str(row[ing_prod_col]).strip()
-            type_val = str(row[ing_type_col]).strip()
-            
-            if "*" in type_val: # Sadece bileşen satırları
-                if p_code not in product_map: product_map[p_code] = []
-                product_map[p_code].append({
-                    "cas": str(row[ing_cas_col]).strip(),
-                    "name": str(row[ing_desc_col]).strip(),
-                    "pct": str(row[ing_pct_col]).strip()
-                })
-
-        # --- ADIM 3: ANALİZ ---
-        report_data = []
-        matched_count = 0
-        
-        for idx, row in df_orders.iterrows():
-            malzeme_kodu = str(row[order_col]).strip()
-            malzeme_tanim = str(row.get("Malzeme Tanım", "")).strip()
-            
-            ingredients = product_map.get(malzeme_kodu, [])
-            
-            if not ingredients:
-                report_data.append({
-                    "MALZEME KODU": malzeme_kodu,
-                    "ÜRÜN ADI": malzeme_tanim,
-                    "BİLEŞEN": "LİSTEDE YOK",
-                    "CAS NO": "-", "G.T.İ.P.": "-", "VERGİ DURUMU": "-"
-                })
-                continue
+        if not cols["order"] or not cols["product"]: 
+            return "❌ Gerekli sütunlar (Malzeme / Product code) bulunamadı.", None
 
-            for ing in ingredients:
-                cas_no = ing["cas"] # Örn: 100-41-4
-                chem_name = ing["name"].lower()
-                
-                tax_record = None
-                clean_cas = cas_no.replace("(", "").replace(")", "").strip()
-                
-                # --- GÜNCELLENMİŞ ARAMA MANTIĞI (REGEX) ---
-                # Yöntem A: CAS Numarası (Kesin Eşleşme - Regex)
-                # (?<!\d) -> Öncesinde rakam YOKSA
-                # (?!\d)  -> Sonrasında rakam YOKSA
-                if len(clean_cas) > 4: 
-                    cas_pattern = r"(?<!\d)" + re.escape(clean_cas) + r"(?!\d)"
-                    for rec in tax_list_linear:
-                        # Regex ile arama: "77-99-6" ararken "157577-99-6" bulmaz.
-                        if re.search(cas_pattern, rec.get("tanim", "")):
-                            tax_record = rec
-                            break
-                
-                # Yöntem B: CAS ile bulunamadıysa İsim ile ara (Tam eşleşme)
-                if not tax_record and len(chem_name) > 3:
-                    for rec in tax_list_linear:
-                        if chem_name in rec.get("tanim", "").lower():
-                            tax_record = rec
-                            break
-                
-                status = "ESLESME YOK"
-                gtip = "-"
-                tax_rate = "-"
-                desc = "-"
-                validity_display = "-"
-                
-                if tax_record:
-                    status = "⚠️ VERGİ LİSTESİNDE"
-                    gtip = tax_record.get("gtp", "-")
-                    tax_rate = f"%{tax_record.get('gv_oran', '0')}"
-                    desc = tax_record.get("tanim", "")
-                    matched_count += 1
-                    
-                    # Tarih Kontrolü ve Renklendirme
-                    raw_date = tax_record.get("gecerlilik", "-")
-                    validity_display = check_tax_date_warning(raw_date)
-                
-                report_data.append({
-                    "MALZEME KODU": malzeme_kodu,
-                    "ÜRÜN ADI": malzeme_tanim,
-                    "BİLEŞEN": ing["name"],
-                    "CAS NO": cas_no,
-                    "ORAN (%)": ing["pct"],
-                    "VERGİ DURUMU": status,
-                    "G.T.İ.P.": gtip,
-                    "VERGİ ORANI": tax_rate,
-                    "GEÇERLİLİK TARİHİ": validity_display, # Yeni kolon
-                    "VERGİ TANIMI": desc
-                })
+        # --- ADIM 2-3: GRUPLAMA, SİPARİŞ VE VERGİ BİRLEŞTİRMESİ (VEKTÖREL) ---
+        df_out, matched_count = build_tax_report_vectorized(df_orders, df_ing, cols, tax_snapshot)
 
         # --- ADIM 4: RAPORLAMA ---
-        if report_data:
-            df_out = pd.DataFrame(report_data)
-            
-            # --- DEĞİŞİKLİK BURADA: Okunabilir Tarih/Saat ---
-            tarih_saat = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            output_filename = f"Vergi_Analiz_Raporu_{tarih_saat}.xlsx"
-            # -----------------------------------------------
-            
-            output_path = os.path.join(BASE_DIR, output_filename)
+        if len(df_out):
             df_out.to_excel(output_path, index=False)
             
             log_buffer += f"<br>✅ <b>İşlem Tamamlandı.</b><br>"
@@ -435,10 +1983,12 @@ def process_tax_analysis_structured(order_file, ingredients_file):
 
 def save_config(api_key, model_name):
     global app_config
-    config_data = {
+    # Diğer ayarlar (eşzamanlılık vb.) korunur
+    config_data = dict(app_config)
+    config_data.update({
         "api_key": api_key,
         "model_name": model_name
-    }
+    })
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(config_data, f, indent=2)
@@ -515,6 +2065,696 @@ def initialize_gemini_model():
         llm_model = None
         return False
 
+# --- LLM ÇAĞRI KATMANI: KOTA (HIZ SINIRI) VE TEKRAR DENEME ---
+# Tüm Gemini istekleri buradan geçer. Her model için config.json'daki "rate_limits" ayarına göre
+# dakikalık istek (rpm) ve token (tpm) kovaları tutulur. 429 / 5xx hataları rastgele gecikmeli
+# (jitter) üstel bekleme ile tekrar denenir. Bekleme süreleri istatistik olarak raporlanır.
+LLM_IMAGE_TOKEN_ESTIMATE = 258            # Gemini'nin görsel başına saydığı yaklaşık token
+LLM_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+LLM_RETRYABLE_GRPC_STATUS = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED"}
+LLM_RETRYABLE_EXCEPTIONS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                            google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                            google_exceptions.BadGateway, google_exceptions.GatewayTimeout,
+                            google_exceptions.DeadlineExceeded)
+LLM_BACKOFF_BASE_SECONDS = 2.0
+LLM_BACKOFF_MAX_SECONDS = 60.0
+
+class TokenBucket:
+    """
+    Dakikalık kapasite kovası. Rezervasyon kovayı eksiye düşürebilir; eksi miktar kadar
+    beklenir. Böylece bekleyen istekler sırayla (varış sırasına göre) aralıklı çıkar.
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """amount kadar kapasite ayırır, beklenmesi gereken saniyeyi döndürür."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # Kapasiteden büyük tek istek sonsuza kadar beklemesin
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+class LlmRateLimiter:
+    """Bir modelin istek/dakika ve token/dakika kovaları (thread-safe; async ve thread çağrıları ortak)."""
+    def __init__(self, rpm, tpm):
+        self._lock = Lock()
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            return max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now))
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Yanıttaki gerçek token sayısıyla tahmin arasındaki farkı kovaya yansıtır."""
+        with self._lock:
+            self.tokens.level -= (actual_tokens - estimated_tokens)
+
+_llm_limiters = {}
+_llm_limiters_lock = Lock()
+llm_call_stats = {"calls": 0, "retries": 0, "errors": 0, "throttle_wait": 0.0, "backoff_wait": 0.0,
+                  "cache_hits": 0, "cache_misses": 0, "bytes_sent": 0, "request_seconds": 0.0,
+                  "streams": 0, "first_token_seconds": 0.0}
+_llm_stats_lock = Lock()
+
+def get_llm_rate_limits(model_name=None):
+    """config.json -> rate_limits: önce model adı, yoksa 'default' ayarı kullanılır."""
+    model_name = (model_name or app_config.get("model_name", "")).replace("models/", "")
+    rate_limits = app_config.get("rate_limits") or {}
+    limits = dict(DEFAULT_CONFIG["rate_limits"]["default"])
+    limits.update(rate_limits.get("default", {}))
+    limits.update(rate_limits.get(model_name, rate_limits.get(f"models/{model_name}", {})))
+    return limits
+
+def get_llm_limiter(model_name=None):
+    """Modelin paylaşılan sınırlayıcısı. Limitler config'de değişirse yeni kova açılır."""
+    limits = get_llm_rate_limits(model_name)
+    key = ((model_name or app_config.get("model_name", "")).replace("models/", ""), limits["rpm"], limits["tpm"])
+    with _llm_limiters_lock:
+        if key not in _llm_limiters:
+            _llm_limiters[key] = LlmRateLimiter(limits["rpm"], limits["tpm"])
+        return _llm_limiters[key]
+
+def new_llm_stats():
+    """Bir işlem (run) için bekleme/tekrar sayaçları."""
+    return {"calls": 0, "retries": 0, "errors": 0, "throttle_wait": 0.0, "backoff_wait": 0.0,
+            "cache_hits": 0, "cache_misses": 0, "bytes_sent": 0, "request_seconds": 0.0,
+            "streams": 0, "first_token_seconds": 0.0}
+
+def record_llm_stat(stats, key, value):
+    with _llm_stats_lock:
+        llm_call_stats[key] += value
+        if stats is not None:
+            stats[key] += value
+
+def merge_llm_stats(target, source):
+    """Bir isteğin sayaçlarını çalıştırma toplamına ekler (global sayaçlar zaten güncellenmiştir)."""
+    if target is None:
+        return
+    with _llm_stats_lock:
+        for key in target:
+            target[key] += source[key]
+
+def format_llm_payload_stats(stats):
+    if not stats["calls"]:
+        return "📦 Modele istek gönderilmedi"
+    return (f"📦 Gönderilen: {stats['bytes_sent'] / 1024:.0f} KB (istek başına {stats['bytes_sent'] / 1024 / stats['calls']:.0f} KB) | "
+            f"Ortalama istek süresi: {stats['request_seconds'] / stats['calls']:.1f} sn")
+
+def format_llm_stream_stats(stats):
+    if not stats["streams"]:
+        return ""
+    return (f"⚡ Akış: {stats['streams']} istek | Ortalama ilk token süresi: {stats['first_token_seconds'] / stats['streams']:.1f} sn "
+            f"(ortalama toplam {stats['request_seconds'] / max(stats['calls'], 1):.1f} sn)")
+
+def format_llm_wait_stats(stats):
+    return (f"⏱️ Kota beklemesi: {stats['throttle_wait']:.1f} sn | "
+            f"Tekrar deneme: {stats['retries']} ({stats['backoff_wait']:.1f} sn bekleme) | "
+            f"İstek: {stats['calls']} başarılı, {stats['errors']} hatalı")
+
+def estimate_llm_request_tokens(parts):
+    """İstek token tahmini: metinler ~4 karakter/token, görseller sabit."""
+    total = 0
+    for part in (parts if isinstance(parts, list) else [parts]):
+        total += estimate_token_count(part) if isinstance(part, str) else LLM_IMAGE_TOKEN_ESTIMATE
+    return total
+
+def is_retryable_llm_error(error):
+    """
+    429 (kota) ve 5xx (sunucu) hataları tekrar denenir. Karar hata türüne (google.api_core) veya
+    hatanın durum koduna göre verilir; mesaj metnine bakılmaz.
+    """
+    if isinstance(error, LLM_RETRYABLE_EXCEPTIONS):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # gRPC hataları durum kodunu metotla verir (grpc.StatusCode)
+        try:
+            code = code()
+        except Exception:
+            return False
+    if isinstance(code, int) and not isinstance(code, bool):
+        return code in LLM_RETRYABLE_STATUS
+    return getattr(code, "name", None) in LLM_RETRYABLE_GRPC_STATUS
+
+def llm_backoff_delay(attempt):
+    """Üstel bekleme, tam jitter: [0, min(üst sınır, taban * 2^deneme)]"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+def _llm_call_plan(parts, model):
+    model = model or llm_model
+    if model is None:
+        raise RuntimeError("Model yüklü değil")
+    model_name = app_config.get("model_name") if model is llm_model else getattr(model, "model_name", None)
+    limiter = get_llm_limiter(model_name)
+    max_retries = int(app_config.get("llm_max_retries", DEFAULT_CONFIG["llm_max_retries"]))
+    return model, model_name, limiter, estimate_llm_request_tokens(parts), max_retries
+
+def _llm_cache_lookup(key, bypass_cache, stats):
+    """Önbellek anahtarı varsa ve atlanmıyorsa kayıtlı yanıtı döndürür."""
+    if key is None:
+        return None
+    text = None if bypass_cache else llm_cache.get(key)
+    record_llm_stat(stats, "cache_misses" if text is None else "cache_hits", 1)
+    return CachedLlmResponse(text) if text is not None else None
+
+def _llm_cache_store(key, response, model_name, cache):
+    if key is None:
+        return
+    try:
+        llm_cache.put(key, response.text, model_name, cache)
+    except Exception as e:
+        # Engellenen/boş yanıtlarda .text hata verir; önbelleğe yazılmaz
+        print(f"LLM yanıtı önbelleğe yazılamadı: {e}")
+
+def _llm_settle(limiter, estimated, response, stats):
+    record_llm_stat(stats, "calls", 1)
+    usage = getattr(response, "usage_metadata", None)
+    actual = getattr(usage, "prompt_token_count", None) if usage is not None else None
+    if isinstance(actual, int) and actual > 0:
+        limiter.settle(estimated, actual)
+
+def _llm_retry_delay(error, attempt, max_retries, stats):
+    """Tekrar denenecekse bekleme süresini döndürür, denenmeyecekse hatayı yükseltir."""
+    if attempt >= max_retries or not is_retryable_llm_error(error):
+        record_llm_stat(stats, "errors", 1)
+        raise error
+    delay = llm_backoff_delay(attempt)
+    record_llm_stat(stats, "retries", 1)
+    record_llm_stat(stats, "backoff_wait", delay)
+    print(f"LLM isteği tekrar denenecek ({attempt + 1}/{max_retries}, {delay:.1f} sn sonra): {error}")
+    return delay
+
+def _llm_log_request(model, model_name, cache, started, payload, outcome, stats, first_token=None):
+    """
+    İstek metriğini kaydeder: payload = (bayt, görsel sayısı, hazırlık sn), outcome = (durum, api sn, deneme).
+    first_token: akışlı isteklerde ilk metin parçasının geldiği an (istek başından itibaren sn).
+    """
+    total_seconds = time.perf_counter() - started
+    status, api_seconds, attempts = outcome
+    if status == "ok":
+        record_llm_stat(stats, "bytes_sent", payload[0])
+        record_llm_stat(stats, "request_seconds", total_seconds)
+        if first_token is not None:
+            record_llm_stat(stats, "streams", 1)
+            record_llm_stat(stats, "first_token_seconds", first_token)
+            print(f"LLM akışı ({cache or '-'}): ilk token {first_token:.2f} sn | toplam {total_seconds:.2f} sn")
+    if model is not llm_model:
+        return  # Benchmark'taki sahte modeller metrik dosyasını doldurmasın
+    if status == "ok" and payload[1]:
+        record_image_request_latency(cache or "-", total_seconds * 1000)
+    record_llm_request_metric({
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "model": model_name,
+        "prompt": cache or "-",
+        "status": status,
+        "bytes_sent": payload[0],
+        "images": payload[1],
+        "prepare_ms": round(payload[2] * 1000),
+        "api_ms": round(api_seconds * 1000),
+        "total_ms": round(total_seconds * 1000),
+        "ttft_ms": round(first_token * 1000) if first_token is not None else None,
+        "attempts": attempts,
+        "image_optimizer": get_image_optimizer_settings()
+    })
+
+async def llm_generate_async(parts, stats=None, model=None, cache=None, bypass_cache=False, cache_key=None):
+    """
+    generate_content_async yerine kullanılır: kota beklemesi + 429/5xx tekrar denemesi.
+    cache: PROMPT_VERSIONS'taki istem adı verilirse yanıt diskte önbelleklenir.
+    bypass_cache: önbellekteki yanıt kullanılmaz, model yeniden çağrılır (yeni yanıt kaydedilir).
+    cache_key: çağıran önbelleğe bu anahtarla zaten baktıysa verilir; tekrar bakılmaz (ıska iki kez sayılmaz),
+    yanıt bu anahtarla kaydedilir.
+    Görseller gönderilmeden önce optimize edilir (image_optimizer); bayt ve süre metrik olarak kaydedilir.
+    """
+    started = time.perf_counter()
+    model, model_name, limiter, estimated, max_retries = _llm_call_plan(parts, model)
+    key = cache_key
+    if key is None and cache and llm_cache.settings()["enabled"]:
+        key = await asyncio.to_thread(llm_cache.make_key, model_name, cache, parts)
+        cached = await asyncio.to_thread(_llm_cache_lookup, key, bypass_cache, stats)
+        if cached is not None:
+            return cached
+    prepared, payload_bytes, image_count = await asyncio.to_thread(prepare_llm_parts, parts)
+    payload = (payload_bytes, image_count, time.perf_counter() - started)
+    attempt = 0
+    while True:
+        wait = limiter.reserve(estimated)
+        if wait > 0:
+            record_llm_stat(stats, "throttle_wait", wait)
+            await asyncio.sleep(wait)
+        api_started = time.perf_counter()
+        try:
+            response = await model.generate_content_async(prepared)
+        except Exception as e:
+            try:
+                delay = _llm_retry_delay(e, attempt, max_retries, stats)
+            except Exception:
+                _llm_log_request(model, model_name, cache, started, payload, ("error", time.perf_counter() - api_started, attempt + 1), stats)
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        api_seconds = time.perf_counter() - api_started
+        _llm_settle(limiter, estimated, response, stats)
+        if key is not None:
+            await asyncio.to_thread(_llm_cache_store, key, response, model_name, cache)
+        await asyncio.to_thread(_llm_log_request, model, model_name, cache, started, payload, ("ok", api_seconds, attempt + 1), stats)
+        return response
+
+def llm_generate(parts, stats=None, model=None, cache=None, bypass_cache=False):
+    """generate_content (senkron, thread içinden) için aynı kota, tekrar deneme, önbellek ve optimizasyon mantığı."""
+    started = time.perf_counter()
+    model, model_name, limiter, estimated, max_retries = _llm_call_plan(parts, model)
+    key = None
+    if cache and llm_cache.settings()["enabled"]:
+        key = llm_cache.make_key(model_name, cache, parts)
+        cached = _llm_cache_lookup(key, bypass_cache, stats)
+        if cached is not None:
+            return cached
+    prepared, payload_bytes, image_count = prepare_llm_parts(parts)
+    payload = (payload_bytes, image_count, time.perf_counter() - started)
+    attempt = 0
+    while True:
+        wait = limiter.reserve(estimated)
+        if wait > 0:
+            record_llm_stat(stats, "throttle_wait", wait)
+            time.sleep(wait)
+        api_started = time.perf_counter()
+        try:
+            response = model.generate_content(prepared)
+        except Exception as e:
+            try:
+                delay = _llm_retry_delay(e, attempt, max_retries, stats)
+            except Exception:
+                _llm_log_request(model, model_name, cache, started, payload, ("error", time.perf_counter() - api_started, attempt + 1), stats)
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        api_seconds = time.perf_counter() - api_started
+        _llm_settle(limiter, estimated, response, stats)
+        _llm_cache_store(key, response, model_name, cache)
+        _llm_log_request(model, model_name, cache, started, payload, ("ok", api_seconds, attempt + 1), stats)
+        return response
+
+STREAM_RENDER_INTERVAL = 0.1  # Akışlı yanıtlarda arayüzün en sık yenilenme aralığı (sn)
+
+def _llm_chunk_text(chunk):
+    """Akış parçasının metni (Güvenlik/bitiş parçalarında .text hata verir, boş sayılır)."""
+    try:
+        return chunk.text or ""
+    except Exception:
+        return ""
+
+async def llm_stream_async(parts, stats=None, model=None, cache=None, bypass_cache=False):
+    """
+    llm_generate_async'in akışlı (stream=True) karşılığı: metin parçalarını geldikçe verir (async generator).
+    Kota, önbellek ve görsel optimizasyonu aynıdır. Tekrar deneme yalnızca ilk parça gelmeden önceki
+    hatalarda yapılır; ekrana yazılmaya başlanmış bir yanıt yarıda kesilirse hata yükseltilir.
+    Önbellek isabetinde kayıtlı yanıt tek parça olarak verilir. İlk token süresi metriğe yazılır.
+    """
+    started = time.perf_counter()
+    model, model_name, limiter, estimated, max_retries = _llm_call_plan(parts, model)
+    key = None
+    if cache and llm_cache.settings()["enabled"]:
+        key = await asyncio.to_thread(llm_cache.make_key, model_name, cache, parts)
+        cached = await asyncio.to_thread(_llm_cache_lookup, key, bypass_cache, stats)
+        if cached is not None:
+            yield cached.text
+            return
+    prepared, payload_bytes, image_count = await asyncio.to_thread(prepare_llm_parts, parts)
+    payload = (payload_bytes, image_count, time.perf_counter() - started)
+    attempt = 0
+    while True:
+        wait = limiter.reserve(estimated)
+        if wait > 0:
+            record_llm_stat(stats, "throttle_wait", wait)
+            await asyncio.sleep(wait)
+        api_started = time.perf_counter()
+        chunks = []
+        first_token = None
+        try:
+            response = await model.generate_content_async(prepared, stream=True)
+            async for chunk in response:
+                text = _llm_chunk_text(chunk)
+                if not text:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                chunks.append(text)
+                yield text
+        except Exception as e:
+            try:
+                if chunks:
+                    record_llm_stat(stats, "errors", 1)
+                    raise e
+                delay = _llm_retry_delay(e, attempt, max_retries, stats)
+            except Exception:
+                _llm_log_request(model, model_name, cache, started, payload, ("error", time.perf_counter() - api_started, attempt + 1), stats)
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        api_seconds = time.perf_counter() - api_started
+        _llm_settle(limiter, estimated, response, stats)
+        if key is not None and chunks:
+            await asyncio.to_thread(_llm_cache_store, key, CachedLlmResponse("".join(chunks)), model_name, cache)
+        await asyncio.to_thread(_llm_log_request, model, model_name, cache, started, payload, ("ok", api_seconds, attempt + 1), stats, first_token)
+        return
+
+# --- LLM YANIT ÖNBELLEĞİ (İÇERİK ADRESLİ, DİSKTE) ---
+# Aynı form/SDS tekrar yüklendiğinde model yeniden çağrılmaz. Anahtar: normalize edilmiş görsel
+# piksellerinin özeti + istem (prompt) şablonunun sürümü + metin parçaları + model adı.
+# Bir istem şablonu değiştirildiğinde PROMPT_VERSIONS'taki numarası artırılmalıdır (eski yanıtlar kullanılmaz).
+LLM_CACHE_DIR = os.path.join(BASE_DIR, "llm_onbellek")
+PROMPT_VERSIONS = {
+    "gtip_formu": 1,              # process_single_file
+    "sds_ozet": 1,                # analyze_single_sds
+    "siniflandirma": 1,           # classify_product_smart (tekil)
+    "toplu_siniflandirma": 1,     # classify_product_smart (çoklu dosya)
+    "asistan_siniflandirma": 1,   # classify_batch_with_metadata
+    "anahtar_kelime": 1,          # extract_keywords_from_image
+}
+
+class CachedLlmResponse:
+    """Önbellekten dönen yanıt; çağıranlar model yanıtı gibi .text ile okur."""
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+def hash_llm_part(digest, part):
+    """İstek parçasını özete ekler. Görseller dosya biçiminden bağımsız olarak RGB piksellerinden özetlenir."""
+    if isinstance(part, str):
+        digest.update(b"T" + part.encode("utf-8"))
+    elif isinstance(part, Image.Image):
+        rgb = part if part.mode == "RGB" else part.convert("RGB")
+        digest.update(f"I{rgb.size[0]}x{rgb.size[1]}".encode("ascii"))
+        digest.update(rgb.tobytes())
+    elif isinstance(part, (bytes, bytearray)):
+        digest.update(b"B" + bytes(part))
+    else:
+        digest.update(b"R" + repr(part).encode("utf-8"))
+
+class LlmResponseCache:
+    """
+    Dosya başına bir yanıt (anahtar.json). Son erişim zamanı dosyanın mtime'ıdır (LRU);
+    toplam boyut sınırı aşılınca en eski erişilenler silinir. TTL'i geçen kayıtlar ıskalama sayılır.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = Lock()
+        self._entries = None          # anahtar -> [son erişim, boyut]
+
+    def settings(self):
+        settings = dict(DEFAULT_CONFIG["llm_cache"])
+        settings.update(app_config.get("llm_cache") or {})
+        return settings
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if not name.endswith(".json"): continue
+                    try:
+                        st = os.stat(os.path.join(self.directory, name))
+                        self._entries[name[:-5]] = [st.st_mtime, st.st_size]
+                    except OSError: continue
+        return self._entries
+
+    def make_key(self, model_name, prompt_name, parts):
+        digest = hashlib.sha256()
+        version = PROMPT_VERSIONS.get(prompt_name, 0)
+        digest.update(f"{model_name}|{prompt_name}@{version}".encode("utf-8"))
+        # Görsel optimizasyon ayarı değişince (farklı çözünürlük/kalite) yanıtlar yeniden alınır
+        digest.update(json.dumps(get_image_optimizer_settings(), sort_keys=True).encode("utf-8"))
+        for part in (parts if isinstance(parts, list) else [parts]):
+            hash_llm_part(digest, part)
+        return digest.hexdigest()
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        try: os.remove(self._path(key))
+        except OSError: pass
+
+    def get(self, key):
+        """Geçerli kayıt varsa yanıt metnini döndürür, yoksa None."""
+        ttl_seconds = float(self.settings()["ttl_days"]) * 86400
+        with self._lock:
+            entries = self._load_entries()
+            if key not in entries:
+                return None
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+            except Exception:
+                self._remove(key)
+                return None
+            if time.time() - payload.get("created", 0) > ttl_seconds:
+                self._remove(key)
+                return None
+            now = time.time()
+            try: os.utime(self._path(key), (now, now))
+            except OSError: pass
+            entries[key][0] = now
+            return payload.get("text")
+
+    def put(self, key, text, model_name, prompt_name):
+        max_bytes = float(self.settings()["max_mb"]) * 1024 * 1024
+        payload = {"text": text, "model": model_name, "prompt": prompt_name,
+                   "prompt_version": PROMPT_VERSIONS.get(prompt_name, 0), "created": time.time()}
+        with self._lock:
+            entries = self._load_entries()
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+            entries[key] = [time.time(), os.path.getsize(self._path(key))]
+            total = sum(size for _, size in entries.values())
+            if total > max_bytes:
+                for old_key, (_, size) in sorted(entries.items(), key=lambda kv: kv[1][0]):
+                    if total <= max_bytes * 0.9 or old_key == key: break
+                    self._remove(old_key)
+                    total -= size
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._load_entries()):
+                self._remove(key)
+
+    def summary(self):
+        with self._lock:
+            entries = self._load_entries()
+            return len(entries), sum(size for _, size in entries.values())
+
+llm_cache = LlmResponseCache(LLM_CACHE_DIR)
+
+def format_llm_cache_stats(stats):
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    if not lookups:
+        return "🗄️ Önbellek: kullanılmadı"
+    return f"🗄️ Önbellek: {stats['cache_hits']} isabet / {stats['cache_misses']} ıskalama (%{100 * stats['cache_hits'] / lookups:.0f} isabet)"
+
+def clear_llm_cache():
+    count, size = llm_cache.summary()
+    llm_cache.clear()
+    return f"🗑️ Önbellek temizlendi: {count} yanıt ({size / 1024 / 1024:.1f} MB)"
+
+# --- ÇOK BELGELİ (TOPLU) ÇIKARIM İSTEKLERİ ---
+# Kısa JSON çıktılı çıkarımlarda (SDS özeti, GTIP formu) istek başına sabit maliyet baskındır.
+# DocumentBatcher aynı çalıştırmadaki belgeleri kısa bir pencerede toplar, N belgeyi tek istekte
+# "document_id" anahtarlı JSON dizisi olarak ister ve sonuçları dosyalarına dağıtır.
+# İstek hata verirse veya yanıttaki kimlikler gönderilen belgelerle birebir eşleşmezse (eksik, fazla,
+# tekrarlanan kimlik) yanıta güvenilmez ve gruptaki belgeler tek tek istenir.
+
+def get_document_batching_settings():
+    settings = dict(DEFAULT_CONFIG["document_batching"])
+    settings.update(app_config.get("document_batching") or {})
+    return settings
+
+def parse_llm_json_object(text):
+    """Model yanıtındaki JSON nesnesini döndürür (```json bloklarını temizler). Bulunamazsa None."""
+    json_str = text.replace("```json", "").replace("```", "").strip()
+    match = re.search(r'\{.*\}', json_str, re.DOTALL)
+    return json.loads(match.group(0)) if match else None
+
+async def extract_document_json(prompt, cache_name, document, stats=None, bypass_cache=False, cache_key=None):
+    """Tek belge için istem + belge (görsel/metin) gönderir, JSON nesnesini döndürür (parse edilemezse None)."""
+    response = await llm_generate_async(document_llm_parts(prompt, document), stats=stats, cache=cache_name,
+                                        bypass_cache=bypass_cache, cache_key=cache_key)
+    return parse_llm_json_object(response.text)
+
+def split_llm_stats(stats, count):
+    """
+    Tek isteğin sayaçlarını (new_llm_stats) count belgeye paylaştırır: süreler eşit bölünür, adetler
+    kalan ilk belgelere yazılarak dağıtılır. Payların toplamı her zaman isteğin sayaçlarına eşittir.
+    """
+    shares = [dict.fromkeys(stats, 0) for _ in range(count)]
+    for key, value in stats.items():
+        if isinstance(value, float):
+            for share in shares:
+                share[key] = value / count
+        else:
+            base, extra = divmod(value, count)
+            for i, share in enumerate(shares):
+                share[key] = base + (1 if i < extra else 0)
+    return shares
+
+class DocumentBatcher:
+    """
+    Bir çalıştırmaya (run) ait belge çıkarım isteklerini gruplayan yardımcı.
+    Aynı istem (prompt) ve önbellek adıyla kullanılır; extract() her belge için ayrı çağrılır.
+    """
+    def __init__(self, prompt, cache_name, bypass_cache=False):
+        settings = get_document_batching_settings()
+        self.prompt = prompt
+        self.cache_name = cache_name
+        self.bypass_cache = bypass_cache
+        self.max_documents = max(1, int(settings["max_documents"])) if settings["enabled"] else 1
+        self.max_wait = max(0, int(settings["max_wait_ms"])) / 1000
+        self._pending = []            # (belge, future, stats, önbellek anahtarı)
+        self._timer = None
+        self._tasks = set()
+        self.stats = {"batches": 0, "batched_documents": 0, "fallbacks": 0}
+
+    async def extract(self, document, stats=None):
+        """Belgenin JSON nesnesini döndürür (parse edilemezse None). Gruplama kapalıysa tek istek atar."""
+        if self.max_documents <= 1:
+            return await extract_document_json(self.prompt, self.cache_name, document, stats, self.bypass_cache)
+
+        # Tekil istemle aynı anahtar: toplu alınan yanıtlar tekil çağrılarda da kullanılabilir
+        key = None
+        if llm_cache.settings()["enabled"]:
+            key = await asyncio.to_thread(llm_cache.make_key, app_config.get("model_name"), self.cache_name,
+                                          document_llm_parts(self.prompt, document))
+            cached = await asyncio.to_thread(_llm_cache_lookup, key, self.bypass_cache, stats)
+            if cached is not None:
+                return parse_llm_json_object(cached.text)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((document, future, stats, key))
+        if len(self._pending) >= self.max_documents:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_documents], self._pending[self.max_documents:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(lambda task: self._settle_batch(task, batch))
+
+    def _settle_batch(self, task, batch):
+        """
+        Grup görevi bitince çağrılır. Görev iptal edildiyse (başlamadan bile) veya beklenmedik hatayla
+        bittiyse sonucu verilmemiş extract() çağrıları askıda kalmasın diye iptal edilir / hatayla tamamlanır.
+        """
+        self._tasks.discard(task)
+        error = None if task.cancelled() else task.exception()
+        for _, future, _, _ in batch:
+            if future.done():
+                continue
+            if error is None:
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    def _batch_parts(self, batch):
+        parts = [self.prompt + f"""
+
+        TOPLU MOD: Bu istekte {len(batch)} ayrı belge var. Her belge "[BELGE <kimlik>]" satırıyla başlar.
+        Yukarıdaki görevi HER BELGE İÇİN AYRI uygula. Tek nesne yerine SADECE bir JSON dizisi döndür;
+        dizideki her nesne yukarıdaki formatta olsun ve ayrıca belgenin kimliğini "document_id" alanında taşısın.
+        Örnek: [{{"document_id": "D1", ...}}, {{"document_id": "D2", ...}}]
+        """]
+        for number, (document, _, _, _) in enumerate(batch, 1):
+            parts.append(f"[BELGE D{number}]")
+            parts.extend(document_llm_parts("", document)[1:])
+        return parts
+
+    def _parse_batch_response(self, text, count):
+        """
+        Toplu yanıtı {"D1": nesne, ...} olarak döndürür. Kimlikler D1..Dcount ile birebir eşleşmezse
+        (eksik, fazla veya tekrarlanan kimlik, nesne olmayan öğe) None: sonuçlar belgelere güvenle dağıtılamaz.
+        """
+        json_str = text.replace("```json", "").replace("```", "").strip()
+        match = re.search(r'\[.*\]', json_str, re.DOTALL)
+        items = json.loads(match.group(0)) if match else None
+        if not isinstance(items, list) or len(items) != count:
+            return None
+        results = {}
+        for item in items:
+            # "D2", "[BELGE D2]" veya 2 gibi yazımlar aynı kimliğe indirgenir
+            number = re.search(r'(\d+)', str(item.get("document_id", ""))) if isinstance(item, dict) else None
+            if not number:
+                return None
+            item.pop("document_id")
+            results[f"D{int(number.group(1))}"] = item
+        return results if set(results) == {f"D{n}" for n in range(1, count + 1)} else None
+
+    async def _run_batch(self, batch):
+        batch_stats = new_llm_stats()
+        results = None
+        try:
+            response = await llm_generate_async(self._batch_parts(batch), stats=batch_stats)
+            results = self._parse_batch_response(response.text, len(batch))
+            if results is None:
+                print(f"Toplu yanıttaki belge kimlikleri eşleşmedi, {len(batch)} belge tek tek denenecek.")
+        except Exception as e:
+            print(f"Toplu çıkarım isteği başarısız, belgeler tek tek denenecek: {e}")
+        finally:
+            # Tek isteğin sayaçları belgelere paylaştırılır (Çalıştırma toplamları ve AIMD ölçümü için)
+            for (_, _, stats, _), share in zip(batch, split_llm_stats(batch_stats, len(batch))):
+                merge_llm_stats(stats, share)
+        self.stats["batches"] += 1
+
+        if results is not None:
+            for number, (document, future, stats, key) in enumerate(batch, 1):
+                item = results[f"D{number}"]
+                self.stats["batched_documents"] += 1
+                if key is not None:
+                    await asyncio.to_thread(_llm_cache_store, key, CachedLlmResponse(json.dumps(item, ensure_ascii=False)),
+                                            app_config.get("model_name"), self.cache_name)
+                if not future.done():
+                    future.set_result(item)
+            return
+
+        # Belgeler tek tek istenir. Önbelleğe extract() içinde zaten bakıldı: anahtar verilerek
+        # ıska ikinci kez sayılmaz, yanıt aynı anahtarla kaydedilir.
+        self.stats["fallbacks"] += len(batch)
+        async def retry(document, future, stats, key):
+            try:
+                result = await extract_document_json(self.prompt, self.cache_name, document, stats,
+                                                     self.bypass_cache, cache_key=key)
+                if not future.done(): future.set_result(result)
+            except Exception as e:
+                if not future.done(): future.set_exception(e)
+        await asyncio.gather(*(retry(*entry) for entry in batch))
+
+    def summary(self):
+        if not self.stats["batches"]:
+            return ""
+        return (f"📚 Toplu istek: {self.stats['batches']} istekte {self.stats['batched_documents']} belge"
+                f" | tek tek yeniden denenen: {self.stats['fallbacks']}")
+
 # --- 4. GEÇMİŞ İŞLEMLERİ (GÜNCELLENDİ: HEM ARAMA HEM EMSAL GÖSTERİMİ) ---
 
 def log_search_to_history(query, found_cases, image_obj):
@@ -540,7 +2780,8 @@ def log_search_to_history(query, found_cases, image_obj):
             "query": query,
             "summary_results": summary_text,
             "image_b64": img_str,
-            "full_results": found_cases[:5]
+            "full_results": found_cases[:5],
+            "search_key": fold_search_text(f"{query} {summary_text}")
         }
 
         with open(SEARCH_LOG_FILE, 'a', encoding='utf-8') as f:
@@ -555,6 +2796,7 @@ def get_filtered_history(filter_text="", history_type="Arama Geçmişi"):
     """
     data_list = []
     raw_logs = [] # Detay gösterimi için ham veriyi tutacağız
+    filter_key = fold_search_text(filter_text or "")
 
     # --- MOD 1: ARAMA GEÇMİŞİ ---
     if history_type == "Arama Geçmişi":
@@ -568,8 +2810,9 @@ def get_filtered_history(filter_text="", history_type="Arama Geçmişi"):
                     if not line.strip(): continue
                     try:
                         log = json.loads(line)
-                        searchable = f"{log.get('query')} {log.get('summary_results')}".lower()
-                        if filter_text.lower() in searchable:
+                        # Yeni kayıtlarda arama anahtarı hazır gelir, eskiler için hesaplanır
+                        searchable = log.get("search_key") or fold_search_text(f"{log.get('query')} {log.get('summary_results')}")
+                        if filter_key in searchable:
                             has_image = "📷 Var" if log.get("image_b64") else "-"
                             data_list.append([
                                 log.get("timestamp"),
@@ -590,23 +2833,18 @@ def get_filtered_history(filter_text="", history_type="Arama Geçmişi"):
             return pd.DataFrame(columns=["ID", "Ürün Adı", "GTIP", "Tarih"]), []
         
         try:
-            with open(CASES_FILE, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                for line in reversed(lines):
-                    if not line.strip(): continue
-                    try:
-                        case = json.loads(line)
-                        searchable = f"{case.get('product_name')} {case.get('assigned_gtip')} {case.get('composition_text')}".lower()
-                        if filter_text.lower() in searchable:
-                            data_list.append([
-                                case.get("id", "-"),
-                                case.get("product_name", "Bilinmiyor"),
-                                case.get("assigned_gtip", "-"),
-                                case.get("assignment_date", "-"),
-                                case.get("composition_text", "")[:50] + "..."
-                            ])
-                            raw_logs.append(case)
-                    except: continue
+            # Emsaller arama indeksinden gelir (Filtre anahtarları kayıt eklenirken hesaplanmıştır)
+            for case in case_index.filter_cases(filter_text):
+                try:
+                    data_list.append([
+                        case.get("id", "-"),
+                        case.get("product_name", "Bilinmiyor"),
+                        case.get("assigned_gtip", "-"),
+                        case.get("assignment_date", "-"),
+                        case.get("composition_text", "")[:50] + "..."
+                    ])
+                    raw_logs.append(case)
+                except: continue
             return pd.DataFrame(data_list, columns=["ID", "Ürün Adı", "GTIP", "Tarih", "İçerik Özeti"]), raw_logs
         except Exception as e:
             print(f"Emsal okuma hatası: {e}")
@@ -625,8 +2863,8 @@ def get_filtered_history(filter_text="", history_type="Arama Geçmişi"):
                     try:
                         log = json.loads(line)
                         # Arama filtresi
-                        searchable = f"{log.get('filename')} {log.get('product_name')} {log.get('composition')}".lower()
-                        if filter_text.lower() in searchable:
+                        searchable = log.get("search_key") or fold_search_text(f"{log.get('filename')} {log.get('product_name')} {log.get('composition')}")
+                        if filter_key in searchable:
                             data_list.append([
                                 log.get("timestamp"),
                                 log.get("filename"),
@@ -701,41 +2939,107 @@ def clear_all_search_history():
     return get_filtered_history()
 
 
-async def analyze_single_sds(file_path, ref_data):
+# --- SDS YEREL ÖN TARAMA (CAS + VERGİ İNDEKSİ, MODELSİZ) ---
+# Metin katmanı olan SDS'lerde Bölüm 3'teki CAS numaraları (kontrol basamağı doğrulanarak)
+# doğrudan vergi listesinin CAS indeksinde aranır. Sonuç ancak ana bileşen belliyse yerel verilir:
+# bileşimde tek geçerli CAS varsa, tüm CAS'lar aynı vergi kaydına çıkıyorsa ya da eşleşen CAS
+# oranıyla açıkça ana bileşense (alt sınırı diğerlerinin üst sınırından küçük değil). Aksi halde
+# (CAS yok, ana bileşen belirsiz / listede yok, birden fazla kayıt) Gemini'ye gidilir.
+SDS_CONCENTRATION_PATTERN = re.compile(
+    r'([<>≤≥]=?)?\s*(\d{1,3}(?:[.,]\d+)?)\s*(?:(?:-|–|—|to|\.\.\.?)\s*[<>≤≥]?=?\s*(\d{1,3}(?:[.,]\d+)?)\s*)?%')
+SDS_PRODUCT_NAME_PATTERN = re.compile(
+    r'(?im)^[ \t]*(?:[\d.]+[ \t]*)?(?:trade[ \t]*name|product[ \t]*name|ticari[ \t]*ad[ıi]?|[üu]r[üu]n[ \t]*ad[ıi]|'
+    r'handelsname|produktname|nom[ \t]*commercial)[ \t]*[:\-]?[ \t]*([^\n]{2,120})$')
+
+def is_valid_cas_number(cas):
+    """CAS kontrol basamağı: son hane hariç rakamlar sağdan 1, 2, 3... ile çarpılıp toplanır, mod 10 son haneye eşit olmalı."""
+    digits = str(cas).replace("-", "")
+    if not digits.isdigit() or len(digits) < 5:
+        return False
+    body, check = digits[:-1], int(digits[-1])
+    return sum(int(d) * weight for weight, d in enumerate(reversed(body), 1)) % 10 == check
+
+def parse_sds_concentration(line):
     """
-    Tek bir SDS dosyasını analiz eder. (Helper Function)
+    Bileşim satırındaki oranı (alt, üst) yüzde olarak döndürür; bulunamazsa None.
+    "40-60 %" -> (40, 60), "< 1 %" -> (0, 1), "≥ 90%" -> (90, 100), "12,5%" -> (12.5, 12.5).
+    Satırdaki CAS numaraları önceden çıkarılır (1330-20-7 gibi numaralar oran sanılmasın).
     """
-    f_name = os.path.basename(file_path)
-    
-    # Regex ile ID yakalama
-    product_id_match = re.search(r'^([A-Z0-9-]+)', f_name)
-    product_id = product_id_match.group(0) if product_id_match else "-"
-
-    try:
-        # --- HIZ OPTİMİZASYONU: DPI Düşürme ---
-        # Global fonksiyon yerine burada özel bir convert işlemi yapabiliriz veya
-        # load_file_as_image fonksiyonunun DPI ayarını düşürebilirsin.
-        # Hız için burada tekrar convert_from_path çağırıyorum ama düşük DPI ile.
-        img = None
-        if file_path.lower().endswith(".pdf"):
-            # Poppler yolunu global değişkenden veya sistemden al
-            poppler_path = None
-            if getattr(sys, 'frozen', False):
-                poppler_path = os.path.join(sys._MEIPASS, "poppler_bin")
-            else:
-                poppler_path = os.path.join(BASE_DIR, "poppler", "Library", "bin")
-                if not os.path.exists(poppler_path): poppler_path = None
-
-            # DPI=150 okuma hızı için idealdir
-            pages = convert_from_path(file_path, dpi=150, first_page=1, last_page=1, poppler_path=poppler_path)
-            if pages: img = pages[0]
-        else:
-            img = Image.open(file_path)
+    match = SDS_CONCENTRATION_PATTERN.search(CAS_NUMBER_PATTERN.sub(" ", line))
+    if not match:
+        return None
+    sign, first, second = match.group(1), float(match.group(2).replace(",", ".")), match.group(3)
+    if second is not None:
+        return first, float(second.replace(",", "."))
+    if sign and sign[0] in "<≤":
+        return 0.0, first
+    if sign and sign[0] in ">≥":
+        return first, 100.0
+    return first, first
+
+def find_sds_main_cas(composition, cas_list):
+    """
+    Oranına göre açıkça ana bileşen olan CAS: alt sınırı diğer tüm CAS'ların üst sınırından küçük değilse.
+    Oranı okunamayan CAS varsa veya ana bileşen net değilse None.
+    """
+    ranges = {}
+    for line in composition.splitlines():
+        for cas in CAS_NUMBER_PATTERN.findall(line):
+            if cas in cas_list and cas not in ranges:
+                ranges[cas] = parse_sds_concentration(line)
+    if any(ranges.get(cas) is None for cas in cas_list):
+        return None
+    main = max(cas_list, key=lambda cas: ranges[cas][1])
+    if all(ranges[main][0] >= ranges[cas][1] for cas in cas_list if cas != main):
+        return main
+    return None
 
-        if not img: raise Exception("Görsel okunamadı")
+def extract_sds_product_name(text):
+    """SDS metnindeki ticari ad satırı (bulunamazsa boş string)."""
+    match = SDS_PRODUCT_NAME_PATTERN.search(text)
+    return match.group(1).strip(" :-\t") if match else ""
 
-        # Gemini Analizi
-        prompt = """
+def screen_sds_locally(document, as_of=None):
+    """
+    Metin katmanından yerel sonuç üretmeyi dener.
+    Dönen: (sonuç, neden). Sonuç None ise model çağrılmalıdır; 'neden' rapora yazılır.
+    """
+    if document is None or document["kind"] != "text":
+        return None, "metin katmanı yok"
+    text = document["text"]
+    composition = extract_sds_composition(text) or text
+    cas_list = [cas for cas in extract_cas_numbers(composition) if is_valid_cas_number(cas)]
+    if not cas_list:
+        return None, "geçerli CAS bulunamadı"
+    snapshot = get_tax_snapshot(as_of)
+    if snapshot is None:
+        return None, "vergi listesi yok"
+    records = {}                      # CAS -> vergi kaydı (Listede olmayanlar hariç)
+    hits = {}                         # (gtp, tanim) -> (ilk CAS, kayıt)
+    for cas in cas_list:
+        record = lookup_tax_by_cas(cas, snapshot.records, snapshot.cas_index)
+        if record:
+            records[cas] = record
+            hits.setdefault((record.get("gtp"), record.get("tanim")), (cas, record))
+    if not hits:
+        return None, "CAS'lar vergi listesinde yok"
+
+    if len(hits) == 1 and len(records) == len(cas_list):
+        # Tek CAS, ya da tüm CAS'lar aynı vergi kaydına çıkıyor
+        cas, record = next(iter(hits.values()))
+    else:
+        main = find_sds_main_cas(composition, cas_list)
+        if main is None:
+            if len(hits) > 1:
+                return None, f"{len(hits)} farklı vergi kaydı eşleşti (belirsiz)"
+            return None, "birden fazla CAS, ana bileşen belirsiz"
+        if main not in records:
+            return None, f"ana bileşen ({main}) vergi listesinde yok"
+        cas, record = main, records[main]
+    return {"product_name": extract_sds_product_name(text), "main_cas": cas, "tax_record": record}, "yerel"
+
+# Gemini Analizi istemi (SDS özeti)
+SDS_SUMMARY_PROMPT = """
         GÖREV: Bu SDS belgesini analiz et ve aşağıdaki JSON formatını doldur.
         Özellikle Bölüm 3 (Composition) kısmındaki CAS numaralarına ve ana kimyasal isme odaklan.
         
@@ -745,19 +3049,54 @@ async def analyze_single_sds(file_path, ref_data):
             "content_summary": "İçerik özeti (Örn: %60 Solvent Naphtha)"
         }
         """
-        # API isteği
-        response = await llm_model.generate_content_async([prompt, img])
-        json_str = response.text.replace("```json", "").replace("```", "").strip()
-        match = re.search(r'\{.*\}', json_str, re.DOTALL)
-        
-        ai_data = json.loads(match.group(0)) if match else {}
-        
-        p_name = ai_data.get("product_name", "Bulunamadı")
-        cas_no = ai_data.get("main_cas", "")
+
+async def analyze_single_sds(file_path, ref_data, stats=None, document=None, local_first=False, batcher=None, as_of=None):
+    """
+    Tek bir SDS dosyasını analiz eder. (Helper Function)
+    LLM isteği ortak kota sınırlayıcısından geçer; bekleme süreleri 'stats' sözlüğüne eklenir.
+    'document' verilmezse burada hazırlanır (dijital PDF'te metin katmanı, değilse ilk sayfa görüntüsü).
+    local_first=True ise önce yerel CAS taraması yapılır; net sonuç varsa model çağrılmaz.
+    batcher (DocumentBatcher) verilirse SDS diğerleriyle aynı istekte gönderilebilir.
+    as_of (date) verilirse vergi eşleşmesi o tarihte yürürlükte olan liste sürümünde yapılır.
+    """
+    f_name = os.path.basename(file_path)
+    
+    # Regex ile ID yakalama
+    product_id_match = re.search(r'^([A-Z0-9-]+)', f_name)
+    product_id = product_id_match.group(0) if product_id_match else "-"
+    file_stats = new_llm_stats()      # Dosyaya özel sayaçlar (tasarruf özeti), sonda toplama eklenir
+
+    try:
+        # Boru hattından hazır belge gelmediyse burada hazırlanır (DPI=150 okuma hızı için idealdir)
+        if document is None:
+            document = await asyncio.to_thread(load_document_for_llm, file_path, SDS_RASTER_DPI)
+
+        if document["kind"] == "image" and not document["image"]: raise Exception("Görsel okunamadı")
+
+        # Yerel ön tarama (metin katmanı + CAS indeksi)
+        local_result, local_reason = None, "kapalı"
+        if local_first:
+            local_result, local_reason = await asyncio.to_thread(screen_sds_locally, document, as_of)
+
+        if local_result:
+            p_name = local_result["product_name"] or os.path.splitext(f_name)[0]
+            cas_no = local_result["main_cas"]
+            tax_record = local_result["tax_record"]
+            resolution = "Yerel (CAS)"
+        else:
+            # Gemini Analizi (toplu modda diğer SDS'lerle aynı istekte)
+            if batcher is not None:
+                ai_data = await batcher.extract(document, file_stats) or {}
+            else:
+                ai_data = await extract_document_json(SDS_SUMMARY_PROMPT, "sds_ozet", document, file_stats) or {}
         
-        # Vergi Listesinde Ara
-        tax_record = search_tax_db_smart(cas_no, p_name)
+            p_name = ai_data.get("product_name", "Bulunamadı")
+            cas_no = ai_data.get("main_cas", "")
         
+            # Vergi Listesinde Ara
+            tax_record = search_tax_db_smart(cas_no, p_name, as_of=as_of)
+            resolution = "Gemini"
+
         # Rapor Satırı
         row = {
             "G.T.İ.P. *": tax_record.get("gtp", "-") if tax_record else "Eşleşme Yok",
@@ -768,12 +3107,20 @@ async def analyze_single_sds(file_path, ref_data):
             "EK V NOTLAR": tax_record.get("tanim", "-") if tax_record else "Vergi listesinde uygun kayıt bulunamadı.",
             "CAS NR (REF:SDS)": cas_no,
             "KABUL KOŞULU": f"Vergi Oranı: %{tax_record.get('gv_oran', '?')}" if tax_record else "-",
-            "GÖZDEN GEÇİRME TARİHİ ***": check_tax_date_warning(tax_record.get("gecerlilik")) if tax_record else "-",
-            "NOT": f"Dosya: {f_name} | ID: {product_id}"
+            "GÖZDEN GEÇİRME TARİHİ ***": tax_validity_display(tax_record) if tax_record else "-",
+            "NOT": f"Dosya: {f_name} | ID: {product_id}",
+            "ÇÖZÜM": resolution
         }
         
         match_icon = "✅" if tax_record else "⚠️"
-        log_html = f"<div>{match_icon} <b>{p_name}</b> ({cas_no}) -> {row['G.T.İ.P. *']}</div>"
+        log_html = f"<div>{match_icon} <b>{p_name}</b> ({cas_no}) -> {row['G.T.İ.P. *']}"
+        if local_result:
+            log_html += " <span style='background:#E8F5E9; color:#2E7D32; padding:1px 6px; border-radius:4px; font-size:0.8em;'>⚡ Yerel</span></div>"
+        else:
+            log_html += f" <span style='color:#999; font-size:0.8em;'>🤖 Gemini ({local_reason})</span></div>" if local_first else "</div>"
+        savings = format_text_layer_savings(document, file_stats, "sds_ozet") if not local_result else ""
+        if savings:
+            log_html += f"<div style='color:#777; font-size:0.85em; margin-left:20px;'>{savings}</div>"
         
         return row, log_html
 
@@ -784,15 +3131,27 @@ async def analyze_single_sds(file_path, ref_data):
             "NOT": str(e)
         }
         return err_row, f"<div style='color:red'>❌ {f_name}: {e}</div>"
+    finally:
+        merge_llm_stats(stats, file_stats)
 
-async def process_tax_analysis(sds_files, reference_excel):
+async def process_tax_analysis(sds_files, reference_excel, local_first=None, as_of_text=""):
     """
     2. ADIM (PARALEL): SDS'leri eşzamanlı analiz eder.
+    local_first (varsayılan: config 'sds_local_first'): metin katmanlı SDS'ler önce yerel CAS taramasıyla çözülür.
+    as_of_text (Örn: 15.01.2023) girilirse hem yerel tarama hem eşleştirme o tarihte yürürlükte olan liste sürümüyle yapılır.
     """
     global llm_model
     if not llm_model: return "Model hatası.", None
     if not sds_files: return "Lütfen SDS dosyalarını yükleyin.", None
 
+    as_of = None
+    if as_of_text and str(as_of_text).strip():
+        as_of = parse_review_date(as_of_text)
+        if as_of is None:
+            return f"⚠️ Analiz tarihi anlaşılamadı: '{as_of_text}' (Örn: 15.01.2023)", None
+        if get_tax_snapshot(as_of) is None:
+            return f"❌ {as_of.strftime('%d.%m.%Y')} tarihinde yürürlükte olan bir vergi listesi sürümü yok.", None
+
     # Referans Excel varsa oku
     ref_data = {}
     if reference_excel:
@@ -801,20 +3160,45 @@ async def process_tax_analysis(sds_files, reference_excel):
         except: pass
 
     status_log = "<h3>📊 Analiz Durumu (Paralel İşlem Başlatıldı...)</h3>"
+    if as_of is not None:
+        version = tax_versions.find_version(as_of)
+        status_log += f"📅 {as_of.strftime('%d.%m.%Y')} tarihli liste: v{version['id']} ({version['filename']}, yürürlük {version['valid_from']})<br>"
     report_data = []
 
     # --- PARALEL İŞLEM BAŞLANGICI ---
+    # Görüntüleme (poppler havuzu) ve LLM aşaması sınırlı bir kuyrukla bağlıdır: yüzlerce dosyada
+    # bile bellekte sadece kuyruktaki ve işlenmekte olan sayfalar bulunur. İstekler modelin dakikalık
+    # kotasına (rpm/tpm) göre sıraya girer; 429 ve sunucu hataları beklemeli olarak tekrar denenir.
+    run_stats = new_llm_stats()
+    if local_first is None:
+        local_first = app_config.get("sds_local_first", DEFAULT_CONFIG["sds_local_first"])
+    results = [None] * len(sds_files)
+    batcher = DocumentBatcher(SDS_SUMMARY_PROMPT, "sds_ozet")
+    # Eşzamanlılık toplu işlemdeki gibi AIMD ile ayarlanır (Gecikme/429'a göre daralır, normalde genişler)
+    limiter = AdaptiveConcurrencyLimiter(*get_batch_concurrency_bounds())
+
+    async def analyze(index, file_path, document, error):
+        stats = new_llm_stats()
+        started = time.monotonic()
+        try:
+            if error is not None:
+                f_name = os.path.basename(file_path)
+                results[index] = ({"G.T.İ.P. *": "HATA", "HAMMADDE ADI": f_name, "NOT": str(error)},
+                                  f"<div style='color:red'>❌ {f_name}: {error}</div>")
+            else:
+                results[index] = await analyze_single_sds(file_path, ref_data, stats, document, local_first, batcher, as_of)
+        finally:
+            merge_llm_stats(run_stats, stats)
+            await limiter.release_with_stats(stats, time.monotonic() - started)
+
     tasks = []
+    async for index, file_path, document, error in iter_document_images(sds_files, dpi=SDS_RASTER_DPI):
+        await limiter.acquire()
+        tasks.append(asyncio.create_task(analyze(index, file_path, document, error)))
+        del document
+    await asyncio.gather(*tasks)
     
-    # Tüm dosyalar için görev oluştur (Henüz çalıştırma, sadece planla)
-    for file_path in sds_files:
-        tasks.append(analyze_single_sds(file_path, ref_data))
-    
-    # Hepsini aynı anda ateşle!
-    # asyncio.gather tüm görevlerin bitmesini bekler ama hepsi aynı anda çalışır.
-    results = await asyncio.gather(*tasks)
-    
-    # Sonuçları topla
+    # Sonuçları topla (dosya sırasıyla)
     for row_data, log_msg in results:
         report_data.append(row_data)
         status_log += log_msg
@@ -834,6 +3218,12 @@ async def process_tax_analysis(sds_files, reference_excel):
         # Son bir özet ekle
         total_time = datetime.now().strftime("%H:%M:%S")
         status_log += f"<br><hr><b>✅ İşlem Tamamlandı: {total_time}</b>"
+        if local_first:
+            local_count = sum(1 for row in report_data if row.get("ÇÖZÜM") == "Yerel (CAS)")
+            status_log += f"<br>⚡ Yerel çözülen (modelsiz): {local_count} / {len(report_data)} dosya"
+        if batcher.summary():
+            status_log += f"<br>{batcher.summary()}"
+        status_log += f"<br><small>{format_llm_payload_stats(run_stats)}<br>{format_llm_wait_stats(run_stats)}</small>"
         
         return status_log, output_path
     else:
@@ -841,28 +3231,108 @@ async def process_tax_analysis(sds_files, reference_excel):
     
 
 # --- 5. YENİ: TOPLU (BATCH) İŞLEM VE VERİTABANI LİSTELEME ---
-# --- YARDIMCI FONKSİYON: TEK BİR DOSYAYI İŞLER ---
-def process_single_file(file_obj, file_index):
+# --- UYARLANABİLİR EŞZAMANLILIK (AIMD) ---
+# Toplu işlemde aynı anda kaç dosyanın modele gönderileceği sabit değildir:
+# gecikme normal ve hata yoksa sınır yavaşça (toplamsal) artar; gecikme taban değerin
+# katlarına çıkarsa veya 429/5xx yüzünden tekrar deneme olursa sınır yarıya (çarpımsal) iner.
+AIMD_LATENCY_TOLERANCE = 2.0      # Gecikme, taban gecikmenin bu katını aşarsa yavaşlama sayılır
+AIMD_DECREASE_FACTOR = 0.5
+
+class AdaptiveConcurrencyLimiter:
     """
-    Tek bir dosya için LLM isteği atar, JSON parse eder ve veriyi DÖNDÜRÜR.
-    NOT: Bu fonksiyon dosyaya yazma yapmaz, sadece veriyi hazırlar.
+    Eşzamanlı istek sınırını gözlenen gecikme ve hata durumuna göre ayarlayan async semafor.
+    Sınır her zaman [min_limit, max_limit] aralığında kalır.
     """
-    try:
-        # Dosya yolunu güvenli alma
-        try:
-            current_file_path = file_obj.name
-        except AttributeError:
-            current_file_path = str(file_obj)
-            
-        filename_display = os.path.basename(current_file_path)
-        
-        # 1. Resmi Yükle (Senin kodunda tanımlı olduğunu varsayıyorum)
-        image_file = load_file_as_image(current_file_path)
-        if image_file is None:
-            return {"status": "error", "msg": "Resim yüklenemedi", "file": filename_display}
+    def __init__(self, min_limit=1, max_limit=16, initial=4):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.baseline = None          # Yavaş yükselen minimum gecikme (sn)
+        self.last_decrease = 0.0
+        self.history = []             # (zaman, sınır) değişim kaydı
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def release(self, latency, congested=False, throttled=False):
+        """
+        İstek bitince çağrılır. latency: kota/tekrar beklemeleri hariç model süresi.
+        congested: 429/5xx görüldü; throttled: istek kota sınırlayıcısında bekledi (sınır artmaz).
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            # Bekleyenler kilit bırakılınca sınırı yeniden kontrol eder
+            self._condition.notify_all()
+            if latency is None and not congested:
+                return
+            now = time.monotonic()
+            if latency is not None and latency > 0:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * 0.05
+            slow = latency is not None and self.baseline is not None and latency > self.baseline * AIMD_LATENCY_TOLERANCE
+            old_limit = self.limit
+            if congested or slow:
+                # Aynı gecikme penceresinde biten isteklerin hepsi ayrı ayrı düşürmesin
+                if now - self.last_decrease >= (latency or 0):
+                    self.limit = max(self.min_limit, self.limit * AIMD_DECREASE_FACTOR)
+                    self.last_decrease = now
+            elif not throttled:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            if int(self.limit) != int(old_limit):
+                self.history.append((now, int(self.limit)))
+
+    async def release_with_stats(self, stats, elapsed):
+        """
+        release'in bir öğenin LLM sayaçlarıyla (new_llm_stats) çağrılan hali. Model çağrılmadıysa
+        (önbellek isabeti, yerel çözüm, okuma hatası) gecikme ölçümü sayılmaz.
+        """
+        latency = max(0.0, elapsed - stats["throttle_wait"] - stats["backoff_wait"]) if stats["calls"] else None
+        await self.release(latency, congested=stats["retries"] > 0, throttled=stats["throttle_wait"] > 0)
+
+def get_batch_concurrency_bounds():
+    """config.json -> batch_concurrency: {"min", "max", "initial"}"""
+    bounds = dict(DEFAULT_CONFIG["batch_concurrency"])
+    bounds.update(app_config.get("batch_concurrency") or {})
+    return int(bounds["min"]), int(bounds["max"]), int(bounds["initial"])
 
-        # --- JSON ŞABLONU ---
-        example_json_structure = """
+async def run_adaptive_batch(items, worker, limiter, totals=None):
+    """
+    items içindeki her öğe için worker(item, index, stats) çalıştırır; eşzamanlılığı limiter belirler.
+    Sonuçları bittikçe (index, sonuç) olarak verir (async generator).
+    totals verilirse her öğenin LLM sayaçları (new_llm_stats) buna eklenir.
+    Tüketici erken çıkarsa (iptal / generator kapatma) bitmemiş öğeler iptal edilir.
+    """
+    async def run(index, item):
+        await limiter.acquire()
+        stats = new_llm_stats()
+        started = time.monotonic()
+        try:
+            return index, await worker(item, index, stats)
+        finally:
+            if totals is not None:
+                for key in totals:
+                    totals[key] += stats[key]
+            await limiter.release_with_stats(stats, time.monotonic() - started)
+
+    tasks = [asyncio.ensure_future(run(i, item)) for i, item in enumerate(items)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# --- GTIP FORMU ÇIKARIM İSTEMİ (JSON ŞABLONU) ---
+GTIP_FORM_JSON_TEMPLATE = """
         {
             "product_name": "ÜRÜN TİCARİ ADI",
             "brand": "MARKA (Yoksa boş string)",
@@ -889,7 +3359,7 @@ def process_single_file(file_obj, file_index):
         }
         """
 
-        prompt = f"""
+GTIP_FORM_PROMPT = f"""
         GÖREV: Ekteki gümrük sınıflandırma formunu (GTIP TESPİT FORMU) uzman bir kimya mühendisi gibi analiz et.
         
         KURALLAR:
@@ -901,22 +3371,52 @@ def process_single_file(file_obj, file_index):
         6. SADECE JSON döndür. Yorum veya markdown ekleme.
 
         İSTENEN JSON FORMATI:
-        {example_json_structure}
+        {GTIP_FORM_JSON_TEMPLATE}
         """
 
+# --- YARDIMCI FONKSİYON: TEK BİR DOSYAYI İŞLER ---
+async def process_single_file(file_obj, file_index, stats=None, bypass_cache=False, batcher=None):
+    """
+    Tek bir dosya için LLM isteği atar, JSON parse eder ve veriyi DÖNDÜRÜR.
+    NOT: Bu fonksiyon dosyaya yazma yapmaz, sadece veriyi hazırlar.
+    'stats' sözlüğüne kota beklemesi / tekrar deneme / önbellek bilgisi yazılır (AIMD bunu kullanır).
+    Aynı form daha önce işlendiyse yanıt önbellekten gelir (bypass_cache=True ile atlanır).
+    batcher (DocumentBatcher) verilirse form diğerleriyle aynı istekte gönderilebilir.
+    """
+    filename_display = str(file_obj)
+    try:
+        # Dosya yolunu güvenli alma
+        try:
+            current_file_path = file_obj.name
+        except AttributeError:
+            current_file_path = str(file_obj)
+            
+        filename_display = os.path.basename(current_file_path)
+        
+        # 1. Resmi Yükle (Senin kodunda tanımlı olduğunu varsayıyorum)
+        # Dijital PDF'te metin katmanı, diğerlerinde görüntü
+        try:
+            document = await asyncio.to_thread(load_document_for_llm, current_file_path, 300)
+        except Exception as e:
+            print(f"Dosya okuma hatası ({current_file_path}): {e}")
+            document = None
+        if document is None or (document["kind"] == "image" and document["image"] is None):
+            return {"status": "error", "msg": "Resim yüklenemedi", "file": filename_display}
+
         # 2. Model İsteği
         if not llm_model:
             return {"status": "error", "msg": "Model yüklü değil", "file": filename_display}
             
-        response = llm_model.generate_content([prompt, image_file])
-        
-        # 3. JSON Temizliği
-        json_str = response.text.replace("```json", "").replace("```", "").strip()
-        match = re.search(r'\{.*\}', json_str, re.DOTALL)
+        # stats toplu işlemde zaten dosyaya özeldir (AIMD sayaçları)
+        file_stats = stats if stats is not None else new_llm_stats()
+        if batcher is not None:
+            data = await batcher.extract(document, file_stats)
+        else:
+            data = await extract_document_json(GTIP_FORM_PROMPT, "gtip_formu", document, file_stats, bypass_cache)
+        savings = format_text_layer_savings(document, file_stats, "gtip_formu")
         
-        if match:
-            data = json.loads(match.group(0))
-            
+        # 3. JSON Temizliği (parse_llm_json_object)
+        if data:
             # Post-processing (Eksik alanları doldurma)
             data["id"] = f"auto_{int(time.time())}_{file_index}"
             data["source_path"] = filename_display
@@ -926,7 +3426,7 @@ def process_single_file(file_obj, file_index):
                 
             data["version_date"] = datetime.now().strftime("%Y-%m-%d")
             
-            return {"status": "success", "data": data, "file": filename_display}
+            return {"status": "success", "data": data, "file": filename_display, "savings": savings}
         else:
             return {"status": "error", "msg": "JSON parse edilemedi", "file": filename_display}
 
@@ -935,98 +3435,111 @@ def process_single_file(file_obj, file_index):
 
 
 # --- ANA FONKSİYON: PARALEL İŞLEME VE GÜVENLİ YAZMA ---
-def process_batch_files(file_paths, progress=gr.Progress()):
+async def process_batch_files(file_paths, bypass_cache=False, progress=gr.Progress()):
+    """
+    Async generator: her dosya bittikçe (rapor, kartlar) ikilisini günceller.
+    Rapor ve kartlara yalnızca sona ekleme yapılır; Gradio ardışık çıktıların farkını (append)
+    gönderdiği için her adımda tüm HTML yeniden iletilmez.
+    Her başarılı kayıt bittiği anda cases.jsonl'e yazılır; işlem iptal edilirse yazılanlar korunur.
+    """
     global llm_model
-    if not llm_model: return "Model hazır değil, API anahtarını kontrol edin.", ""
-    if not file_paths: return "Lütfen dosya seçin.", ""
+    if not llm_model:
+        yield "Model hazır değil, API anahtarını kontrol edin.", ""
+        return
+    if not file_paths:
+        yield "Lütfen dosya seçin.", ""
+        return
 
     if not isinstance(file_paths, list):
         file_paths = [file_paths]
 
     total_files = len(file_paths)
-    print(f"--- Toplu İşlem Başlatıldı: {total_files} Dosya (Paralel + Kilitli Yazma) ---")
+    min_limit, max_limit, initial = get_batch_concurrency_bounds()
+    limiter = AdaptiveConcurrencyLimiter(min_limit, max_limit, initial)
+    print(f"--- Toplu İşlem Başlatıldı: {total_files} Dosya (Uyarlanabilir Eşzamanlılık {min_limit}-{max_limit} + Kilitli Yazma) ---")
 
     html_report = "<h3>🚀 İşlem Raporu</h3>"
     cards_html = ""
     
-    # --- THREAD POOL BAŞLANGICI ---
-    # max_workers=5: Aynı anda 5 dosya işler.
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        # Görevleri dağıt
-        future_to_file = {executor.submit(process_single_file, f, i): i for i, f in enumerate(file_paths)}
+    completed_count = 0
+    run_stats = new_llm_stats()
+    batcher = DocumentBatcher(GTIP_FORM_PROMPT, "gtip_formu", bypass_cache)
+
+    async def worker(file_obj, file_index, stats):
+        return await process_single_file(file_obj, file_index, stats, bypass_cache, batcher)
+
+    yield html_report, cards_html
+
+    # Görevler bittikçe sonuçları al
+    async for _, res in run_adaptive_batch(file_paths, worker, limiter, totals=run_stats):
+        completed_count += 1
+        progress((completed_count / total_files), desc=f"İşleniyor {completed_count}/{total_files} (eşzamanlı: {int(limiter.limit)})...")
         
-        completed_count = 0
+        status_icon = "❓"
+        status_msg = ""
         
-        # Görevler bittikçe sonuçları al
-        for future in as_completed(future_to_file):
-            completed_count += 1
-            progress((completed_count / total_files), desc=f"İşleniyor {completed_count}/{total_files}...")
-            
-            res = future.result()
+        if res["status"] == "success":
+            new_case_data = res["data"]
+            status_icon = "✅"
+            status_msg = "Başarılı"
+            p_name = new_case_data.get('product_name', 'Bilinmiyor')
             
-            status_icon = "❓"
-            status_msg = ""
-            
-            if res["status"] == "success":
-                new_case_data = res["data"]
-                status_icon = "✅"
-                status_msg = "Başarılı"
-                p_name = new_case_data.get('product_name', 'Bilinmiyor')
-                
-                print(f"-> İşlendi: {p_name}")
+            print(f"-> İşlendi: {p_name}")
 
-                # --- KRİTİK BÖLÜM: DOSYAYA GÜVENLİ YAZMA ---
-                try:
-                    # KİLİT (LOCK) İLE YAZMA: Başka thread yazarken bekler
-                    with file_writer_lock:
-                        with open(CASES_FILE, 'a', encoding='utf-8') as f:
-                            json_line = json.dumps(new_case_data, ensure_ascii=False)
-                            f.write(json_line + "\n")
-                            f.flush()            # Python tamponunu boşalt
-                            os.fsync(f.fileno()) # Diske yazmayı zorla (RunPod için şart)
-                    
-                    print(f"   💾 DİSKE YAZILDI: {p_name}") # Logda bunu görmelisin
-                    
-                except Exception as e:
-                    print(f"!!! KRİTİK YAZMA HATASI: {e}")
-                    status_msg = f"Yazma Hatası: {str(e)}"
-                    status_icon = "💾"
-
-                # HTML KART OLUŞTURMA
-                gtip = new_case_data.get('assigned_gtip', '-')
-                reason = new_case_data.get('short_reason', '-')
-                use_area = new_case_data.get('features', {}).get('use', 'Belirtilmemiş')
-
-                cards_html += f"""
-                <div style="font-family:sans-serif; border:1px solid #ddd; border-radius:8px; margin-bottom:15px; background:white; box-shadow:0 2px 4px rgba(0,0,0,0.05); overflow:hidden;">
-                    <div style="background:#E3F2FD; padding:10px 15px; border-bottom:1px solid #BBDEFB; display:flex; justify-content:space-between; align-items:center;">
-                        <span style="font-weight:bold; color:#1565C0;">{p_name}</span>
-                        <span style="background:#1565C0; color:white; padding:2px 8px; border-radius:4px; font-size:0.9em;">{gtip}</span>
+            # --- KRİTİK BÖLÜM: DOSYAYA GÜVENLİ YAZMA ---
+            # Yazıcıya teslim edilen kayıt iptalden etkilenmez (shield yalnızca beklemeyi korur)
+            try:
+                await asyncio.shield(asyncio.wrap_future(case_writer.submit(new_case_data)))
+                
+                print(f"   💾 DİSKE YAZILDI: {p_name}") # Logda bunu görmelisin
+                
+            except Exception as e:
+                print(f"!!! KRİTİK YAZMA HATASI: {e}")
+                status_msg = f"Yazma Hatası: {str(e)}"
+                status_icon = "💾"
+
+            # HTML KART OLUŞTURMA
+            gtip = new_case_data.get('assigned_gtip', '-')
+            reason = new_case_data.get('short_reason', '-')
+            use_area = new_case_data.get('features', {}).get('use', 'Belirtilmemiş')
+
+            cards_html += f"""
+            <div style="font-family:sans-serif; border:1px solid #ddd; border-radius:8px; margin-bottom:15px; background:white; box-shadow:0 2px 4px rgba(0,0,0,0.05); overflow:hidden;">
+                <div style="background:#E3F2FD; padding:10px 15px; border-bottom:1px solid #BBDEFB; display:flex; justify-content:space-between; align-items:center;">
+                    <span style="font-weight:bold; color:#1565C0;">{p_name}</span>
+                    <span style="background:#1565C0; color:white; padding:2px 8px; border-radius:4px; font-size:0.9em;">{gtip}</span>
+                </div>
+                <div style="padding:15px;">
+                    <div style="font-size:0.85em; color:#999; margin-bottom:5px;">
+                        📅 {new_case_data.get('assignment_date')} | 🧪 {use_area}
                     </div>
-                    <div style="padding:15px;">
-                        <div style="font-size:0.85em; color:#999; margin-bottom:5px;">
-                            📅 {new_case_data.get('assignment_date')} | 🧪 {use_area}
-                        </div>
-                        <div style="background:#f9f9f9; padding:8px; border-left:3px solid #FF9800; font-style:italic; color:#666; font-size:0.9em;">
-                            "{reason}"
-                        </div>
+                    <div style="background:#f9f9f9; padding:8px; border-left:3px solid #FF9800; font-style:italic; color:#666; font-size:0.9em;">
+                        "{reason}"
                     </div>
                 </div>
-                """
-            else:
-                status_icon = "❌"
-                status_msg = res.get("msg", "Hata")
-                print(f"-> HATA: {res['file']} - {status_msg}")
-
-            # Rapor satırı
-            html_report += f"""
-            <div style="border-bottom:1px solid #eee; padding:8px; display:flex; justify-content:space-between;">
-                <span>{status_icon} <b>{res['file']}</b></span>
-                <span style="color:#666; font-size:0.9em;">{status_msg[:30]}</span>
             </div>
             """
+        else:
+            status_icon = "❌"
+            status_msg = res.get("msg", "Hata")
+            print(f"-> HATA: {res['file']} - {status_msg}")
+
+        # Rapor satırı
+        html_report += f"""
+        <div style="border-bottom:1px solid #eee; padding:8px; display:flex; justify-content:space-between;">
+            <span>{status_icon} <b>{res['file']}</b></span>
+            <span style="color:#666; font-size:0.9em;">{status_msg[:30]}</span>
+        </div>
+        """
+        if res.get("savings"):
+            html_report += f"<div style='color:#777; font-size:0.85em; padding:0 8px 8px 28px;'>{res['savings']}</div>"
+        yield html_report, cards_html
 
-    return html_report, cards_html
+    print(f"--- Toplu İşlem Bitti: en yüksek eşzamanlılık {limiter.peak_in_flight}, son sınır {int(limiter.limit)} ---")
+    html_report += (f"<div style='padding:8px; color:#555; font-size:0.9em;'>{format_llm_cache_stats(run_stats)}<br>"
+                    f"{format_llm_payload_stats(run_stats)}<br>{format_llm_wait_stats(run_stats)}"
+                    f"{'<br>' + batcher.summary() if batcher.summary() else ''}</div>")
+    yield html_report, cards_html
 
 
 def get_all_cases_as_df():
@@ -1058,59 +3571,670 @@ def get_all_cases_as_df():
         return pd.DataFrame(), f"Hata: {e}"
 
 # --- 6. ARAMA MOTORU (ORİJİNAL MANTIK KORUNDU) --- 
+# Puanlama orijinal algoritmayla birebir aynıdır (40 / 50 / 15 / 5 / 10 + benzerlik).
+# Farkı: cases.jsonl her aramada okunmaz; bellekte ters indeks tutulur ve sadece
+# puan alabilecek aday kayıtlar puanlanır.
+# Tüm metinler Türkçe duyarlı arama anahtarıyla (fold_search_text) karşılaştırılır.
+CASE_SIMILARITY_THRESHOLD = 0.6
+
+class SubstringIndex:
+    """
+    Metin listesi üzerinde trigram ile alt metin (substring) araması.
+    Adaylar aranan metnin tüm trigramlarını içeren kayıtlardır, sonra 'in' ile doğrulanır.
+    3 karakterden kısa aramalarda liste doğrudan taranır.
+    """
+    def __init__(self):
+        self.texts = []
+        self.postings = {}    # trigram -> [kayıt sırası]
+
+    def add(self, text):
+        pos = len(self.texts)
+        self.texts.append(text)
+        for gram in char_trigrams(text):
+            self.postings.setdefault(gram, []).append(pos)
+
+    def find(self, sub):
+        """sub metnini içeren kayıtların sıralarını (küme) döndürür."""
+        grams = char_trigrams(sub)
+        if not grams:
+            return {pos for pos, text in enumerate(self.texts) if sub in text}
+        lists = sorted((self.postings.get(g, ()) for g in grams), key=len)
+        candidates = set(lists[0])
+        for positions in lists[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(positions)
+        return {pos for pos in candidates if sub in self.texts[pos]}
+
+# --- EMSAL BENZERLİK ARAMASI (KARAKTER N-GRAM TF-IDF) ---
+# Anahtar kelime puanlaması farklı ifade edilmiş aynı kimyayı kaçırabilir
+# ("polyether modified siloxane" / "silicone surfactant"). Bu yüzden emsaller karakter n-gram
+# TF-IDF vektörleriyle de tutulur. N-gram'lar sabit boyuta hash'lenir (sözlük tutulmaz);
+# matris seyrek NumPy dizileridir ve sorgu tek bir vektörel (seyrek) matris-vektör çarpımıdır.
+CASE_VECTOR_DIMENSIONS = 2 ** 18
+CASE_VECTOR_NGRAM_SIZES = (3, 4)
+CASE_VECTOR_IDF_REFRESH_RATIO = 0.2     # Kayıt sayısı bu oranda artınca IDF ve normlar yeniden hesaplanır
+CASE_VECTOR_MIN_SIMILARITY = 0.15       # Bu kosinüs benzerliğinin altındaki emsaller döndürülmez
+CASE_VECTOR_RAG_EXTRA = 2               # RAG bağlamına anahtar kelime sonuçlarına ek olarak alınacak emsal sayısı
+
+def case_vector_text(case):
+    """Benzerlik vektörüne girecek alanlar: ürün adı, kompozisyon, etiketler ve kullanım alanı."""
+    tags = case.get("tags") or []
+    features = case.get("features") if isinstance(case.get("features"), dict) else {}
+    return " ".join([
+        str(case.get("product_name") or ""),
+        str(case.get("composition_text") or ""),
+        " ".join(map(str, tags)) if isinstance(tags, list) else str(tags),
+        str(features.get("use") or ""),
+    ])
+
+@lru_cache(maxsize=1 << 17)
+def ngram_hash(gram):
+    """
+    N-gram'ın süreçten bağımsız özeti (CRC32). Python'un hash()'i her süreçte farklı tohumlandığından
+    çakışmalar ve dolayısıyla benzerlik sıralaması çalıştırmadan çalıştırmaya değişirdi.
+    """
+    return zlib.crc32(gram.encode('utf-8'))
+
+def char_ngram_counts(text, dimensions=CASE_VECTOR_DIMENSIONS):
+    """Kelime sınırlı karakter n-gram'larını hash'leyip {boyut: adet} döndürür."""
+    counts = {}
+    mask = dimensions - 1
+    for word in re.findall(r'\w+', fold_search_text(text)):
+        padded = f" {word} "
+        for n in CASE_VECTOR_NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                slot = ngram_hash(padded[i:i + n]) & mask
+                counts[slot] = counts.get(slot, 0) + 1
+    return counts
+
+class CaseVectorIndex:
+    """
+    Emsallerin TF-IDF vektörleri.
+    - Ekleme satır bazlıdır (CSR: indptr / indices / değer dizileri), yeni emsal sona eklenir.
+    - IDF ve satır normları kayıt sayısı belirgin artınca toplu (vektörel) yeniden hesaplanır ve
+      ağırlıklar sütun (n-gram) sırasına dizilir (CSC). Sorgu sadece kendi n-gram sütunlarına dokunur.
+    - Son yeniden hesaplamadan sonra eklenen satırlar mevcut IDF ile ağırlıklandırılıp CSR'den puanlanır.
+    """
+    def __init__(self, dimensions=CASE_VECTOR_DIMENSIONS):
+        self.dimensions = dimensions
+        self.rows = 0
+        self.nnz = 0
+        self.indptr = np.zeros(1025, dtype=np.int64)
+        self.indices = np.empty(1 << 16, dtype=np.int32)
+        self.row_ids = np.empty(1 << 16, dtype=np.int32)
+        self.tf = np.empty(1 << 16, dtype=np.float32)        # 1 + log(adet)
+        self.weights = np.empty(1 << 16, dtype=np.float32)   # tf * idf / satır normu
+        self.doc_freq = np.zeros(dimensions, dtype=np.int32)
+        self.idf = None
+        self.idf_rows = 0           # IDF'nin (ve sütun düzeninin) hesaplandığı kayıt sayısı
+        self.weighted_rows = 0      # Ağırlıkları hesaplanmış satır sayısı
+        self.col_ptr = None         # Sütun düzeni (CSC): n-gram -> [col_ptr[s], col_ptr[s+1]) aralığı
+        self.col_rows = None
+        self.col_weights = None
+        self._query = np.zeros(dimensions, dtype=np.float32)
+
+    def _grow(self, extra):
+        """Dizi kapasitelerini gerekirse ikiye katlar."""
+        if self.rows + 2 > len(self.indptr):
+            self.indptr = np.resize(self.indptr, len(self.indptr) * 2)
+        needed = self.nnz + extra
+        if needed > len(self.indices):
+            size = max(needed, len(self.indices) * 2)
+            self.indices = np.resize(self.indices, size)
+            self.row_ids = np.resize(self.row_ids, size)
+            self.tf = np.resize(self.tf, size)
+            self.weights = np.resize(self.weights, size)
+
+    def add(self, text):
+        counts = char_ngram_counts(text, self.dimensions)
+        self._grow(len(counts))
+        start, end = self.nnz, self.nnz + len(counts)
+        slots = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        self.indices[start:end] = slots
+        self.row_ids[start:end] = self.rows
+        self.tf[start:end] = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        self.doc_freq[slots] += 1
+        self.nnz = end
+        self.rows += 1
+        self.indptr[self.rows] = end
+
+    def _weigh_rows(self, first_row):
+        """first_row'dan itibaren satırların ağırlıklarını mevcut IDF ile hesaplar ve normalize eder."""
+        seg = slice(self.indptr[first_row], self.nnz)
+        weights = self.tf[seg] * self.idf[self.indices[seg]]
+        local_rows = self.row_ids[seg] - first_row
+        norms = np.sqrt(np.bincount(local_rows, weights=weights.astype(np.float64) ** 2,
+                                    minlength=self.rows - first_row))
+        norms[norms == 0] = 1.0
+        self.weights[seg] = weights / norms[local_rows].astype(np.float32)
+        self.weighted_rows = self.rows
+
+    def _refresh(self):
+        if self.idf is None or self.rows > self.idf_rows * (1 + CASE_VECTOR_IDF_REFRESH_RATIO):
+            self.idf = (np.log((1 + self.rows) / (1 + self.doc_freq)) + 1).astype(np.float32)
+            self.idf_rows = self.rows
+            self._weigh_rows(0)
+            # Sütun düzeni: ağırlıklar n-gram sırasına dizilir
+            indices = self.indices[:self.nnz]
+            order = np.argsort(indices, kind='stable')
+            self.col_rows = self.row_ids[order]
+            self.col_weights = self.weights[order]
+            self.col_ptr = np.zeros(self.dimensions + 1, dtype=np.int64)
+            np.cumsum(np.bincount(indices, minlength=self.dimensions), out=self.col_ptr[1:])
+        elif self.weighted_rows < self.rows:
+            self._weigh_rows(self.weighted_rows)
+
+    def search(self, text, top_k=5, min_similarity=CASE_VECTOR_MIN_SIMILARITY):
+        """Kosinüs benzerliği en yüksek [(benzerlik, satır)] listesi (Eşitlikte önce eklenen)."""
+        if not self.rows:
+            return []
+        self._refresh()
+        counts = char_ngram_counts(text, self.dimensions)
+        if not counts:
+            return []
+        slots = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        q = (1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[slots]
+        q /= np.linalg.norm(q) or 1.0
+
+        # Seyrek matris x sorgu vektörü: sadece sorgudaki n-gram sütunları okunur
+        scores = np.zeros(self.rows, dtype=np.float64)
+        starts = self.col_ptr[slots]
+        lengths = self.col_ptr[slots + 1] - starts
+        total = int(lengths.sum())
+        if total:
+            ends = np.cumsum(lengths)
+            positions = np.repeat(starts - ends + lengths, lengths) + np.arange(total)
+            scores[:self.idf_rows] = np.bincount(
+                self.col_rows[positions], weights=self.col_weights[positions] * np.repeat(q, lengths),
+                minlength=self.idf_rows)
+
+        # Sütun düzeninden sonra eklenen satırlar (CSR'den)
+        if self.rows > self.idf_rows:
+            seg = slice(self.indptr[self.idf_rows], self.nnz)
+            self._query[slots] = q
+            try:
+                contributions = self.weights[seg] * self._query[self.indices[seg]]
+            finally:
+                self._query[slots] = 0
+            scores[self.idf_rows:] = np.bincount(self.row_ids[seg] - self.idf_rows, weights=contributions,
+                                                 minlength=self.rows - self.idf_rows)
+
+        k = min(int(top_k), self.rows)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        ranked = sorted(top.tolist(), key=lambda row: (-scores[row], row))
+        return [(float(scores[row]), row) for row in ranked if scores[row] >= min_similarity]
+
+class CaseQueryBatch:
+    """
+    Bir arama turunun (tek veya toplu sorgu) ara sonuç önbelleği.
+    Aynı terimler, alt metin eşleşmeleri ve NumPy'a çevrilmiş karakter sütunları sorgular arasında paylaşılır.
+    Sadece CaseSearchIndex kilidi altında, tek bir senkronizasyon süresince kullanılır.
+    """
+    def __init__(self):
+        self._cache = {}
+
+    def cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def query_hits(self, index, query_norm):
+        """Ad sorguyu içeren veya sorgu adı içeren kayıtlar (40 puan)."""
+        return self.cached(("name", query_norm),
+                           lambda: index.names_norm.find(query_norm) | index._names_inside(query_norm))
+
+    def term_points(self, index, term):
+        """Terimin kayıt başına puanı: adda 15, kompozisyonda 5, normalize adda 10."""
+        def compute():
+            in_name = index.names.find(term)
+            in_comp = index.comps.find(term) - in_name
+            in_norm = index.names_norm.find(compact_search_key(term)) - in_name - in_comp
+            points = dict.fromkeys(in_norm, 10)
+            points.update(dict.fromkeys(in_comp, 5))
+            points.update(dict.fromkeys(in_name, 15))
+            return points
+        return self.cached(("term", term), compute)
+
+    def char_column(self, index, ch):
+        column = index.char_counts.get(ch)
+        if column is None:
+            return None
+        return self.cached(("char", ch), lambda: np.array(column, dtype=np.int64))
+
+    def name_lengths(self, index):
+        return self.cached(("lengths",), lambda: np.array(index.name_lengths, dtype=np.int64))
+
+class CaseSearchIndex:
+    """
+    cases.jsonl için bellek içi arama indeksi (Ürün adı, normalize ad, GTIP ve kompozisyon)
+    ve aynı sırada tutulan TF-IDF benzerlik vektörleri.
+    Arama anahtarları kayıt eklenirken bir kez hesaplanır, sorgularda tekrar normalize edilmez.
+    Dosya ilk aramada bir kez okunur; sonradan eklenen satırlar (add_case veya dosya sonundan
+    okuma ile) indekse eklenir. Dosya küçülür / değişirse baştan kurulur.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._offset = None       # Dosyada indekslenen bayt sayısı (None: henüz yüklenmedi)
+        self._mtime = None
+        self.cases = []
+        self.names = SubstringIndex()          # fold(product_name)
+        self.names_norm = SubstringIndex()     # compact(product_name)
+        self.gtips_norm = SubstringIndex()     # compact(assigned_gtip)
+        self.comps = SubstringIndex()          # fold(composition_text)
+        self.names_by_norm = {}                # compact(ad) -> [kayıt sırası]
+        self.name_lengths = array('I')
+        self.char_counts = {}                  # karakter -> array('H'), kayıt başına adet
+        self.history_entries = []              # (geçmiş filtre anahtarı, emsal) - tüm kayıtlar, dosya sırasıyla
+        self.vectors = CaseVectorIndex()       # Satır sırası self.cases ile aynı
+
+    def _add(self, case):
+        """Tek bir emsali indekse ekler. Ad/kompozisyonu metin olmayan kayıtlar aramaya alınmaz."""
+        if not isinstance(case, dict):
+            return
+        self.history_entries.append((
+            fold_search_text(f"{case.get('product_name')} {case.get('assigned_gtip')} {case.get('composition_text')}"),
+            case
+        ))
+        p_name = case.get('product_name', '')
+        comp_text = case.get('composition_text', '')
+        if not isinstance(p_name, str) or not isinstance(comp_text, str):
+            return
+        p_name_lower = fold_search_text(p_name)
+        p_name_norm = compact_search_key(p_name)
+        gtip_norm = compact_search_key(case.get('assigned_gtip', ''))
+        comp = fold_search_text(comp_text)
+        pos = len(self.cases)
+        self.cases.append(case)
+        self.names.add(p_name_lower)
+        self.names_norm.add(p_name_norm)
+        self.gtips_norm.add(gtip_norm)
+        self.comps.add(comp)
+        self.names_by_norm.setdefault(p_name_norm, []).append(pos)
+        self.name_lengths.append(len(p_name_lower))
+        self.vectors.add(case_vector_text(case))
+
+        counts = {}
+        for ch in p_name_lower:
+            counts[ch] = counts.get(ch, 0) + 1
+        for ch in counts:
+            if ch not in self.char_counts:
+                self.char_counts[ch] = array('H', [0]) * pos
+        for ch, column in self.char_counts.items():
+            column.append(min(counts.get(ch, 0), 65535))
+
+    def _read_from(self, offset):
+        """Dosyayı offset'ten sonuna kadar okuyup tamamlanmış satırları indekse ekler."""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1     # Yarım kalmış (yazılmakta olan) son satır sonraya bırakılır
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            if not line.strip(): continue
+            try:
+                self._add(json.loads(line))
+            except: continue
+        self._offset = offset + end
+
+    def _sync(self):
+        """Dosya değişikliklerini indekse yansıtır (Kilit altında çağrılır)."""
+        st = os.stat(self.path)
+        if self._offset is not None:
+            if st.st_size == self._offset and st.st_mtime_ns == self._mtime:
+                return
+            if st.st_size >= self._offset:
+                self._read_from(self._offset)
+                self._mtime = st.st_mtime_ns
+                return
+        self._reset()
+        self._read_from(0)
+        self._mtime = st.st_mtime_ns
+
+    def add_case(self, case, line):
+        """
+        Dosyaya yeni yazılan emsali indekse ekler (Yeniden kurulum yapılmaz).
+        Dosya tam olarak bu satır kadar büyüdüyse doğrudan eklenir, aksi halde
+        bir sonraki aramada dosyadan senkronize edilir.
+        """
+        self.add_cases([case], [line])
+
+    def add_cases(self, cases, lines):
+        """add_case'in grup hali: dosya tam olarak bu satırlar kadar büyüdüyse hepsi birlikte eklenir."""
+        with self._lock:
+            if self._offset is None:
+                return
+            st = os.stat(self.path)
+            group_bytes = sum(len(line.encode('utf-8')) for line in lines)
+            if st.st_size == self._offset + group_bytes:
+                try:
+                    for case in cases:
+                        self._add(case)
+                except Exception:
+                    # Yarım eklenen grup indekste kalmasın: bir sonraki aramada dosyadan yeniden kurulur
+                    self._reset()
+                    raise
+                self._offset += group_bytes
+                self._mtime = st.st_mtime_ns
+
+    def _similar_names(self, query_raw, batch):
+        """
+        Ad benzerliği eşiğini geçebilecek kayıtlar.
+        SequenceMatcher oranı, ortak karakter adedi üst sınırıyla (quick_ratio) vektörel olarak elenir;
+        kesin oran sadece kalan adaylar için hesaplanır.
+        """
+        n = len(query_raw)
+        query_counts = {}
+        for ch in query_raw:
+            query_counts[ch] = query_counts.get(ch, 0) + 1
+        matches_ub = np.zeros(len(self.cases), dtype=np.int64)
+        for ch, q_count in query_counts.items():
+            column = batch.char_column(self, ch)
+            if column is not None:
+                matches_ub += np.minimum(column, q_count)
+        total = batch.name_lengths(self) + n
+        ratio_ub = np.where(total > 0, 2.0 * matches_ub / np.maximum(total, 1), 1.0)
+
+        similar = {}
+        for pos in np.nonzero(ratio_ub > CASE_SIMILARITY_THRESHOLD)[0].tolist():
+            similarity = SequenceMatcher(None, query_raw, self.names.texts[pos]).ratio()
+            if similarity > CASE_SIMILARITY_THRESHOLD:
+                similar[pos] = int(similarity * 20)
+        return similar
+
+    def _names_inside(self, query_norm):
+        """Normalize adı, sorgunun (normalize) içinde geçen kayıtlar."""
+        found = set(self.names_by_norm.get("", ()))
+        lengths = {len(name) for name in self.names_by_norm if 0 < len(name) <= len(query_norm)}
+        for length in lengths:
+            for i in range(len(query_norm) - length + 1):
+                found.update(self.names_by_norm.get(query_norm[i:i + length], ()))
+        return found
+
+    def _score(self, query, batch):
+        """Tek sorgunun puanları {kayıt sırası: puan}. Ara sonuçlar batch önbelleğinden paylaşılır."""
+        query_raw = fold_search_text(query).strip()
+        query_norm = compact_search_key(query)
+        scores = {}
+
+        # Puanlama Algoritması (Orijinal)
+        if query_norm:
+            for pos in batch.query_hits(self, query_norm):
+                scores[pos] = scores.get(pos, 0) + 40
+            for pos in batch.cached(("gtip", query_norm), lambda: self.gtips_norm.find(query_norm)):
+                scores[pos] = scores.get(pos, 0) + 50
+
+        for term in query_raw.split():
+            for pos, points in batch.term_points(self, term).items():
+                scores[pos] = scores.get(pos, 0) + points
+
+        for pos, points in self._similar_names(query_raw, batch).items():
+            scores[pos] = scores.get(pos, 0) + points
+        return scores
+
+    def search_many(self, queries, limit=5):
+        """
+        Birden fazla sorguyu tek seferde puanlar (Toplu RAG için).
+        İndeks bir kez senkronize edilir; terim / alt metin eşleşmeleri ve karakter sütunları
+        sorgular arasında paylaşılır, aynı sorgu bir kez puanlanır.
+        Dönüş: sorgu sırasıyla [(en alakalı emsaller, puanı 0'dan büyük toplam kayıt sayısı)]
+        """
+        with self._lock:
+            self._sync()
+            batch = CaseQueryBatch()
+            results = {}
+            for query in queries:
+                if query not in results:
+                    scores = self._score(query, batch)
+                    # Eşit puanda dosyada önce gelen kayıt önce gelir
+                    ranked = sorted((pos for pos, score in scores.items() if score > 0), key=lambda pos: (-scores[pos], pos))
+                    results[query] = ([self.cases[pos] for pos in ranked[:int(limit)]], len(ranked))
+            return [results[query] for query in queries]
+
+    def search(self, query, limit=5):
+        """Dönüş: (en alakalı emsaller, puanı 0'dan büyük toplam kayıt sayısı)."""
+        return self.search_many([query], limit)[0]
+
+    def similar(self, text, limit=5, min_similarity=CASE_VECTOR_MIN_SIMILARITY):
+        """Metne vektör (n-gram TF-IDF) benzerliği en yüksek emsaller: [(benzerlik, emsal)]."""
+        with self._lock:
+            self._sync()
+            return [(score, self.cases[row]) for score, row in self.vectors.search(text, limit, min_similarity)]
+
+    def filter_cases(self, filter_text=""):
+        """Geçmiş ekranı için: filtreyi içeren emsaller, en yeniden eskiye (Hazır anahtarlar üzerinden)."""
+        key = fold_search_text(filter_text)
+        with self._lock:
+            self._sync()
+            return [case for case_key, case in reversed(self.history_entries) if key in case_key]
+
+# --- EMSAL KAYIT YAZICISI (GRUP COMMIT) ---
+# Tüm üreticilerin kayıtları tek bir yazıcı thread'inde toplanır ve gruplar halinde tek write + tek fsync ile
+# diske indirilir. Üretici (submit'in döndürdüğü Future) ancak kaydı fsync edildikten sonra onaylanır.
+TORN_LINES_FILE = os.path.join(BASE_DIR, "cases_yarim_satirlar.txt")
+
+def get_case_writer_settings():
+    """config.json -> case_writer: {"max_delay_ms", "max_group"}. Geçersiz değerler yerine varsayılan kullanılır."""
+    defaults = DEFAULT_CONFIG["case_writer"]
+    settings = dict(defaults)
+    settings.update(app_config.get("case_writer") or {})
+    try:
+        max_delay_ms = max(0.0, float(settings["max_delay_ms"]))
+    except (TypeError, ValueError):
+        print(f"Geçersiz case_writer.max_delay_ms: {settings['max_delay_ms']!r}, varsayılan kullanılıyor.")
+        max_delay_ms = float(defaults["max_delay_ms"])
+    try:
+        max_group = max(1, int(settings["max_group"]))
+    except (TypeError, ValueError):
+        print(f"Geçersiz case_writer.max_group: {settings['max_group']!r}, varsayılan kullanılıyor.")
+        max_group = int(defaults["max_group"])
+    return {"max_delay_ms": max_delay_ms, "max_group": max_group}
+
+def repair_torn_jsonl_tail(path):
+    """
+    Yarıda kalmış (\n ile bitmeyen) son satırı onarır: geçerli JSON ise sonuna \n eklenir, değilse
+    satır TORN_LINES_FILE'a taşınıp dosya son tam satırdan kesilir. Yapılan işlemi döndürür (yoksa None).
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return None
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return None
+        # Son satır başını bulmak için dosya sonundan geriye doğru blok blok oku
+        pos = size
+        tail = b""
+        while pos > 0 and b"\n" not in tail:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+        line_start = pos + tail.rfind(b"\n") + 1 if b"\n" in tail else 0
+        fragment = tail[line_start - pos:]
+        try:
+            json.loads(fragment.decode('utf-8'))
+            f.seek(size)
+            f.write(b"\n")
+            action = "Son satır geçerli, satır sonu eklendi"
+        except Exception:
+            with open(TORN_LINES_FILE, 'ab') as torn:
+                torn.write(fragment + b"\n")
+            f.truncate(line_start)
+            action = f"Yarım son satır ({len(fragment)} bayt) {os.path.basename(TORN_LINES_FILE)} dosyasına taşındı"
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"{os.path.basename(path)} onarıldı: {action}")
+    return action
+
+class CaseGroupWriter:
+    """
+    cases.jsonl için tek yazıcılı grup commit. submit(kayıt) bir Future döndürür; Future kayıt
+    fsync ile diske indiğinde True ile, yazma başarısız olursa hatayla tamamlanır.
+    Yazıcı ilk kaydı aldıktan sonra en fazla max_delay_ms kadar başka kayıt bekler (grup büyüsün diye).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._cond = Condition()
+        self._queue = []
+        self._thread = None
+        self._closed = False
+        self.stats = {"records": 0, "groups": 0, "largest_group": 0, "index_errors": 0}
+
+    def submit(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        future = Future()
+        with self._cond:
+            if self._closed:
+                future.set_exception(RuntimeError("Emsal yazıcısı kapatıldı"))
+                return future
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="case-writer", daemon=True)
+                self._thread.start()
+            self._queue.append((record, line, future))
+            self._cond.notify()
+        return future
+
+    def close(self, timeout=30):
+        """Yeni kayıt kabulünü durdurur ve kuyruktaki kayıtlar diske inene kadar bekler (Çıkışta atexit ile çağrılır)."""
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _next_group(self):
+        """Sıradaki grup; kapatıldıysa ve kuyruk boşsa None."""
+        settings = get_case_writer_settings()
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            deadline = time.monotonic() + settings["max_delay_ms"] / 1000
+            while len(self._queue) < settings["max_group"] and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            group, self._queue = self._queue[:settings["max_group"]], self._queue[settings["max_group"]:]
+            return group
+
+    def _commit(self, group):
+        data = "".join(line for _, line, _ in group).encode('utf-8')
+        with file_writer_lock:
+            with open(self.path, 'ab') as f:
+                start = f.seek(0, os.SEEK_END)
+                try:
+                    f.write(data)
+                    f.flush()            # Python tamponunu boşalt
+                    os.fsync(f.fileno()) # Diske yazmayı zorla (RunPod için şart)
+                except Exception:
+                    # Yarım grup dosyada kalmasın (Onaylanmamış kayıtlar geri alınır)
+                    f.truncate(start)
+                    raise
+            # Arama indeksine ekle (İndeks yeniden kurulmaz). Kayıtlar artık diskte olduğundan
+            # indeks hatası yazmayı başarısız saymaz; indeks bir sonraki aramada dosyadan kurulur.
+            try:
+                case_index.add_cases([record for record, _, _ in group], [line for _, line, _ in group])
+            except Exception as e:
+                self.stats["index_errors"] += 1
+                print(f"Emsal indeksi güncellenemedi ({len(group)} kayıt diske yazıldı): {e}")
+
+    def _run(self):
+        group = None
+        try:
+            while True:
+                group = self._next_group()
+                if group is None:
+                    return
+                try:
+                    self._commit(group)
+                except Exception as e:
+                    print(f"!!! KRİTİK YAZMA HATASI ({len(group)} kayıt): {e}")
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                self.stats["records"] += len(group)
+                self.stats["groups"] += 1
+                self.stats["largest_group"] = max(self.stats["largest_group"], len(group))
+                for _, _, future in group:
+                    future.set_result(True)
+        except BaseException as e:
+            # Thread beklenmedik şekilde ölürse bekleyen üreticiler askıda kalmasın; sonraki submit yeni thread açar
+            print(f"!!! Emsal yazıcısı durdu: {e}")
+            with self._cond:
+                pending, self._queue = (group or []) + self._queue, []
+                self._thread = None
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+def repair_cases_file():
+    """Açılışta çağrılır: cases.jsonl'in yarım son satırını, emsal indeksi dosyayı ilk kez okumadan önce onarır."""
+    # İndeks \n ile bitmeyen son satırı atlar; onarılmazsa tam ama satır sonu olmayan kayıt aramada görünmezdi
+    with file_writer_lock:
+        return repair_torn_jsonl_tail(CASES_FILE)
+
+case_writer = CaseGroupWriter(CASES_FILE)
+atexit.register(case_writer.close)
+case_index = CaseSearchIndex(CASES_FILE)
+
 def search_jsonl_directly(query, limit=5):
     if not os.path.exists(CASES_FILE):
         return [], "Veri dosyası (cases.jsonl) bulunamadı."
 
-    def normalize(text):
-        return re.sub(r'[\W_]+', '', str(text).lower())
+    try:
+        top_cases, total = case_index.search(query, limit)
+        if not top_cases: return [], "Eşleşme bulunamadı."
+        return top_cases, f"{total} kayıt bulundu, en alakalı {len(top_cases)} gösteriliyor."
+
+    except Exception as e:
+        return [], f"Arama hatası: {e}"
 
-    results = []
-    query_raw = query.lower().strip()
-    query_norm = normalize(query) 
-    query_terms = query_raw.split() 
+def search_jsonl_batch(queries, limit=5):
+    """
+    search_jsonl_directly'nin toplu hali: tüm sorgular indeks üzerinde tek turda puanlanır.
+    Dönüş: sorgu sırasıyla [(emsaller, mesaj)]
+    """
+    if not os.path.exists(CASES_FILE):
+        return [([], "Veri dosyası (cases.jsonl) bulunamadı.")] * len(queries)
 
     try:
-        with open(CASES_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        results = []
+        for top_cases, total in case_index.search_many(list(queries), limit):
+            if not top_cases:
+                results.append(([], "Eşleşme bulunamadı."))
+            else:
+                results.append((top_cases, f"{total} kayıt bulundu, en alakalı {len(top_cases)} gösteriliyor."))
+        return results
 
-        for line in lines:
-            if not line.strip(): continue
-            try:
-                case = json.loads(line)
-                score = 0
-                
-                p_name = case.get('product_name', '')
-                p_name_lower = p_name.lower()
-                p_name_norm = normalize(p_name)
-                gtip = str(case.get('assigned_gtip', ''))
-                gtip_norm = normalize(gtip)
-                comp = case.get('composition_text', '').lower()
-
-                # Puanlama Algoritması (Orijinal)
-                if query_norm and (query_norm in p_name_norm or p_name_norm in query_norm):
-                    score += 40
-                if query_norm and (query_norm in gtip_norm):
-                    score += 50
-                for term in query_terms:
-                    if term in p_name_lower: score += 15
-                    elif term in comp: score += 5
-                    elif normalize(term) in p_name_norm: score += 10
-
-                similarity = SequenceMatcher(None, query_raw, p_name_lower).ratio()
-                if similarity > 0.6: score += int(similarity * 20)
-
-                if score > 0: results.append((score, case))
-            except: continue
-        
-        results.sort(key=lambda x: x[0], reverse=True)
-        top_cases = [r[1] for r in results[:int(limit)]]
-        
-        if not top_cases: return [], "Eşleşme bulunamadı."
-        return top_cases, f"{len(results)} kayıt bulundu, en alakalı {len(top_cases)} gösteriliyor."
+    except Exception as e:
+        return [([], f"Arama hatası: {e}")] * len(queries)
 
+def find_similar_cases(text, limit=5, exclude=()):
+    """
+    Anahtar kelime eşleşmesi olmasa da içerik olarak benzeyen emsaller (Tamamen yerel, API çağrısı yok).
+    'exclude' içindeki emsaller (örn. anahtar kelime sonuçları) atlanır.
+    """
+    if not os.path.exists(CASES_FILE):
+        return []
+    excluded = {id(case) for case in exclude}
+    try:
+        matches = case_index.similar(text, limit + len(excluded))
     except Exception as e:
-        return [], f"Arama hatası: {e}"
+        print(f"Benzerlik arama hatası: {e}")
+        return []
+    return [case for _, case in matches if id(case) not in excluded][:limit]
 
 async def extract_keywords_from_image(image):
     global llm_model
@@ -1132,7 +4256,7 @@ async def extract_keywords_from_image(image):
     """
     
     try:
-        response = await llm_model.generate_content_async([prompt, image])
+        response = await llm_generate_async([prompt, image], cache="anahtar_kelime")
         return response.text.strip()
     except Exception as e:
         return f"Hata: {str(e)}"
@@ -1144,9 +4268,13 @@ async def classify_batch_with_metadata(files, metadata_df, pasted_image_path):
     - Kullanıcının tabloda yaptığı isim değişikliklerini (Rename) esas alır.
     - Dosya/Resim sırası ile Tablo satır sırasını eşleştirir (Index Matching).
     - Hem toplu dosyaları hem de yapıştırılan tekil görseli işler.
+    - Dosyalar aynı anda en fazla 'classification_concurrency' (config.json) adet işlenir.
+      Async generator: her dosya bittikçe rapor (tablo sırasıyla) güncellenerek gönderilir.
     """
     global llm_model
-    if not llm_model: return "Model hatası."
+    if not llm_model:
+        yield "Model hatası."
+        return
     
     # 1. İşlenecek Kaynakları Sırayla Listele (Sıra Önemli: Önce Dosyalar, Sonra Paste)
     # Bu sıralama create_metadata_table fonksiyonundaki sıralamayla AYNI olmalı.
@@ -1159,7 +4287,9 @@ async def classify_batch_with_metadata(files, metadata_df, pasted_image_path):
     if pasted_image_path:
         resource_paths.append(pasted_image_path)
 
-    if not resource_paths: return "Lütfen en az bir dosya yükleyin veya görsel yapıştırın."
+    if not resource_paths:
+        yield "Lütfen en az bir dosya yükleyin veya görsel yapıştırın."
+        return
 
     # 2. Metadata Tablosunu Oku
     meta_rows = []
@@ -1173,10 +4303,10 @@ async def classify_batch_with_metadata(files, metadata_df, pasted_image_path):
     if not meta_rows:
         meta_rows = [["", "", "", ""]] * len(resource_paths)
 
-    final_report = "<h3>🧠 Detaylı Sınıflandırma Raporu</h3>"
+    report_header = "<h3>🧠 Detaylı Sınıflandırma Raporu</h3>"
 
-    # --- ANA DÖNGÜ (SIRALI EŞLEŞTİRME) ---
     # Kaynak dosyalar ile tablodaki satırları sırasıyla (zip) eşleştiriyoruz.
+    run_items = []
     for i, f_path in enumerate(resource_paths):
         
         # O anki dosya için tablodaki veriyi çek
@@ -1192,20 +4322,46 @@ async def classify_batch_with_metadata(files, metadata_df, pasted_image_path):
         else:
             display_filename = os.path.basename(f_path)
             p_name, comp, use = "", "", ""
+        run_items.append((f_path, display_filename, p_name, comp, use))
+
+    # --- RAG: TÜM DOSYALARIN EMSALLERİ TEK SEFERDE (LLM ÇAĞRILARINDAN ÖNCE) ---
+    # Kullanıcı girdileri dahil edilir. Sorgular emsal indeksinde tek turda puanlanır.
+    rag_results = search_jsonl_batch(
+        [f"{p_name} {comp} {display_filename}" for _, display_filename, p_name, comp, _ in run_items], limit=3)
+
+    # --- DOSYA BAŞINA İŞLEM (Semafor ile sınırlı eşzamanlılık) ---
+    semaphore = asyncio.Semaphore(get_classification_concurrency())
+    run_stats = new_llm_stats()
+
+    def analysis_card(header_name, body, timing, streaming):
+        # Akış sürerken kart açık durur, metin geldikçe büyür; bitince eski (kapalı) görünümüne döner
+        badge = "✍️ Yazılıyor..." if streaming else "Analizi Göster ⬇️"
+        return f"""
+            <details {'open' if streaming else ''} style="background:white; border:1px solid #bdc3c7; margin-bottom:15px; padding:0; border-radius:8px; overflow:hidden;">
+                <summary style="cursor:pointer; background:#ecf0f1; padding:12px 15px; font-weight:bold; color:#2c3e50; display:flex; justify-content:space-between; align-items:center;">
+                    <span>📄 {header_name}</span>
+                    <span style="font-size:0.85em; color:#7f8c8d; background:white; padding:3px 8px; border-radius:10px;">{badge}</span>
+                </summary>
+                <div style="padding:20px; line-height:1.6;">
+                    {body}
+                </div>
+                <div style="padding:0 20px 10px; font-size:0.8em; color:#95a5a6;">{timing}</div>
+            </details>
+            """
+
+    async def classify_one(item, similar_cases, publish):
+        f_path, display_filename, p_name, comp, use = item
 
         # --- GÖRÜNÜM AYARI ---
         # Başlıkta görünecek isim: Varsa Ürün Adı, yoksa Dosya Adı
         final_header_name = p_name if p_name else display_filename
 
         try:
-            # Görseli Yükle
-            img = load_file_as_image(f_path)
-            if img is None: raise Exception("Dosya formatı okunamadı.")
+            # Belgeyi hazırla: dijital PDF'te metin katmanı, değilse görsel (event loop'u bloklamasın diye thread'de)
+            document = await asyncio.to_thread(load_document_for_llm, f_path, 300)
+            if document["kind"] == "image" and document["image"] is None: raise Exception("Dosya formatı okunamadı.")
 
-            # 1. RAG (Arama - Kullanıcı girdilerini dahil et)
-            search_query = f"{p_name} {comp} {display_filename}"
-            similar_cases, _ = search_jsonl_directly(search_query, limit=3)
-            
+            # 1. RAG (Emsaller yukarıda toplu olarak bulundu)
             context_text = "SİSTEMDEKİ BENZER EMSALLER (Referans Al):\n"
             if similar_cases:
                 for c in similar_cases:
@@ -1247,37 +4403,78 @@ async def classify_batch_with_metadata(files, metadata_df, pasted_image_path):
             </div>
             """
             
-            # Model İsteği
-            response = await llm_model.generate_content_async([prompt, img])
-            
+            # Model İsteği (Akışlı: metin geldikçe karta yazılır)
+            started = time.perf_counter()
+            first_token = None
+            text = ""
+            async for chunk in llm_stream_async(document_llm_parts(prompt, document), run_stats, cache="asistan_siniflandirma"):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                text += chunk
+                publish(analysis_card(final_header_name, text, f"⚡ İlk token: {first_token:.1f} sn", True))
+            timing = f"⚡ İlk token: {first_token or 0:.1f} sn | Toplam: {time.perf_counter() - started:.1f} sn"
+
             # Loglama (Geçmişe senin verdiğin isimle kaydeder)
-            log_classification_to_history(display_filename, p_name, comp, response.text)
+            log_classification_to_history(display_filename, p_name, comp, text)
 
-            # Rapor HTML'ine Ekle
-            final_report += f"""
-            <details style="background:white; border:1px solid #bdc3c7; margin-bottom:15px; padding:0; border-radius:8px; overflow:hidden;">
-                <summary style="cursor:pointer; background:#ecf0f1; padding:12px 15px; font-weight:bold; color:#2c3e50; display:flex; justify-content:space-between; align-items:center;">
-                    <span>📄 {final_header_name}</span>
-                    <span style="font-size:0.85em; color:#7f8c8d; background:white; padding:3px 8px; border-radius:10px;">Analizi Göster ⬇️</span>
-                </summary>
-                <div style="padding:20px; line-height:1.6;">
-                    {response.text}
-                </div>
-            </details>
-            """
+            # Rapor HTML'i
+            return analysis_card(final_header_name, text, timing, False)
 
         except Exception as e:
             print(f"Hata ({display_filename}): {e}")
-            final_report += f"<div style='color:white; background:#e74c3c; padding:10px; margin-bottom:10px; border-radius:5px;'>❌ <b>{display_filename}</b> hatası: {str(e)}</div>"
+            return f"<div style='color:white; background:#e74c3c; padding:10px; margin-bottom:10px; border-radius:5px;'>❌ <b>{display_filename}</b> hatası: {str(e)}</div>"
+
+    # --- ANA DÖNGÜ: Kartlar (akış halindekiler dahil) yerine konur, bekleyenler yer tutucu olarak görünür ---
+    # Akış parçaları kuyrukta biriktirilir; arayüz en fazla STREAM_RENDER_INTERVAL'da bir yenilenir.
+    cards = [None] * len(run_items)
+    updates = asyncio.Queue()
+
+    async def run(idx):
+        async with semaphore:
+            card = await classify_one(run_items[idx], rag_results[idx][0],
+                                      lambda html: updates.put_nowait((idx, html, False)))
+        updates.put_nowait((idx, card, True))
+
+    def render():
+        parts = [report_header]
+        for (_, display_filename, p_name, _, _), card in zip(run_items, cards):
+            parts.append(card if card is not None else
+                         f"<div style='color:#7f8c8d; padding:8px 12px; margin-bottom:10px; border:1px dashed #ccc; border-radius:8px;'>⏳ {p_name or display_filename} işleniyor...</div>")
+        if remaining == 0 and run_stats["streams"]:
+            parts.append(f"<div style='font-size:0.85em; color:#7f8c8d;'>{format_llm_stream_stats(run_stats)}</div>")
+        return "".join(parts)
+
+    remaining = len(run_items)
+    yield render()
+    tasks = [asyncio.create_task(run(idx)) for idx in range(len(run_items))]
+    try:
+        while remaining:
+            event = await updates.get()
+            while True:
+                idx, card, done = event
+                cards[idx] = card
+                remaining -= done
+                if updates.empty():
+                    break
+                event = updates.get_nowait()
+            yield render()
+            if remaining:
+                await asyncio.sleep(STREAM_RENDER_INTERVAL)
+    finally:
+        # Kullanıcı işlemi durdurursa (generator kapatılırsa) devam eden istekler iptal edilir
+        for task in tasks:
+            task.cancel()
 
-    return final_report
 async def classify_product_smart(product_name, composition, use, image_files):
     """
     GÜNCELLENDİ: Hem tekil metin girdisi hem de ÇOKLU DOSYA (Batch) desteği.
     Eğer 'image_files' bir liste ise toplu analiz yapar, değilse tekil analiz yapar.
+    Async generator: model yanıtı akış halinde geldikçe rapor güncellenerek gönderilir.
     """
     global llm_model
-    if not llm_model: return "Model hatası. Ayarları kontrol edin."
+    if not llm_model:
+        yield "Model hatası. Ayarları kontrol edin."
+        return
 
     # --- SENARYO 1: ÇOKLU DOSYA YÜKLENMİŞSE (BATCH SDS ANALİZİ) ---
     # Gradio 'file_count="multiple"' olduğunda liste gönderir.
@@ -1302,29 +4499,39 @@ async def classify_product_smart(product_name, composition, use, image_files):
                 """
                 
                 # Hızlı olması için RAG kullanmadan direkt görsel analizi yapıyoruz
-                response = await llm_model.generate_content_async([batch_prompt, img])
-                
-                # Akordeon (Açılır/Kapanır) Yapısı
-                final_report += f"""
-                <details style="background:white; border:1px solid #ccc; margin-bottom:10px; padding:10px; border-radius:5px;">
+                # Akordeon (Açılır/Kapanır) Yapısı; yazılırken açık durur
+                def card(text, streaming):
+                    return f"""
+                <details {'open' if streaming else ''} style="background:white; border:1px solid #ccc; margin-bottom:10px; padding:10px; border-radius:5px;">
                     <summary style="cursor:pointer; font-weight:bold; color:#2c3e50;">
-                        📄 {os.path.basename(img_path)} (Tıkla & Gör)
+                        📄 {os.path.basename(img_path)} {'(✍️ Yazılıyor...)' if streaming else '(Tıkla & Gör)'}
                     </summary>
                     <div style="margin-top:10px; color:#333;">
-                        {response.text}
+                        {text}
                     </div>
                 </details>
                 """
+
+                text = ""
+                last_render = 0.0
+                async for chunk in llm_stream_async([batch_prompt, img], cache="toplu_siniflandirma"):
+                    text += chunk
+                    if time.perf_counter() - last_render >= STREAM_RENDER_INTERVAL:
+                        last_render = time.perf_counter()
+                        yield final_report + card(text, True)
+                final_report += card(text, False)
             except Exception as e:
                 final_report += f"<div style='color:red;'>❌ {os.path.basename(img_path)} hatası: {e}</div>"
-        
-        return final_report
+            yield final_report
+        return
 
     # --- SENARYO 2: TEKİL GİRİŞ (ESKİ MANTIK) ---
     else:
         # 1. RAG (Benzer Emsalleri Bul)
         search_text = f"{product_name} {composition}"
         similar_cases, _ = search_jsonl_directly(search_text, limit=3)
+        # Farklı kelimelerle tanımlanmış ama içerik olarak benzeyen emsaller (n-gram vektör benzerliği)
+        similar_cases = similar_cases + find_similar_cases(f"{search_text} {use}", limit=CASE_VECTOR_RAG_EXTRA, exclude=similar_cases)
         
         context_text = "SİSTEMDEKİ BENZER EMSALLER (Referans Al):\n"
         if similar_cases:
@@ -1368,11 +4575,17 @@ async def classify_product_smart(product_name, composition, use, image_files):
             except:
                 pass # Resim açılamazsa metinle devam et
         
+        text = ""
         try:
-            response = await llm_model.generate_content_async(inputs)
-            return response.text
+            last_render = 0.0
+            async for chunk in llm_stream_async(inputs, cache="siniflandirma"):
+                text += chunk
+                if time.perf_counter() - last_render >= STREAM_RENDER_INTERVAL:
+                    last_render = time.perf_counter()
+                    yield text
+            yield text
         except Exception as e:
-            return f"Hata oluştu: {str(e)}"
+            yield f"{text}\n\nHata oluştu: {str(e)}" if text else f"Hata oluştu: {str(e)}"
 
 async def search_and_explain(query, limit, image_for_log=None):
     global llm_model
@@ -1396,7 +4609,7 @@ async def search_and_explain(query, limit, image_for_log=None):
                 summary_for_ai.append({"id": idx, "urun": c.get('product_name'), "icerik": c.get('composition_text')[:100]})
             
             prompt = f"KULLANICI: {query}. KAYITLAR: {json.dumps(summary_for_ai)}. Her biri için tek cümlelik ilişki yorumu yap. JSON Çıktı: [{{'id':0, 'yorum':'...'}}]"
-            resp = await llm_model.generate_content_async(prompt)
+            resp = await llm_generate_async(prompt)
             clean = resp.text.replace("```json","").replace("```","").strip()
             match = re.search(r'\[.*\]', clean, re.DOTALL)
             if match:
@@ -1436,6 +4649,23 @@ async def search_and_explain(query, limit, image_for_log=None):
 
 TAX_DB_FILE = os.path.join(BASE_DIR, "vergi_listesi.jsonl")
 TAX_META_FILE = os.path.join(BASE_DIR, "vergi_meta.json")
+TAX_VERSIONS_DIR = os.path.join(BASE_DIR, "vergi_surumleri")
+
+# Süreç genelinde paylaşılan vergi listesi önbelleği ve sürüm geçmişi
+tax_versions = TaxVersionStore(TAX_VERSIONS_DIR)
+tax_db = TaxDatabase(TAX_DB_FILE, share=tax_versions.share_records)
+_tax_databases = {}                 # mutlak yol -> TaxDatabase (varsayılan liste dışındaki dosyalar)
+_tax_databases_lock = Lock()
+
+def get_tax_database(path):
+    """Verilen vergi listesi dosyasının paylaşılan TaxDatabase nesnesi (Yol başına tek örnek)."""
+    key = os.path.abspath(path)
+    if key == os.path.abspath(tax_db.path):
+        return tax_db
+    with _tax_databases_lock:
+        if key not in _tax_databases:
+            _tax_databases[key] = TaxDatabase(path)
+        return _tax_databases[key]
 
 def get_tax_db_status():
     """Sisteme en son ne zaman vergi listesi yüklendiğini kontrol eder."""
@@ -1443,19 +4673,65 @@ def get_tax_db_status():
         try:
             with open(TAX_META_FILE, 'r', encoding='utf-8') as f:
                 meta = json.load(f)
-            return f"✅ Mevcut Liste: {meta.get('filename')} (Yükleme: {meta.get('upload_date')})"
+            version_info = f" | Sürüm v{meta['version']} (Yürürlük: {meta.get('valid_from')})" if meta.get("version") else ""
+            return f"✅ Mevcut Liste: {meta.get('filename')} (Yükleme: {meta.get('upload_date')}){version_info} | {format_tax_db_stats()}"
         except:
             return "⚠️ Veri dosyası bozuk."
     return "❌ Henüz bir vergi listesi yüklenmedi."
 
-def process_and_save_tax_excel(file_obj):
+def list_expiring_tax_records():
+    """Süresi dolmuş veya 365 gün içinde dolacak GTIP'leri hazır görünümden tablo olarak döndürür."""
+    columns = ["GTIP", "Gözden Geçirme Tarihi", "Kalan Gün", "Durum", "Eşya Tanımı"]
+    if not os.path.exists(TAX_DB_FILE):
+        return pd.DataFrame(columns=columns), "❌ Henüz bir vergi listesi yüklenmedi."
+
+    snapshot = tax_db.snapshot()
+    view = get_tax_expiry_view(snapshot)
+    rows = []
+    for expiry, pos in view["expiring"]:
+        rec = snapshot.records[pos]
+        days_left = (expiry - view["date"]).days
+        rows.append([
+            rec.get("gtp", "-"),
+            expiry.isoformat(),
+            days_left,
+            "⚫ SÜRESİ DOLMUŞ" if days_left <= 0 else "🔴 KRİTİK - <1 YIL",
+            rec.get("tanim", "")[:150]
+        ])
+    return pd.DataFrame(rows, columns=columns), f"{len(rows)} kayıt listelendi (Hesaplama tarihi: {view['date'].isoformat()})."
+
+def list_tax_versions():
+    """Yüklenen vergi listesi sürümlerini (en yenisi üstte) tablo olarak döndürür."""
+    columns = ["Sürüm", "Dosya", "Yürürlük", "Yükleme", "Kayıt", "Eklenen", "Değişen", "Kaldırılan", "Durum"]
+    active = tax_versions.find_version()
+    rows = [
+        [f"v{v['id']}", v["filename"], v["valid_from"], v["upload_date"], v["total_records"],
+         v.get("added", "-"), v.get("changed", "-"), v.get("removed", "-"),
+         "✅ Güncel" if active and active["id"] == v["id"] else ""]
+        for v in reversed(tax_versions.list_versions())
+    ]
+    return pd.DataFrame(rows, columns=columns)
+
+def process_and_save_tax_excel(file_obj, valid_from_text=""):
     """
     Yüklenen Excel (V Sayılı Liste) dosyasını işler ve JSONL formatına çevirip kaydeder.
     GÜNCELLENDİ: İşlem sonunda anlık durumu (get_tax_db_status) döndürür.
+    Her yükleme sürüm olarak saklanır; aynı içerik tekrar yüklenirse atlanır,
+    değişen listede indeksler sadece fark (eklenen/değişen/kaldırılan) üzerinden güncellenir.
     """
     if file_obj is None:
         return "Lütfen bir Excel dosyası yükleyin."
 
+    # Yürürlük tarihi: boşsa bugün. Geçmiş tarihli listeler arşive eklenir, güncel listeyi değiştirmez.
+    today = datetime.now().date()
+    valid_from = today
+    if valid_from_text and str(valid_from_text).strip():
+        valid_from = parse_review_date(valid_from_text)
+        if valid_from is None:
+            return f"⚠️ Yürürlük tarihi anlaşılamadı: '{valid_from_text}' (Örn: 01.01.2023)"
+        if valid_from > today:
+            return "⚠️ Yürürlük tarihi ileri bir tarih olamaz."
+
     try:
         # 1. Dosyayı önce başlıksız ham olarak oku
         df_raw = pd.read_excel(file_obj.name, header=None, dtype=str)
@@ -1511,21 +4787,51 @@ def process_and_save_tax_excel(file_obj):
                     "gv_oran": str(row.get(gv_col, "0")).strip(),
                     "dipnot": str(row.get("DİPNOT", "")).strip(),
                     # Gözden geçirme tarihi bazen farklı isimle gelebilir, opsiyonel yapalım
-                    "gecerlilik": str(row.get("GÖZDEN GEÇİRME TARİHİ**", row.get("GÖZDEN GEÇİRME TARİHİ", "-"))).strip()
+                    # Tarih ISO formatına (YYYY-MM-DD) çevrilerek saklanır, raporlarda tekrar ayrıştırılmaz
+                    "gecerlilik": normalize_review_date(row.get("GÖZDEN GEÇİRME TARİHİ**", row.get("GÖZDEN GEÇİRME TARİHİ", "-")))
                 }
                 records.append(record)
                 processed_count += 1
 
+        # Sürüm olarak kaydet (Değişmeyen kayıtlar önceki sürümlerle paylaşılır)
+        version, diff, records = tax_versions.add_version(records, os.path.basename(file_obj.name), valid_from)
+        if diff is None:
+            return f"ℹ️ Liste değişmemiş (v{version['id']} ile aynı içerik), yeniden işlenmedi. | {get_tax_db_status()}"
+
+        diff_text = f"+{diff['added']} eklenen / ~{diff['changed']} değişen / -{diff['removed']} kaldırılan"
+        active = tax_versions.find_version()
+        if active["id"] != version["id"]:
+            return (f"🗄️ v{version['id']} arşive eklendi (Yürürlük: {version['valid_from']}, {diff_text}). "
+                    f"Güncel liste v{active['id']} olarak kaldı.")
+
+        # Güncel listeyi değiştirmeden önce eski snapshot alınır (İndeksler bunun üzerinden güncellenir)
+        base_snapshot = tax_db.snapshot() if os.path.exists(TAX_DB_FILE) else None
+
         # JSONL Olarak Kaydet (Eski dosyanın üzerine yazar)
         with open(TAX_DB_FILE, 'w', encoding='utf-8') as f:
             for rec in records:
                 f.write(json.dumps(rec, ensure_ascii=False) + "\n")
 
+        # Derlenmiş snapshot'ı kaydet (Kolon bazlı kayıtlar + hazır CAS / BM25 / trigram indeksleri)
+        # Sonraki açılışlarda JSON ayrıştırma ve indeks kurulumu yapılmaz.
+        # Önceki liste varsa sadece farklı kayıtlar indekslenir.
+        index_states = None
+        if base_snapshot is not None and base_snapshot.records:
+            pos_map, added_positions = diff_tax_records(
+                [record_content_hash(rec) for rec in base_snapshot.records],
+                [record_content_hash(rec) for rec in records])
+            index_states = patch_tax_indexes(base_snapshot, records, pos_map, added_positions)
+        write_tax_snapshot(records, TAX_DB_FILE, get_file_signature(TAX_DB_FILE), index_states=index_states)
+        # Bellekteki paylaşılan kopyayı tazele
+        tax_db.invalidate()
+
         # Meta veriyi kaydet (Tarih ve Dosya Adı)
         meta_info = {
             "filename": os.path.basename(file_obj.name),
             "upload_date": datetime.now().strftime("%d.%m.%Y %H:%M"),
-            "total_records": processed_count
+            "total_records": processed_count,
+            "version": version["id"],
+            "valid_from": version["valid_from"]
         }
         with open(TAX_META_FILE, 'w', encoding='utf-8') as f:
             json.dump(meta_info, f, ensure_ascii=False)
@@ -1533,7 +4839,7 @@ def process_and_save_tax_excel(file_obj):
         # --- KRİTİK NOKTA DÜZELTİLDİ ---
         # Dosyayı yazdıktan hemen sonra okumaya çalıştığımızda bazen eski veriyi getirebiliyor.
         # Bu yüzden tekrar okumak yerine, elimizdeki güncel 'meta_info' verisini kullanıyoruz.
-        return f"✅ Mevcut Liste: {meta_info['filename']} (Yükleme: {meta_info['upload_date']})"
+        return f"✅ Mevcut Liste: {meta_info['filename']} (Yükleme: {meta_info['upload_date']}) | Sürüm v{version['id']} ({diff_text})"
 
     except Exception as e:
         return f"❌ İşlem sırasında hata oluştu: {str(e)}"
@@ -1587,18 +4893,21 @@ with gr.Blocks(theme=gr.themes.Monochrome(), title="GTIP Uzmanı") as gradio_ui:
                 with gr.Column(scale=1):
                     # ÇOKLU DOSYA SEÇİMİ
                     files_input = gr.File(label="Dosyaları Seçin (Çoklu Seçim)", file_count="multiple", type="filepath")
+                    batch_bypass_cache = gr.Checkbox(label="🔄 Önbelleği atla (daha önce işlenen formları yeniden analiz et)", value=False)
                     batch_process_btn = gr.Button("🚀 Toplu Analiz ve Kayıt Başlat", variant="primary")
+                    batch_stop_btn = gr.Button("⏹️ Durdur (kaydedilenler korunur)", variant="stop")
                 
                 with gr.Column(scale=1):
                     # ÇIKTILAR ARTIK HTML
                     batch_report_output = gr.HTML(label="İşlem Raporu")
                     cards_preview_output = gr.HTML(label="Eklenen Kartlar") # <-- BURASI HTML OLDU
 
-            batch_process_btn.click(
+            batch_event = batch_process_btn.click(
                 fn=process_batch_files,
-                inputs=[files_input],
+                inputs=[files_input, batch_bypass_cache],
                 outputs=[batch_report_output, cards_preview_output]
             )
+            batch_stop_btn.click(fn=None, cancels=[batch_event])
 
         # === SEKME 3: ASİSTAN ===
         with gr.TabItem("Sınıflandırma Asistanı"):
@@ -1675,6 +4984,9 @@ with gr.Blocks(theme=gr.themes.Monochrome(), title="GTIP Uzmanı") as gradio_ui:
                 model_dropdown = gr.Dropdown(label="Kullanılacak Model", choices=[app_config["model_name"]], value=app_config["model_name"], allow_custom_value=True)
                 save_settings_btn = gr.Button("💾 Ayarları Kaydet", variant="primary")
                 settings_status = gr.Label(label="Durum", value="Bekleniyor...")
+                clear_cache_btn = gr.Button("🗑️ LLM Yanıt Önbelleğini Temizle", variant="secondary")
+
+            clear_cache_btn.click(clear_llm_cache, outputs=[settings_status])
 
             check_btn.click(list_available_models, inputs=[api_in], outputs=[model_dropdown, settings_status])
             
@@ -2024,14 +5336,27 @@ with gr.Blocks(theme=gr.themes.Monochrome(), title="GTIP Uzmanı") as gradio_ui:
                     with gr.Column(scale=3):
                         tax_file_input = gr.File(label="Güncel Vergi Listesi (.xlsx)", file_types=[".xlsx", ".xls"])
                     with gr.Column(scale=1):
+                        tax_valid_from_input = gr.Textbox(label="Yürürlük Tarihi", placeholder="GG.AA.YYYY (Boş: bugün)")
                         tax_update_btn = gr.Button("Listeyi Sisteme İşle 💾", variant="primary")
                 
                 tax_status_output = gr.Textbox(label="İşlem Durumu", value=get_tax_db_status(), interactive=False)
                 tax_refresh_btn = gr.Button("Durumu Yenile", size="sm")
 
-                tax_update_btn.click(process_and_save_tax_excel, inputs=[tax_file_input], outputs=[tax_status_output])
+                with gr.Accordion("🗄️ Sürüm Geçmişi", open=False):
+                    tax_versions_btn = gr.Button("🔄 Sürümleri Listele", size="sm")
+                    tax_versions_table = gr.Dataframe(interactive=False, wrap=True)
+                    tax_versions_btn.click(list_tax_versions, outputs=[tax_versions_table])
+
+                tax_update_btn.click(process_and_save_tax_excel, inputs=[tax_file_input, tax_valid_from_input], outputs=[tax_status_output])
                 tax_refresh_btn.click(get_tax_db_status, inputs=[], outputs=[tax_status_output])
 
+            # --- SÜRESİ DOLAN / YAKLAŞAN GTIP'LER ---
+            with gr.Accordion("⏳ Süresi Dolan / 1 Yıl İçinde Dolacak GTIP'ler", open=False):
+                expiring_btn = gr.Button("🔄 Listeyi Göster", size="sm")
+                expiring_status = gr.Label(show_label=False)
+                expiring_table = gr.Dataframe(interactive=False, wrap=True, headers=["GTIP", "Gözden Geçirme Tarihi", "Kalan Gün", "Durum", "Eşya Tanımı"])
+                expiring_btn.click(list_expiring_tax_records, outputs=[expiring_table, expiring_status])
+
             gr.Markdown("---")
             
             # --- YENİ ANALİZ BÖLÜMÜ ---
@@ -2055,6 +5380,8 @@ with gr.Blocks(theme=gr.themes.Monochrome(), title="GTIP Uzmanı") as gradio_ui:
                         height=100
                     )
                     gr.Markdown("<sub>*Type(*), Product code, CAS, Percent sütunları olmalı.*</sub>")
+
+                    analysis_date_input = gr.Textbox(label="Analiz Tarihi (Opsiyonel)", placeholder="GG.AA.YYYY - Boş: güncel liste")
                     
                     analyze_excel_btn = gr.Button("Eşleştir ve Analiz Et 📊", variant="primary")
                 
@@ -2066,7 +5393,7 @@ with gr.Blocks(theme=gr.themes.Monochrome(), title="GTIP Uzmanı") as gradio_ui:
             # Buton Aksiyonu
             analyze_excel_btn.click(
                 fn=process_tax_analysis_structured,
-                inputs=[order_list_input, ing_list_input],
+                inputs=[order_list_input, ing_list_input, analysis_date_input],
                 outputs=[analysis_log, analysis_output_file]
             )
 
@@ -2075,7 +5402,14 @@ with gr.Blocks(theme=gr.themes.Monochrome(), title="GTIP Uzmanı") as gradio_ui:
 gradio_app = gr.mount_gradio_app(fastapi_app, gradio_ui, path="/")
 
 if __name__ == "__main__":
+    # Görsel optimizasyon ayarlarının karşılaştırması: python Application.py --benchmark-gorsel [klasör]
+    if "--benchmark-gorsel" in sys.argv:
+        position = sys.argv.index("--benchmark-gorsel")
+        run_image_optimizer_benchmark(sys.argv[position + 1] if len(sys.argv) > position + 1 else None)
+        sys.exit(0)
+
     print("Uygulama Başlatılıyor...")
+    repair_cases_file()
     try: webbrowser.open("http://127.0.0.1:7860")
     except: pass
     uvicorn.run(gradio_app, host="127.0.0.1", port=7860)
\ No newline at end of file
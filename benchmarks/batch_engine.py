@@ -0,0 +1,110 @@
+"""
+Toplu işlem motoru: eski sabit havuz (5 işçi) ile uyarlanabilir (AIMD) eşzamanlılığın sahte model üzerinde karşılaştırması.
+Kullanım: python benchmarks/batch_engine.py
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Application as A  # noqa: E402
+
+class SimulatedQuotaError(Exception):
+    """Benchmark'taki sahte modelin kota aşımı hatası (HTTP 429)."""
+    code = 429
+
+class SimulatedGeminiBackend:
+    """
+    Benchmark için sahte model. Kapasiteyi aşan eşzamanlılıkta gecikme karesel artar,
+    kapasitenin 1.5 katı aşılırsa 429 döner. Gerçek modelle aynı iki çağrı yüzünü sunar.
+    """
+    model_name = "benchmark-simulated"
+
+    def __init__(self, base_latency=0.05, capacity=12, seed=7):
+        self.base_latency = base_latency
+        self.capacity = capacity
+        self.in_flight = 0
+        self._lock = Lock()
+        self._rng = random.Random(seed)
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            load = self.in_flight / self.capacity
+            latency = self.base_latency * (0.9 + self._rng.random() * 0.2) * max(1.0, load) ** 2
+            return latency, load > 1.5
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def generate_content_async(self, parts):
+        latency, overloaded = self._enter()
+        try:
+            await asyncio.sleep(latency)
+            if overloaded:
+                raise SimulatedQuotaError("429 Resource has been exhausted (simulated)")
+            return type("SimulatedResponse", (), {"text": "{}", "usage_metadata": None})()
+        finally:
+            self._exit()
+
+    def generate_content(self, parts):
+        latency, overloaded = self._enter()
+        try:
+            time.sleep(latency)
+            if overloaded:
+                raise SimulatedQuotaError("429 Resource has been exhausted (simulated)")
+            return type("SimulatedResponse", (), {"text": "{}", "usage_metadata": None})()
+        finally:
+            self._exit()
+
+def run_batch_engine_benchmark(sizes=(10, 100, 1000)):
+    """
+    Eski sabit havuzu (ThreadPoolExecutor, 5 işçi) uyarlanabilir (AIMD) motorla sahte model üzerinde karşılaştırır.
+    Kullanım: python benchmarks/batch_engine.py
+    """
+    backend = SimulatedGeminiBackend()
+    # Sahte model için kota sınırlayıcısı devre dışı kalsın (ölçülen şey eşzamanlılık).
+    # Ayar sadece bu süreçte geçerlidir, config.json'a yazılmaz.
+    A.app_config.setdefault("rate_limits", {})[backend.model_name] = {"rpm": 10 ** 9, "tpm": 10 ** 12}
+    min_limit, max_limit, initial = A.get_batch_concurrency_bounds()
+    print(f"Sahte model: taban gecikme {backend.base_latency * 1000:.0f} ms, kapasite {backend.capacity} eşzamanlı istek")
+    print(f"AIMD sınırları: {min_limit}-{max_limit} (başlangıç {initial})")
+
+    for n in sizes:
+        fixed_stats = A.new_llm_stats()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            for future in as_completed([executor.submit(A.llm_generate, ["benchmark"], fixed_stats, backend) for _ in range(n)]):
+                future.result()
+        t1 = time.perf_counter()
+
+        adaptive_stats = A.new_llm_stats()
+        limiter = A.AdaptiveConcurrencyLimiter(min_limit, max_limit, initial)
+
+        async def worker(item, index, stats):
+            response = await A.llm_generate_async(["benchmark"], stats=stats, model=backend)
+            for key in adaptive_stats:
+                adaptive_stats[key] += stats[key]
+            return response
+
+        async def drive():
+            async for _ in A.run_adaptive_batch(range(n), worker, limiter):
+                pass
+
+        t2 = time.perf_counter()
+        asyncio.run(drive())
+        t3 = time.perf_counter()
+
+        print(f"\n{n} dosya:")
+        print(f"  Sabit havuz (5):  {t1 - t0:7.2f} sn  ({n / (t1 - t0):6.1f} dosya/sn)  tekrar deneme: {fixed_stats['retries']}")
+        print(f"  Uyarlanabilir:    {t3 - t2:7.2f} sn  ({n / (t3 - t2):6.1f} dosya/sn)  tekrar deneme: {adaptive_stats['retries']}"
+              f"  en yüksek eşzamanlılık: {limiter.peak_in_flight}, son sınır: {int(limiter.limit)}")
+
+
+if __name__ == "__main__":
+    run_batch_engine_benchmark()
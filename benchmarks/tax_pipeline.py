@@ -0,0 +1,144 @@
+"""
+Vergi raporu birleştirmesi: eski (iterrows) ve vektörel (pandas merge) sürümlerin karşılaştırması.
+Kullanım: python benchmarks/tax_pipeline.py   (vergi_listesi.jsonl yüklü olmalı)
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Application as A  # noqa: E402
+
+REPORT_COLS = {"order": "Malzeme", "product": "Product code", "type": "Type",
+               "cas": "CAS", "desc": "Standard description", "pct": "Percent"}
+
+def build_tax_report_rows_legacy(df_orders, df_ing, cols, tax_snapshot):
+    """
+    Satır satır (iterrows) çalışan eski raporlama mantığı (Application.build_tax_report_vectorized öncesi).
+    Vektörel sürümün doğrulaması (tests/test_tax_report.py) ve hız karşılaştırması için referans.
+    """
+    tax_list_linear = tax_snapshot.records
+    tax_cas_index = tax_snapshot.cas_index
+
+    product_map = {}
+    for _, row in df_ing.iterrows():
+        p_code = str(row[cols["product"]]).strip()
+        type_val = str(row[cols["type"]]).strip()
+
+        if "*" in type_val: # Sadece bileşen satırları
+            if p_code not in product_map: product_map[p_code] = []
+            product_map[p_code].append({
+                "cas": str(row[cols["cas"]]).strip(),
+                "name": str(row[cols["desc"]]).strip(),
+                "pct": str(row[cols["pct"]]).strip()
+            })
+
+    report_data = []
+    matched_count = 0
+
+    for idx, row in df_orders.iterrows():
+        malzeme_kodu = str(row[cols["order"]]).strip()
+        malzeme_tanim = str(row.get("Malzeme Tanım", "")).strip()
+
+        ingredients = product_map.get(malzeme_kodu, [])
+
+        if not ingredients:
+            report_data.append({
+                "MALZEME KODU": malzeme_kodu,
+                "ÜRÜN ADI": malzeme_tanim,
+                "BİLEŞEN": "LİSTEDE YOK",
+                "CAS NO": "-", "G.T.İ.P.": "-", "VERGİ DURUMU": "-"
+            })
+            continue
+
+        for ing in ingredients:
+            cas_no = ing["cas"]
+            chem_name = A.fold_search_text(ing["name"])
+
+            tax_record = None
+            clean_cas = cas_no.replace("(", "").replace(")", "").strip()
+
+            if len(clean_cas) > 4:
+                tax_record = A.lookup_tax_by_cas(clean_cas, tax_list_linear, tax_cas_index)
+
+            if not tax_record and len(chem_name) > 3:
+                for rec in tax_list_linear:
+                    if chem_name in A.fold_search_text(rec.get("tanim", "")):
+                        tax_record = rec
+                        break
+
+            status, gtip, tax_rate, desc, validity_display = "ESLESME YOK", "-", "-", "-", "-"
+            if tax_record:
+                status = "⚠️ VERGİ LİSTESİNDE"
+                gtip = tax_record.get("gtp", "-")
+                tax_rate = f"%{tax_record.get('gv_oran', '0')}"
+                desc = tax_record.get("tanim", "")
+                matched_count += 1
+                validity_display = A.check_tax_date_warning(tax_record.get("gecerlilik", "-"))
+
+            report_data.append({
+                "MALZEME KODU": malzeme_kodu,
+                "ÜRÜN ADI": malzeme_tanim,
+                "BİLEŞEN": ing["name"],
+                "CAS NO": cas_no,
+                "ORAN (%)": ing["pct"],
+                "VERGİ DURUMU": status,
+                "G.T.İ.P.": gtip,
+                "VERGİ ORANI": tax_rate,
+                "GEÇERLİLİK TARİHİ": validity_display,
+                "VERGİ TANIMI": desc
+            })
+
+    return report_data, matched_count
+
+def make_synthetic_inputs(tax_snapshot, n_products=2000, ingredients_per_product=5, n_orders=2000):
+    """
+    Vergi listesindeki CAS/isimlerden sentetik sipariş ve bileşen tabloları üretir.
+    Bileşenlerin üçte biri listede olmayan CAS taşır, siparişlerin bir kısmı bileşen listesinde yoktur.
+    """
+    cas_keys = list(tax_snapshot.cas_index.keys()) or ["64-17-5"]
+    names = [str(r.get("tanim", ""))[:25] for r in tax_snapshot.records[:200]] or ["etanol"]
+
+    ing_rows = []
+    for p in range(n_products):
+        ing_rows.append({"Product code": f"P{p}", "Type": "Product", "CAS": "", "Standard description": "", "Percent": ""})
+        for k in range(ingredients_per_product):
+            seed = p * ingredients_per_product + k
+            cas = cas_keys[seed % len(cas_keys)] if seed % 3 else f"{1000 + seed}-00-0"
+            ing_rows.append({
+                "Product code": f"P{p}", "Type": "*",
+                "CAS": cas, "Standard description": names[seed % len(names)], "Percent": str(k * 10)
+            })
+    df_ing = pd.DataFrame(ing_rows, dtype=str)
+    df_orders = pd.DataFrame({
+        "Malzeme": [f"P{i % (n_products + n_products // 10)}" for i in range(n_orders)],
+        "Malzeme Tanım": [f"Ürün {i}" for i in range(n_orders)],
+    }, dtype=str)
+    return df_orders, df_ing
+
+def legacy_report_frame(df_orders, df_ing, cols, tax_snapshot):
+    """Eski sürümün çıktısını vektörel sürümle karşılaştırılabilir DataFrame olarak döndürür."""
+    rows, matched = build_tax_report_rows_legacy(df_orders, df_ing, cols, tax_snapshot)
+    return pd.DataFrame(rows).reindex(columns=A.TAX_REPORT_COLUMNS).fillna("").astype(str), matched
+
+def run(n_products=2000, ingredients_per_product=5, n_orders=2000):
+    snapshot = A.tax_db.snapshot()
+    df_orders, df_ing = make_synthetic_inputs(snapshot, n_products, ingredients_per_product, n_orders)
+
+    t0 = time.perf_counter()
+    legacy_df, legacy_matched = legacy_report_frame(df_orders, df_ing, REPORT_COLS, snapshot)
+    t1 = time.perf_counter()
+    vector_df, vector_matched = A.build_tax_report_vectorized(df_orders, df_ing, REPORT_COLS, snapshot)
+    t2 = time.perf_counter()
+
+    same = legacy_matched == vector_matched and legacy_df.equals(vector_df.fillna("").astype(str))
+    input_rows = len(df_ing) + len(df_orders)
+    print(f"Girdi: {len(df_ing)} bileşen + {len(df_orders)} sipariş satırı -> {len(vector_df)} rapor satırı")
+    print(f"Eski (iterrows):  {t1 - t0:8.3f} sn  ({input_rows / (t1 - t0):,.0f} satır/sn)")
+    print(f"Vektörel (merge): {t2 - t1:8.3f} sn  ({input_rows / (t2 - t1):,.0f} satır/sn)")
+    print(f"Çıktılar aynı mı: {'Evet' if same else 'HAYIR'}")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,54 @@
+import os
+import sys
+import zipfile
+
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import Application as app  # noqa: E402
+
+SHIPPED_ZIP = os.path.join(REPO_DIR, "Folders", "GTIP_Sistem_Dosyalari.zip")
+SHIPPED_TAX_LIST = "GTIP_Sistem_Dosyalari/V_Sayili_Liste.xlsx"
+
+
+@pytest.fixture
+def A():
+    return app
+
+
+@pytest.fixture(scope="session")
+def shipped_tax_snapshot(shipped_tax_records):
+    return app.TaxSnapshot(shipped_tax_records, app.build_tax_cas_index(shipped_tax_records), None)
+
+
+@pytest.fixture(scope="session")
+def shipped_tax_records(tmp_path_factory):
+    """Depodaki V Sayılı Liste'den (zip içinde) uygulamanın yazdığı kayıt biçiminde liste."""
+    target = tmp_path_factory.mktemp("vergi")
+    with zipfile.ZipFile(SHIPPED_ZIP) as zf:
+        path = zf.extract(SHIPPED_TAX_LIST, target)
+    raw = pd.read_excel(path, header=None, dtype=str)
+    header = next(i for i, row in raw.iterrows()
+                  if "GTP" in " ".join(str(x).upper() for x in row.values)
+                  and "EŞYA TANIMI" in " ".join(str(x).upper() for x in row.values))
+    df = pd.read_excel(path, header=header, dtype=str)
+    df.columns = df.columns.str.strip().str.upper().str.replace('\n', '')
+    gv_col = "GV (%)" if "GV (%)" in df.columns else "GV"
+    records = []
+    for _, row in df.iterrows():
+        gtp_raw = str(row.get("GTP", "")).strip()
+        desc = str(row.get("EŞYA TANIMI", "")).strip()
+        if not gtp_raw or not desc or gtp_raw.lower() == "nan":
+            continue
+        for code in gtp_raw.split():
+            records.append({
+                "gtp": code,
+                "tanim": desc,
+                "gv_oran": str(row.get(gv_col, "0")).strip(),
+                "gecerlilik": app.normalize_review_date(
+                    row.get("GÖZDEN GEÇİRME TARİHİ**", row.get("GÖZDEN GEÇİRME TARİHİ", "-"))),
+            })
+    return records
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture
+def ingest(A, tmp_path, monkeypatch):
+    """İlk iki dosya hemen biten, diğerleri hiç bitmeyen sahte çıkarım; kayıtlar geçici cases.jsonl'e yazılır."""
+    path = tmp_path / "cases.jsonl"
+    monkeypatch.setattr(A, "llm_model", object())
+    monkeypatch.setattr(A, "TORN_LINES_FILE", str(tmp_path / "yarim.txt"))
+    monkeypatch.setattr(A, "case_index", A.CaseSearchIndex(str(path)))
+    writer = A.CaseGroupWriter(str(path))
+    monkeypatch.setattr(A, "case_writer", writer)
+    monkeypatch.setitem(A.app_config, "batch_concurrency", {"min": 4, "max": 4, "initial": 4})
+    started, cancelled = [], []
+
+    async def fake_single_file(file_obj, file_index, stats, bypass_cache, batcher):
+        started.append(file_index)
+        try:
+            if file_index >= 2:
+                await asyncio.Event().wait()
+            return {"status": "success", "file": file_obj,
+                    "data": {"product_name": f"Ürün{file_index}", "assigned_gtip": "3208.90", "features": {}}}
+        except asyncio.CancelledError:
+            cancelled.append(file_index)
+            raise
+    monkeypatch.setattr(A, "process_single_file", fake_single_file)
+    yield path, started, cancelled
+    writer.close()
+
+
+def saved_products(path):
+    with open(path, encoding="utf-8") as f:
+        return sorted(json.loads(line)["product_name"] for line in f)
+
+
+def test_cancelled_batch_keeps_acknowledged_records(A, ingest):
+    path, started, cancelled = ingest
+    updates = []
+
+    async def run_and_cancel():
+        async def consume():
+            async for report, cards in A.process_batch_files([f"dosya{i}.pdf" for i in range(5)],
+                                                             progress=lambda *args, **kwargs: None):
+                updates.append((report, cards))
+                if report.count("✅") == 2:
+                    ready.set()
+        ready = asyncio.Event()
+        task = asyncio.create_task(consume())
+        await asyncio.wait_for(ready.wait(), 10)
+        task.cancel()                           # Kullanıcı "Durdur"a bastı
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    asyncio.run(run_and_cancel())
+    assert saved_products(path) == ["Ürün0", "Ürün1"]
+    assert "Ürün0" in updates[-1][1] and "Ürün1" in updates[-1][1]
+    assert sorted(started) == [0, 1, 2, 3, 4]
+    assert sorted(cancelled) == [2, 3, 4]
+    # Diske inen kayıtlar emsal aramasında da görünür
+    cases, total = A.case_index.search("Ürün0", limit=5)
+    assert total >= 1 and cases[0]["product_name"] == "Ürün0"
+
+
+def test_closing_the_generator_keeps_acknowledged_records(A, ingest):
+    path, _, cancelled = ingest
+
+    async def close_early():
+        gen = A.process_batch_files([f"dosya{i}.pdf" for i in range(4)], progress=lambda *args, **kwargs: None)
+        async for report, _ in gen:
+            if report.count("✅") == 2:
+                break
+        await gen.aclose()
+        await asyncio.sleep(0)
+
+    asyncio.run(close_early())
+    assert saved_products(path) == ["Ürün0", "Ürün1"]
+    assert sorted(cancelled) == [2, 3]
@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES = ["DISPARLON", "silicone surfactant", "3208.90", "xylene", "epoxy hardener", "BYK-333", "poliüretan"]
+
+
+@pytest.fixture(autouse=True)
+def exact_idf(A, monkeypatch):
+    # IDF normalde kayıtlar %20 artınca yenilenir; karşılaştırma için her eklemede yenilensin
+    monkeypatch.setattr(A, "CASE_VECTOR_IDF_REFRESH_RATIO", 0)
+
+
+@pytest.fixture(scope="module")
+def shipped_lines():
+    with open(os.path.join(ROOT, "cases.jsonl"), encoding="utf-8") as f:
+        return [line if line.endswith("\n") else line + "\n" for line in f if line.strip()]
+
+
+def snapshot(index):
+    """Karşılaştırma için sorgu sonuçlarının kimlikleri ve toplamları."""
+    results = []
+    for query in QUERIES:
+        cases, total = index.search(query, limit=10)
+        results.append(([case.get("id") for case in cases], total))
+        results.append([(round(score, 6), case.get("id")) for score, case in index.similar(query, limit=5)])
+    results.append([case.get("id") for case in index.filter_cases("sil")])
+    return results
+
+
+def fresh(A, path):
+    return snapshot(A.CaseSearchIndex(str(path)))
+
+
+def test_external_appends_are_read_incrementally(A, tmp_path, shipped_lines):
+    path = tmp_path / "cases.jsonl"
+    half = len(shipped_lines) // 2
+    path.write_text("".join(shipped_lines[:half]), encoding="utf-8")
+    index = A.CaseSearchIndex(str(path))
+    snapshot(index)
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(shipped_lines[half:]))
+    reads = []
+    original = index._read_from
+    index._read_from = lambda offset: (reads.append(offset), original(offset))
+    assert snapshot(index) == fresh(A, path)
+    assert reads == [len("".join(shipped_lines[:half]).encode("utf-8"))]
+
+
+def test_add_cases_extends_index_without_reading_the_file(A, tmp_path, shipped_lines):
+    path = tmp_path / "cases.jsonl"
+    path.write_text("".join(shipped_lines[:-20]), encoding="utf-8")
+    index = A.CaseSearchIndex(str(path))
+    snapshot(index)
+
+    new_lines = shipped_lines[-20:]
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(new_lines))
+    index.add_cases([json.loads(line) for line in new_lines], new_lines)
+    index._read_from = lambda offset: pytest.fail("dosya yeniden okunmamalı")
+    assert snapshot(index) == fresh(A, path)
+
+
+def test_add_cases_is_ignored_when_file_grew_differently(A, tmp_path, shipped_lines):
+    path = tmp_path / "cases.jsonl"
+    path.write_text("".join(shipped_lines[:10]), encoding="utf-8")
+    index = A.CaseSearchIndex(str(path))
+    snapshot(index)
+
+    # Başka bir yazıcı araya satır eklediyse grup doğrudan eklenmez, dosyadan okunur
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(shipped_lines[10:15]))
+    index.add_cases([json.loads(line) for line in shipped_lines[14:15]], shipped_lines[14:15])
+    assert len(index.history_entries) == 10
+    assert snapshot(index) == fresh(A, path)
+    assert len(index.history_entries) == 15
+
+
+def test_torn_last_line_waits_until_completed(A, tmp_path, shipped_lines):
+    path = tmp_path / "cases.jsonl"
+    line = shipped_lines[10]
+    path.write_text("".join(shipped_lines[:10]) + line[:40], encoding="utf-8")
+    index = A.CaseSearchIndex(str(path))
+    snapshot(index)
+    assert len(index.history_entries) == 10
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[40:])
+    assert snapshot(index) == fresh(A, path)
+    assert len(index.history_entries) == 11
+
+
+def test_rewritten_file_is_rebuilt(A, tmp_path, shipped_lines):
+    path = tmp_path / "cases.jsonl"
+    path.write_text("".join(shipped_lines[:30]), encoding="utf-8")
+    index = A.CaseSearchIndex(str(path))
+    snapshot(index)
+
+    path.write_text("".join(shipped_lines[30:40]), encoding="utf-8")
+    assert snapshot(index) == fresh(A, path)
+    assert len(index.history_entries) == 10
+
+
+BATCH_QUERIES = QUERIES + ["xylene", "", "epoxy", "epoxy hardener", "DISPARL0N", "3208", "zzzz-eşleşmez", "DISPARLON", "Xylene"]
+
+
+def test_search_many_equals_one_search_per_query(A, tmp_path, shipped_lines):
+    path = tmp_path / "cases.jsonl"
+    path.write_text("".join(shipped_lines), encoding="utf-8")
+    index = A.CaseSearchIndex(str(path))
+    for limit in (1, 5, 50):
+        expected = [index.search(query, limit) for query in BATCH_QUERIES]
+        assert index.search_many(BATCH_QUERIES, limit) == expected
+    assert index.search_many([], 5) == []
+
+
+def test_search_jsonl_batch_matches_direct_search(A, tmp_path, shipped_lines, monkeypatch):
+    path = tmp_path / "cases.jsonl"
+    path.write_text("".join(shipped_lines), encoding="utf-8")
+    monkeypatch.setattr(A, "CASES_FILE", str(path))
+    monkeypatch.setattr(A, "case_index", A.CaseSearchIndex(str(path)))
+    assert A.search_jsonl_batch(BATCH_QUERIES) == [A.search_jsonl_directly(query) for query in BATCH_QUERIES]
+
+    monkeypatch.setattr(A, "CASES_FILE", str(tmp_path / "yok.jsonl"))
+    assert A.search_jsonl_batch(["a", "b"]) == [A.search_jsonl_directly("a")] * 2
@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+import zlib
+
+import numpy as np
+
+
+def test_ngram_slots_do_not_depend_on_the_process_hash_seed(A):
+    counts = A.char_ngram_counts("Silikon yüzey aktif")
+    expected = {}
+    for word in ("silikon", "yuzey", "aktif"):
+        padded = f" {word} "
+        for n in A.CASE_VECTOR_NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                slot = zlib.crc32(padded[i:i + n].encode("utf-8")) & (A.CASE_VECTOR_DIMENSIONS - 1)
+                expected[slot] = expected.get(slot, 0) + 1
+    assert counts == expected
+
+
+def test_similarity_ranking_is_identical_across_hash_seeds():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = (
+        "import sys; sys.path.insert(0, %r)\n"
+        "import Application as A\n"
+        "index = A.CaseVectorIndex(dimensions=64)\n"
+        "for text in ['polyether modified siloxane', 'silicone surfactant', 'epoxy resin hardener',"
+        " 'modified polysiloxane', 'acrylic emulsion', 'siloxane defoamer']:\n"
+        "    index.add(text)\n"
+        "print(index.search('polyether siloxane', top_k=6, min_similarity=0))\n" % root
+    )
+    outputs = set()
+    for seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env, cwd=root,
+                                timeout=300)
+        assert result.returncode == 0, result.stderr[-2000:]
+        outputs.add(result.stdout.strip().splitlines()[-1])
+    assert len(outputs) == 1
+
+
+CORPUS = [
+    "polyether modified siloxane wetting agent", "silicone surfactant for coatings", "epoxy resin hardener amine",
+    "modified polysiloxane slip additive", "acrylic emulsion binder", "siloxane defoamer mineral oil",
+    "polyurethane dispersion aqueous", "xylene solvent mixture", "titanium dioxide pigment rutile",
+    "alkyd resin in white spirit", "polyamide wax thixotrope", "silane coupling agent", "epoxy reactive diluent",
+    "fluorosurfactant leveling agent", "cellulose acetate butyrate",
+]
+VECTOR_QUERIES = ["polyether siloxane", "epoxy hardener", "silicone surfactant", "solvent", "wax"]
+
+
+def dense_scores(A, texts, idf_texts, query, dimensions):
+    """Yoğun NumPy kosinüs referansı: IDF yalnızca idf_texts'ten hesaplanır (Yenilemeler arasındaki davranış)."""
+    def tf(text):
+        vector = np.zeros(dimensions)
+        for slot, count in A.char_ngram_counts(text, dimensions).items():
+            vector[slot] = 1 + np.log(count)
+        return vector
+    matrix = np.array([tf(text) for text in texts])
+    doc_freq = (np.array([tf(text) for text in idf_texts]) > 0).sum(axis=0)
+    idf = np.log((1 + len(idf_texts)) / (1 + doc_freq)) + 1
+    weighted = matrix * idf
+    weighted /= np.maximum(np.linalg.norm(weighted, axis=1, keepdims=True), 1e-12)
+    q = tf(query) * idf
+    q /= np.linalg.norm(q) or 1.0
+    return weighted @ q
+
+
+def index_scores(index, query):
+    scores = np.zeros(index.rows)
+    for score, row in index.search(query, top_k=index.rows, min_similarity=0):
+        scores[row] = score
+    return scores
+
+
+def test_sparse_search_matches_dense_cosine_before_and_after_idf_refresh(A):
+    dimensions = 4096
+    index = A.CaseVectorIndex(dimensions=dimensions)
+    for text in CORPUS[:10]:
+        index.add(text)
+    for query in VECTOR_QUERIES:
+        np.testing.assert_allclose(index_scores(index, query), dense_scores(A, CORPUS[:10], CORPUS[:10], query, dimensions), atol=1e-5)
+    assert index.idf_rows == 10
+
+    # %20'ye kadar büyüme: yeni satırlar eski IDF ile CSR'den puanlanır
+    for text in CORPUS[10:12]:
+        index.add(text)
+    for query in VECTOR_QUERIES:
+        np.testing.assert_allclose(index_scores(index, query), dense_scores(A, CORPUS[:12], CORPUS[:10], query, dimensions), atol=1e-5)
+    assert (index.idf_rows, index.rows) == (10, 12)
+
+    # Eşik aşılınca IDF tüm kayıtlarla yeniden hesaplanır
+    for text in CORPUS[12:]:
+        index.add(text)
+    for query in VECTOR_QUERIES:
+        np.testing.assert_allclose(index_scores(index, query), dense_scores(A, CORPUS, CORPUS, query, dimensions), atol=1e-5)
+    assert index.idf_rows == len(CORPUS)
+
+
+def test_ranking_matches_dense_order_and_threshold(A):
+    dimensions = 4096
+    index = A.CaseVectorIndex(dimensions=dimensions)
+    for text in CORPUS:
+        index.add(text)
+    for query in VECTOR_QUERIES:
+        dense = dense_scores(A, CORPUS, CORPUS, query, dimensions)
+        expected = sorted((row for row in range(len(CORPUS)) if dense[row] >= A.CASE_VECTOR_MIN_SIMILARITY),
+                          key=lambda row: (-dense[row], row))[:5]
+        assert [row for _, row in index.search(query, top_k=5)] == expected
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+
+class Upload:
+    def __init__(self, name):
+        self.name = name
+
+
+@pytest.fixture
+def classify(A, monkeypatch):
+    """Sahte akışlı model: dosya sırasının tersine biter, aynı anda çalışan istekleri sayar."""
+    monkeypatch.setattr(A, "llm_model", object())
+    monkeypatch.setattr(A, "STREAM_RENDER_INTERVAL", 0)
+    monkeypatch.setattr(A, "load_document_for_llm", lambda f_path, dpi: {"kind": "text", "text": f_path})
+    monkeypatch.setattr(A, "search_jsonl_batch", lambda queries, limit=5: [([], "")] * len(queries))
+    monkeypatch.setattr(A, "log_classification_to_history", lambda *args: None)
+    counters = {"active": 0, "peak": 0, "finished": []}
+
+    async def fake_stream(parts, stats=None, model=None, cache=None, bypass_cache=False):
+        name = parts[1].rsplit("\n", 1)[-1]
+        counters["active"] += 1
+        counters["peak"] = max(counters["peak"], counters["active"])
+        try:
+            await asyncio.sleep(0.01 * (10 - int(name[-5])))
+            yield f"yanıt-{name[-5]} "
+            yield "tamam"
+        finally:
+            counters["active"] -= 1
+            counters["finished"].append(name)
+    monkeypatch.setattr(A, "llm_stream_async", fake_stream)
+
+    def run(n, concurrency):
+        monkeypatch.setitem(A.app_config, "classification_concurrency", concurrency)
+        files = [Upload(f"dosya{i}.pdf") for i in range(n)]
+        rows = [[f"etiket{i}.pdf", f"Ürün{i}", "", ""] for i in range(n)]
+
+        async def collect():
+            return [html async for html in A.classify_batch_with_metadata(files, rows, None)]
+        return asyncio.run(collect()), counters
+    return run
+
+
+def positions(html, labels):
+    return [html.find(label) for label in labels]
+
+
+def test_results_keep_table_order_with_placeholders_and_capped_concurrency(A, classify):
+    renders, counters = classify(5, 2)
+    assert counters["peak"] == 2
+    assert counters["finished"][:2] == ["dosya1.pdf", "dosya0.pdf"]      # Sonraki dosya önce bitti
+
+    first = renders[0]
+    placeholders = [f"⏳ Ürün{i} işleniyor" for i in range(5)]
+    assert all(p >= 0 for p in positions(first, placeholders))
+    assert positions(first, placeholders) == sorted(positions(first, placeholders))
+
+    # Sonraki dosyanın kartı, önceki hâlâ bekliyorken kendi yerinde görünür
+    early = next(html for html in renders if "yanıt-1" in html)
+    assert "⏳ Ürün0 işleniyor" in early and early.find("Ürün1") > early.find("Ürün0")
+
+    final = renders[-1]
+    assert "işleniyor" not in final
+    answers = positions(final, [f"yanıt-{i} tamam" for i in range(5)])
+    assert all(p >= 0 for p in answers) and answers == sorted(answers)
+    assert "✍️ Yazılıyor" not in final
+
+
+@pytest.mark.parametrize("setting, expected", [(1, 1), (0, 1), ("3", 3), ("x", None)])
+def test_concurrency_setting(A, classify, monkeypatch, setting, expected):
+    monkeypatch.setitem(A.app_config, "classification_concurrency", setting)
+    expected = expected or A.DEFAULT_CONFIG["classification_concurrency"]
+    assert A.get_classification_concurrency() == expected
+    if isinstance(setting, int):
+        _, counters = classify(4, setting)
+        assert counters["peak"] == expected
+
@@ -0,0 +1,78 @@
+import asyncio
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def cycle(limiter, latency, **flags):
+    await limiter.acquire()
+    await limiter.release(latency, **flags)
+
+
+def test_limit_halves_on_429_and_grows_back(A):
+    async def scenario():
+        limiter = A.AdaptiveConcurrencyLimiter(min_limit=1, max_limit=16, initial=8)
+        await cycle(limiter, None, congested=True)
+        assert int(limiter.limit) == 4
+        await cycle(limiter, None, congested=True)
+        await cycle(limiter, None, congested=True)
+        await cycle(limiter, None, congested=True)
+        assert int(limiter.limit) == 1           # min_limit altına inmez
+        for _ in range(200):
+            await cycle(limiter, 0.05)
+        assert int(limiter.limit) == 16          # max_limit üstüne çıkmaz
+        return limiter
+    limiter = run(scenario())
+    assert [limit for _, limit in limiter.history][:2] == [4, 2]
+
+
+def test_limit_shrinks_when_latency_exceeds_baseline(A):
+    async def scenario():
+        limiter = A.AdaptiveConcurrencyLimiter(min_limit=1, max_limit=16, initial=8)
+        for _ in range(5):
+            await cycle(limiter, 0.01)
+        before = limiter.limit
+        await cycle(limiter, 0.01 * (A.AIMD_LATENCY_TOLERANCE + 1))
+        assert limiter.limit == before * A.AIMD_DECREASE_FACTOR
+    run(scenario())
+
+
+def test_throttled_and_unmeasured_requests_do_not_grow_the_limit(A):
+    async def scenario():
+        limiter = A.AdaptiveConcurrencyLimiter(min_limit=1, max_limit=16, initial=4)
+        await cycle(limiter, 0.01, throttled=True)
+        await cycle(limiter, None)
+        assert limiter.limit == 4
+    run(scenario())
+
+
+def test_release_with_stats_ignores_waits_and_cached_items(A):
+    async def scenario():
+        limiter = A.AdaptiveConcurrencyLimiter(min_limit=1, max_limit=16, initial=4)
+        cached = A.new_llm_stats()
+        await limiter.acquire()
+        await limiter.release_with_stats(cached, 5.0)
+        assert limiter.baseline is None and limiter.limit == 4
+
+        stats = A.new_llm_stats()
+        stats.update(calls=1, backoff_wait=1.5, retries=1)
+        await limiter.acquire()
+        await limiter.release_with_stats(stats, 2.0)
+        assert limiter.baseline == 0.5 and limiter.limit == 2
+    run(scenario())
+
+
+def test_acquire_never_exceeds_current_limit(A):
+    async def scenario():
+        limiter = A.AdaptiveConcurrencyLimiter(min_limit=1, max_limit=3, initial=3)
+
+        async def item(i):
+            await limiter.acquire()
+            await asyncio.sleep(0.001)
+            await limiter.release(None, congested=(i == 0))
+
+        await asyncio.gather(*(item(i) for i in range(30)))
+        return limiter
+    limiter = run(scenario())
+    assert limiter.peak_in_flight <= 3 and limiter.in_flight == 0
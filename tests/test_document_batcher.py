@@ -0,0 +1,113 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+
+class FakeModel:
+    """Toplu istekte gelen belge kimliklerine göre yanıt üreten sahte model."""
+    def __init__(self, batch_ids=None, block=False):
+        self.batch_ids = batch_ids      # None: gönderilen kimlikler aynen döner
+        self.block = block
+        self.batch_calls = 0
+        self.single_calls = 0
+
+    async def generate_content_async(self, parts):
+        if "TOPLU MOD" in parts[0]:
+            self.batch_calls += 1
+            if self.block:
+                await asyncio.Event().wait()
+            texts = {re.search(r'D\d+', p).group(0): parts[i + 1] for i, p in enumerate(parts) if p.startswith("[BELGE")}
+            ids = self.batch_ids or list(texts)
+            body = [{"document_id": d, "text": texts.get(d, "")[-3:]} for d in ids]
+            return Response("```json\n" + json.dumps(body) + "\n```")
+        self.single_calls += 1
+        return Response(json.dumps({"text": parts[-1][-3:]}))
+
+
+class Response:
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def batching(A, tmp_path, monkeypatch):
+    monkeypatch.setitem(A.app_config, "rate_limits", {"default": {"rpm": 10 ** 9, "tpm": 10 ** 12}})
+    monkeypatch.setitem(A.app_config, "document_batching", {"enabled": True, "max_documents": 3, "max_wait_ms": 1000})
+    monkeypatch.setattr(A, "llm_cache", A.LlmResponseCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(A, "_llm_log_request", lambda *args, **kwargs: None)
+
+    def use(model):
+        monkeypatch.setattr(A, "llm_model", model)
+        return A.DocumentBatcher("Belgeyi özetle.", "sds_ozet")
+    return use
+
+
+def documents(n):
+    return [{"kind": "text", "text": f"belge-{i:03d}"} for i in range(n)]
+
+
+async def extract_all(A, batcher, docs):
+    stats = [A.new_llm_stats() for _ in docs]
+    results = await asyncio.gather(*(batcher.extract(doc, s) for doc, s in zip(docs, stats)))
+    return results, stats
+
+
+def test_matching_ids_are_distributed_and_stats_apportioned(A, batching):
+    model = FakeModel()
+    batcher = batching(model)
+    results, stats = asyncio.run(extract_all(A, batcher, documents(3)))
+    assert [r["text"] for r in results] == ["000", "001", "002"]
+    assert model.batch_calls == 1 and model.single_calls == 0
+    assert [s["calls"] for s in stats] == [1, 0, 0]
+    assert [s["cache_misses"] for s in stats] == [1, 1, 1]
+
+
+@pytest.mark.parametrize("ids", [["D1", "D1", "D3"], ["D1", "D2"], ["D1", "D2", "D3", "D4"], ["D3", "D2", "D7"]])
+def test_mismatched_ids_fall_back_for_every_document(A, batching, ids):
+    model = FakeModel(batch_ids=ids)
+    batcher = batching(model)
+    results, stats = asyncio.run(extract_all(A, batcher, documents(3)))
+    assert [r["text"] for r in results] == ["000", "001", "002"]
+    assert model.single_calls == 3 and batcher.stats["fallbacks"] == 3
+    # Önbelleğe extract() içinde bir kez bakıldı; tek tek deneme ıskayı tekrar saymaz
+    assert [s["cache_misses"] for s in stats] == [1, 1, 1]
+    assert sum(s["calls"] for s in stats) == 4
+
+
+def test_fallback_results_are_cached_under_the_single_document_key(A, batching):
+    model = FakeModel(batch_ids=["D9"])
+    asyncio.run(extract_all(A, batching(model), documents(3)))
+    again = FakeModel()
+    results, stats = asyncio.run(extract_all(A, batching(again), documents(3)))
+    assert [r["text"] for r in results] == ["000", "001", "002"]
+    assert again.batch_calls == 0 and again.single_calls == 0
+    assert [s["cache_hits"] for s in stats] == [1, 1, 1]
+
+
+def test_cancelled_batch_does_not_leave_waiters_hanging(A, batching):
+    batcher = batching(FakeModel(block=True))
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(batcher.extract(doc)) for doc in documents(3)]
+        while not batcher._tasks:
+            await asyncio.sleep(0.001)
+        for task in list(batcher._tasks):
+            task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 5)
+
+    outcomes = asyncio.run(scenario())
+    assert all(isinstance(o, asyncio.CancelledError) for o in outcomes)
+
+
+def test_split_llm_stats_preserves_totals(A):
+    stats = A.new_llm_stats()
+    stats.update(calls=1, retries=2, bytes_sent=1001, throttle_wait=0.9, request_seconds=3.0)
+    shares = A.split_llm_stats(stats, 3)
+    assert [s["calls"] for s in shares] == [1, 0, 0]
+    assert [s["bytes_sent"] for s in shares] == [334, 334, 333]
+    for key, value in stats.items():
+        assert sum(s[key] for s in shares) == pytest.approx(value)
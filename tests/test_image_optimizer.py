@@ -0,0 +1,118 @@
+import io
+
+import pytest
+from google.generativeai.types import content_types
+from PIL import Image
+
+
+def settings(A, **overrides):
+    result = dict(A.DEFAULT_CONFIG["image_optimizer"])
+    result.update(overrides)
+    return result
+
+
+def decode(blob):
+    return Image.open(io.BytesIO(blob["data"]))
+
+
+def page(size, box, color=(0, 0, 0)):
+    image = Image.new("RGB", size, "white")
+    image.paste(color, box)
+    return image
+
+
+def test_transparent_areas_are_flattened_onto_white(A):
+    image = Image.new("RGBA", (200, 100), (0, 0, 0, 0))
+    image.paste((200, 0, 0, 255), (50, 25, 150, 75))
+    blob, info = A.optimize_image_for_llm(image, settings(A, crop_whitespace=False, format="WEBP", quality=100))
+    decoded = decode(blob).convert("RGB")
+    assert info["size"] == (200, 100)
+    assert min(decoded.getpixel((5, 5))) >= 250
+    r, g, b = decoded.getpixel((100, 50))
+    assert r > 180 and g < 40 and b < 40
+
+
+def test_palette_image_with_transparency_is_flattened(A):
+    image = Image.new("P", (40, 40), 0)
+    image.putpalette([0, 0, 0] + [0, 0, 0] * 255)
+    image.info["transparency"] = 0
+    blob, _ = A.optimize_image_for_llm(image, settings(A, crop_whitespace=False))
+    assert min(decode(blob).convert("RGB").getpixel((20, 20))) >= 245
+
+
+def test_whitespace_crop_keeps_content_plus_margin(A):
+    margin = A.WHITESPACE_MARGIN
+    cropped = A.crop_whitespace(page((1000, 800), (300, 200, 500, 400)))
+    assert cropped.size == (200 + 2 * margin, 200 + 2 * margin)
+    assert cropped.getpixel((margin - 1, margin - 1)) == (255, 255, 255)
+    assert cropped.getpixel((margin, margin)) == (0, 0, 0)
+
+
+def test_whitespace_crop_on_large_page_never_cuts_content(A):
+    # Sınır kutusu küçültülmüş kopyada bulunur; kırpma en fazla küçültme oranı kadar geniş kalabilir
+    image = page((3000, 2400), (901, 602, 1499, 1201))
+    cropped = A.crop_whitespace(image)
+    factor = 3
+    width, height = 1499 - 901, 1201 - 602
+    assert width + 2 * A.WHITESPACE_MARGIN <= cropped.width <= width + 2 * (A.WHITESPACE_MARGIN + factor)
+    assert height + 2 * A.WHITESPACE_MARGIN <= cropped.height <= height + 2 * (A.WHITESPACE_MARGIN + factor)
+    assert cropped.convert("L").getextrema()[0] == 0
+    assert A.crop_whitespace(page((400, 300), (0, 0, 400, 300))).size == (400, 300)
+
+
+def test_blank_or_edge_to_edge_pages_are_not_cropped(A):
+    blank = Image.new("RGB", (300, 200), "white")
+    assert A.crop_whitespace(blank) is blank
+    full = page((300, 200), (0, 0, 300, 200), (120, 120, 120))
+    assert A.crop_whitespace(full) is full
+
+
+@pytest.mark.parametrize("size, expected", [((4000, 1000), (1000, 250)), ((600, 3000), (200, 1000)), ((800, 500), (800, 500))])
+def test_long_edge_is_capped_and_aspect_kept(A, size, expected):
+    image = page(size, (0, 0, size[0], size[1]), (90, 90, 90))
+    blob, info = A.optimize_image_for_llm(image, settings(A, max_long_edge=1000, crop_whitespace=False))
+    assert info["original_size"] == size
+    assert info["size"] == expected == decode(blob).size
+
+
+@pytest.mark.parametrize("fmt, mime, pil_format", [("JPEG", "image/jpeg", "JPEG"), ("webp", "image/webp", "WEBP"), ("PNG", "image/jpeg", "JPEG")])
+def test_output_format_and_mime_type(A, fmt, mime, pil_format):
+    blob, info = A.optimize_image_for_llm(page((300, 200), (50, 50, 250, 150)), settings(A, format=fmt))
+    assert blob["mime_type"] == mime
+    assert decode(blob).format == pil_format
+    assert info["bytes"] == len(blob["data"])
+
+
+def test_grayscale_setting_sends_single_channel_image(A):
+    blob, _ = A.optimize_image_for_llm(page((300, 200), (50, 50, 250, 150), (200, 0, 0)), settings(A, grayscale=True))
+    assert decode(blob).mode == "L"
+
+
+def library_blob(image):
+    blob = content_types.to_blob(image)
+    return {"mime_type": blob.mime_type, "data": blob.data}
+
+
+def test_disabled_optimizer_sends_the_library_payload(A, tmp_path, monkeypatch):
+    monkeypatch.setitem(A.app_config, "image_optimizer", {"enabled": False})
+    in_memory = page((500, 400), (100, 100, 300, 300), (10, 120, 200))
+    images = [in_memory]
+    for fmt, name in (("PNG", "form.png"), ("JPEG", "form.jpg")):
+        in_memory.save(tmp_path / name, format=fmt)
+        images.append(Image.open(tmp_path / name))
+
+    prepared, total_bytes, count = A.prepare_llm_parts(["istem"] + images)
+    assert prepared[0] == "istem" and count == 3
+    assert prepared[1:] == [library_blob(image) for image in images]
+    assert total_bytes == len("istem") + sum(len(blob["data"]) for blob in prepared[1:])
+
+
+def test_enabled_optimizer_shrinks_payload_and_keeps_text_parts(A, monkeypatch):
+    monkeypatch.setitem(A.app_config, "image_optimizer", {"enabled": True, "max_long_edge": 1000})
+    image = Image.effect_noise((1500, 2000), 40).convert("RGB")          # Taranmış sayfa gibi gürültülü
+    prepared, total_bytes, count = A.prepare_llm_parts(["istem", image])
+    assert prepared[0] == "istem" and count == 1
+    assert max(decode(prepared[1]).size) == 1000
+    assert total_bytes < len(library_blob(image)["data"])
+    single, _, _ = A.prepare_llm_parts(image)
+    assert single["mime_type"] == "image/jpeg"
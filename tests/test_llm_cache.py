@@ -0,0 +1,139 @@
+import asyncio
+import io
+import json
+import os
+
+import pytest
+from PIL import Image
+
+
+class CountingModel:
+    def __init__(self, text="yanıt"):
+        self.text = text
+        self.calls = 0
+
+    async def generate_content_async(self, parts):
+        self.calls += 1
+        return Response(self.text)
+
+
+class Response:
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def cache(A, tmp_path, monkeypatch):
+    monkeypatch.setitem(A.app_config, "rate_limits", {"default": {"rpm": 10 ** 9, "tpm": 10 ** 12}})
+    monkeypatch.setitem(A.app_config, "llm_cache", {"enabled": True, "ttl_days": 30, "max_mb": 200})
+    monkeypatch.setattr(A, "_llm_log_request", lambda *args, **kwargs: None)
+    cache = A.LlmResponseCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(A, "llm_cache", cache)
+    return cache
+
+
+def reencoded(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def sample_image():
+    image = Image.new("RGB", (64, 48), "white")
+    image.paste((200, 30, 30), (8, 8, 40, 30))
+    return image
+
+
+def test_key_is_stable_across_pixel_identical_encodings(A, cache):
+    image = sample_image()
+    keys = {cache.make_key("m", "sds_ozet", ["istem", reencoded(image, fmt)]) for fmt in ("PNG", "BMP", "TIFF")}
+    keys.add(cache.make_key("m", "sds_ozet", ["istem", image.convert("RGBA")]))
+    assert len(keys) == 1
+
+    changed = image.copy()
+    changed.putpixel((0, 0), (0, 0, 0))
+    assert cache.make_key("m", "sds_ozet", ["istem", changed]) not in keys
+    assert cache.make_key("m", "gtip_formu", ["istem", image]) not in keys
+    assert cache.make_key("m2", "sds_ozet", ["istem", image]) not in keys
+
+
+def test_key_changes_with_prompt_version(A, cache, monkeypatch):
+    before = cache.make_key("m", "sds_ozet", ["istem"])
+    monkeypatch.setitem(A.PROMPT_VERSIONS, "sds_ozet", A.PROMPT_VERSIONS["sds_ozet"] + 1)
+    assert cache.make_key("m", "sds_ozet", ["istem"]) != before
+
+
+def test_expired_entry_is_a_miss_and_removed(A, cache):
+    cache.put("k", "metin", "m", "sds_ozet")
+    assert cache.get("k") == "metin"
+    path = os.path.join(cache.directory, "k.json")
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+    payload["created"] -= 31 * 86400
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    assert cache.get("k") is None
+    assert not os.path.exists(path) and cache.summary() == (0, 0)
+
+
+def test_least_recently_used_entries_are_evicted_past_max_mb(A, cache, monkeypatch):
+    cache.put("a", "x" * 10000, "m", "sds_ozet")
+    size = cache.summary()[1]
+    monkeypatch.setitem(A.app_config, "llm_cache", {"enabled": True, "ttl_days": 30, "max_mb": 2.5 * size / 1024 / 1024})
+    cache.put("b", "x" * 10000, "m", "sds_ozet")
+    assert cache.get("a") is not None          # a son erişilen olur
+    cache.put("c", "x" * 10000, "m", "sds_ozet")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert sorted(os.listdir(cache.directory)) == ["a.json", "c.json"]
+    assert cache.summary()[1] <= 2.5 * size
+
+
+def test_newest_entry_is_kept_even_if_larger_than_max_mb(A, cache, monkeypatch):
+    monkeypatch.setitem(A.app_config, "llm_cache", {"enabled": True, "ttl_days": 30, "max_mb": 1000 / 1024 / 1024})
+    cache.put("a", "x" * 100, "m", "sds_ozet")
+    cache.put("b", "x" * 5000, "m", "sds_ozet")
+    assert cache.get("a") is None and cache.get("b") is not None
+
+
+def test_disabled_cache_always_calls_the_model(A, cache, monkeypatch):
+    monkeypatch.setitem(A.app_config, "llm_cache", {"enabled": False, "ttl_days": 30, "max_mb": 200})
+    model = CountingModel()
+    monkeypatch.setattr(A, "llm_model", model)
+    stats = A.new_llm_stats()
+    for _ in range(2):
+        assert asyncio.run(A.llm_generate_async(["istem"], stats=stats, cache="sds_ozet")).text == "yanıt"
+    assert model.calls == 2
+    assert stats["cache_hits"] == stats["cache_misses"] == 0
+    assert cache.summary() == (0, 0)
+
+
+def test_bypass_skips_the_cached_answer_but_overwrites_it(A, cache, monkeypatch):
+    model = CountingModel("eski")
+    monkeypatch.setattr(A, "llm_model", model)
+    stats = A.new_llm_stats()
+    assert asyncio.run(A.llm_generate_async(["istem"], stats=stats, cache="sds_ozet")).text == "eski"
+    assert asyncio.run(A.llm_generate_async(["istem"], stats=stats, cache="sds_ozet")).text == "eski"
+    assert model.calls == 1
+
+    model.text = "yeni"
+    assert asyncio.run(A.llm_generate_async(["istem"], stats=stats, cache="sds_ozet", bypass_cache=True)).text == "yeni"
+    assert asyncio.run(A.llm_generate_async(["istem"], stats=stats, cache="sds_ozet")).text == "yeni"
+    assert model.calls == 2
+    assert (stats["cache_hits"], stats["cache_misses"]) == (2, 2)
+    assert cache.summary()[0] == 1
+
+
+def test_clear_removes_every_entry_from_disk(A, cache):
+    for key in ("a", "b", "c"):
+        cache.put(key, "metin", "m", "sds_ozet")
+    assert cache.summary()[0] == 3
+    cache.clear()
+    assert cache.summary() == (0, 0)
+    assert cache.get("a") is None
+    assert os.listdir(cache.directory) == []
+    assert A.LlmResponseCache(cache.directory).summary() == (0, 0)
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(A, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(A.time, "monotonic", clock)
+    return clock
+
+
+def test_request_bucket_spaces_out_requests_past_capacity(A, clock):
+    bucket = A.TokenBucket(60)                      # Saniyede 1 istek dolar
+    assert [bucket.reserve(1, clock.now) for _ in range(60)] == [0.0] * 60
+    assert bucket.reserve(1, clock.now) == pytest.approx(1.0)
+    assert bucket.reserve(1, clock.now) == pytest.approx(2.0)
+    clock.now += 2
+    assert bucket.reserve(1, clock.now) == pytest.approx(1.0)
+    clock.now += 600                                # Uzun boşluktan sonra kapasiteyi aşacak kadar dolmaz
+    bucket.reserve(0, clock.now)
+    assert bucket.level == 60
+
+
+def test_token_bucket_caps_single_oversized_request(A, clock):
+    bucket = A.TokenBucket(600)
+    assert bucket.reserve(10 ** 6, clock.now) == 0.0
+    assert bucket.reserve(1, clock.now) == pytest.approx(0.1)
+
+
+def test_limiter_waits_for_the_slower_bucket_and_settles_actual_tokens(A, clock):
+    limiter = A.LlmRateLimiter(rpm=600, tpm=6000)
+    assert limiter.reserve(6000) == 0.0
+    assert limiter.reserve(600) == pytest.approx(6.0)        # Token kovası: saniyede 100 token
+    limiter.settle(estimated_tokens=600, actual_tokens=100)
+    assert limiter.tokens.level == pytest.approx(-100)
+    assert limiter.reserve(0) == pytest.approx(1.0)
+
+
+@pytest.fixture
+def limits(A, monkeypatch):
+    monkeypatch.setitem(A.app_config, "model_name", "gemini-ana")
+    monkeypatch.setitem(A.app_config, "rate_limits", {
+        "default": {"rpm": 10},
+        "gemini-hizli": {"rpm": 5, "tpm": 100},
+        "models/gemini-eski": {"tpm": 50},
+    })
+
+
+def test_per_model_rate_limits_fall_back_to_default(A, limits):
+    assert A.get_llm_rate_limits("gemini-hizli") == {"rpm": 5, "tpm": 100}
+    assert A.get_llm_rate_limits("models/gemini-hizli") == {"rpm": 5, "tpm": 100}
+    assert A.get_llm_rate_limits("gemini-eski") == {"rpm": 10, "tpm": 50}
+    default_tpm = A.DEFAULT_CONFIG["rate_limits"]["default"]["tpm"]
+    assert A.get_llm_rate_limits("baska-model") == {"rpm": 10, "tpm": default_tpm}
+    assert A.get_llm_rate_limits() == A.get_llm_rate_limits("gemini-ana")
+
+
+def test_limiter_is_shared_per_model_and_renewed_when_limits_change(A, limits, monkeypatch):
+    fast = A.get_llm_limiter("gemini-hizli")
+    assert A.get_llm_limiter("models/gemini-hizli") is fast
+    assert A.get_llm_limiter("gemini-eski") is not fast
+    assert (fast.requests.capacity, fast.tokens.capacity) == (5, 100)
+    assert A.get_llm_limiter() is A.get_llm_limiter("gemini-ana")
+
+    monkeypatch.setitem(A.app_config, "rate_limits", {"gemini-hizli": {"rpm": 7, "tpm": 100}})
+    renewed = A.get_llm_limiter("gemini-hizli")
+    assert renewed is not fast and renewed.requests.capacity == 7
+
+
+class FlakyModel:
+    model_name = "kota-testi"
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    async def generate_content_async(self, parts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise google_exceptions.ResourceExhausted("kota")
+        return Response()
+
+
+class Response:
+    text = "tamam"
+    usage_metadata = None
+
+
+def test_throttle_and_backoff_waits_are_counted_in_stats(A, monkeypatch):
+    monkeypatch.setitem(A.app_config, "rate_limits", {"kota-testi": {"rpm": 600, "tpm": 10 ** 9}})
+    monkeypatch.setattr(A, "_llm_log_request", lambda *args, **kwargs: None)
+    monkeypatch.setattr(A, "llm_backoff_delay", lambda attempt: 0.03)
+    limiter = A.get_llm_limiter("kota-testi")
+    limiter.requests.level = 0.5                    # Sonraki istek ~0,05 sn beklemeli
+    waits = []
+    original = limiter.reserve
+    monkeypatch.setattr(limiter, "reserve", lambda tokens: waits.append(original(tokens)) or waits[-1])
+
+    before = dict(A.llm_call_stats)
+    stats = A.new_llm_stats()
+    model = FlakyModel(failures=1)
+    assert asyncio.run(A.llm_generate_async(["istem"], stats=stats, model=model)).text == "tamam"
+
+    assert model.calls == 2 and len(waits) == 2 and all(w > 0 for w in waits)
+    assert stats["throttle_wait"] == pytest.approx(sum(waits))
+    assert (stats["retries"], stats["backoff_wait"], stats["calls"], stats["errors"]) == (1, pytest.approx(0.03), 1, 0)
+    for key in ("throttle_wait", "backoff_wait", "retries", "calls"):
+        assert A.llm_call_stats[key] - before[key] == pytest.approx(stats[key])
+    assert "Tekrar deneme: 1 (0.0 sn bekleme)" in A.format_llm_wait_stats(stats)
+
+
+def test_exhausted_retries_count_as_error(A, monkeypatch):
+    monkeypatch.setitem(A.app_config, "rate_limits", {"default": {"rpm": 10 ** 9, "tpm": 10 ** 12}})
+    monkeypatch.setitem(A.app_config, "llm_max_retries", 2)
+    monkeypatch.setattr(A, "_llm_log_request", lambda *args, **kwargs: None)
+    monkeypatch.setattr(A, "llm_backoff_delay", lambda attempt: 0)
+    stats = A.new_llm_stats()
+    model = FlakyModel(failures=10)
+    with pytest.raises(google_exceptions.ResourceExhausted):
+        asyncio.run(A.llm_generate_async(["istem"], stats=stats, model=model))
+    assert model.calls == 3
+    assert (stats["retries"], stats["errors"], stats["calls"]) == (2, 1, 0)
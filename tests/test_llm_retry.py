@@ -0,0 +1,50 @@
+import grpc
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ResourceExhausted("quota"),
+    google_exceptions.TooManyRequests("slow down"),
+    google_exceptions.ServiceUnavailable("unavailable"),
+    google_exceptions.InternalServerError("internal"),
+    google_exceptions.GatewayTimeout("timeout"),
+    google_exceptions.DeadlineExceeded("deadline"),
+])
+def test_transient_api_errors_are_retried(A, error):
+    assert A.is_retryable_llm_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.InvalidArgument("bad request"),
+    google_exceptions.PermissionDenied("API key not valid"),
+    google_exceptions.NotFound("model 500-pro not found"),
+    ValueError("satır 429: 503 adet, toplam 500"),
+    RuntimeError("ResourceExhausted değil, yanlış şema"),
+])
+def test_other_errors_are_not_retried_even_if_message_has_status_numbers(A, error):
+    assert not A.is_retryable_llm_error(error)
+
+
+class CodedError(Exception):
+    def __init__(self, code):
+        super().__init__("hata")
+        self.code = code
+
+
+class RpcError(Exception):
+    def __init__(self, status):
+        super().__init__("rpc")
+        self._status = status
+
+    def code(self):
+        return self._status
+
+
+def test_status_code_attribute_and_grpc_status(A):
+    assert A.is_retryable_llm_error(CodedError(429))
+    assert A.is_retryable_llm_error(CodedError(503))
+    assert not A.is_retryable_llm_error(CodedError(400))
+    assert not A.is_retryable_llm_error(CodedError(True))
+    assert A.is_retryable_llm_error(RpcError(grpc.StatusCode.UNAVAILABLE))
+    assert not A.is_retryable_llm_error(RpcError(grpc.StatusCode.INVALID_ARGUMENT))
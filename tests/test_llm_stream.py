@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+
+class Chunk:
+    def __init__(self, text):
+        self._text = text
+
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("güvenlik parçası")      # Metni olmayan parçalarda .text hata verir
+        return self._text
+
+
+class Stream:
+    usage_metadata = None
+
+    def __init__(self, chunks, fail_after=None, delay=0):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.delay = delay
+
+    async def __aiter__(self):
+        for i, text in enumerate(self.chunks):
+            if i == self.fail_after:
+                raise google_exceptions.ServiceUnavailable("bağlantı koptu")
+            await asyncio.sleep(self.delay if i == 0 else 0)
+            yield Chunk(text)
+
+
+class StreamingModel:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def generate_content_async(self, parts, stream=False):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def streaming(A, tmp_path, monkeypatch):
+    monkeypatch.setitem(A.app_config, "rate_limits", {"default": {"rpm": 10 ** 9, "tpm": 10 ** 12}})
+    monkeypatch.setattr(A, "llm_cache", A.LlmResponseCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(A, "llm_backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(A, "HISTORY_DIR", str(tmp_path))
+    monkeypatch.setattr(A, "LLM_METRICS_FILE", str(tmp_path / "metrikler.jsonl"))
+
+    def use(model, stats=None, cache=None):
+        monkeypatch.setattr(A, "llm_model", model)
+
+        async def collect():
+            return [chunk async for chunk in A.llm_stream_async(["istem"], stats, cache=cache)]
+        return asyncio.run(collect())
+    return use
+
+
+def metrics(tmp_path):
+    with open(tmp_path / "metrikler.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_error_before_first_chunk_is_retried(A, streaming, tmp_path):
+    model = StreamingModel(google_exceptions.ServiceUnavailable("meşgul"), Stream([None, "a", "b"]))
+    stats = A.new_llm_stats()
+    assert streaming(model, stats) == ["a", "b"]
+    assert model.calls == 2
+    assert (stats["retries"], stats["errors"], stats["calls"], stats["streams"]) == (1, 0, 1, 1)
+    assert metrics(tmp_path)[-1]["attempts"] == 2
+
+
+def test_stream_broken_before_text_is_retried(A, streaming):
+    model = StreamingModel(Stream([None, "x"], fail_after=1), Stream(["tam yanıt"]))
+    assert streaming(model, A.new_llm_stats()) == ["tam yanıt"]
+    assert model.calls == 2
+
+
+def test_error_after_first_chunk_is_raised_without_retry(A, streaming, tmp_path, monkeypatch):
+    model = StreamingModel(Stream(["a", "b", "c"], fail_after=2), Stream(["yeniden"]))
+    stats = A.new_llm_stats()
+    received = []
+
+    async def collect():
+        async for chunk in A.llm_stream_async(["istem"], stats):
+            received.append(chunk)
+
+    monkeypatch.setattr(A, "llm_model", model)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        asyncio.run(collect())
+    assert received == ["a", "b"]
+    assert model.calls == 1
+    assert (stats["retries"], stats["errors"], stats["calls"]) == (0, 1, 0)
+    assert metrics(tmp_path)[-1]["status"] == "error"
+
+
+def test_non_retryable_error_is_raised_immediately(A, streaming):
+    model = StreamingModel(google_exceptions.InvalidArgument("hatalı istek"), Stream(["a"]))
+    with pytest.raises(google_exceptions.InvalidArgument):
+        streaming(model, A.new_llm_stats())
+    assert model.calls == 1
+
+
+def test_time_to_first_token_is_written_to_metrics(A, streaming, tmp_path):
+    stats = A.new_llm_stats()
+    assert streaming(StreamingModel(Stream(["ilk", " son"], delay=0.05)), stats, cache="asistan_siniflandirma") == ["ilk", " son"]
+    entry = metrics(tmp_path)[-1]
+    assert entry["status"] == "ok" and entry["prompt"] == "asistan_siniflandirma"
+    assert 50 <= entry["ttft_ms"] <= entry["total_ms"]
+    assert stats["streams"] == 1 and stats["first_token_seconds"] >= 0.05
+
+
+def test_cached_stream_is_a_single_chunk_without_model_call(A, streaming, tmp_path):
+    assert streaming(StreamingModel(Stream(["a", "b"])), cache="asistan_siniflandirma") == ["a", "b"]
+    model = StreamingModel()
+    stats = A.new_llm_stats()
+    assert streaming(model, stats, cache="asistan_siniflandirma") == ["ab"]
+    assert model.calls == 0 and stats["cache_hits"] == 1 and stats["streams"] == 0
+    assert len(metrics(tmp_path)) == 1
+
+
+def test_non_streaming_requests_log_no_ttft(A, streaming, tmp_path, monkeypatch):
+    class Response:
+        text = "yanıt"
+        usage_metadata = None
+
+    monkeypatch.setattr(A, "llm_model", StreamingModel(Response()))
+    assert asyncio.run(A.llm_generate_async(["istem"])).text == "yanıt"
+    assert metrics(tmp_path)[-1]["ttft_ms"] is None
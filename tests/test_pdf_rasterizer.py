@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def rasterizer(A, tmp_path, monkeypatch):
+    """Poppler yerine sayfa numarası kadar genişlikte PNG yazan sahte çizici."""
+    monkeypatch.setitem(A.app_config, "raster", {"workers": 2, "cache_mb": 0.01, "queue_size": 2})
+    renders = []
+
+    def fake_convert(file_path, dpi, first_page, last_page, output_folder, output_file, **kwargs):
+        renders.append(first_page)
+        path = os.path.join(output_folder, output_file + ".png")
+        Image.frombytes("L", (64, 64), os.urandom(64 * 64)).save(path)
+        return [path]
+
+    monkeypatch.setattr(A, "convert_from_path", fake_convert)
+    pdf = tmp_path / "belge.pdf"
+    pdf.write_bytes(b"%PDF-1.4 sahte")
+    r = A.PdfRasterizer(str(tmp_path / "onbellek"))
+    r.renders = renders
+    r.pdf = str(pdf)
+    return r
+
+
+def test_pinned_page_survives_eviction(A, rasterizer):
+    key = rasterizer._pin_page(rasterizer.pdf, 100, 1)
+    for page in range(2, 8):
+        rasterizer.open_page(rasterizer.pdf, 100, page)
+    assert os.path.exists(rasterizer._path(key))
+    rasterizer._unpin_page(key)
+
+    for page in range(8, 14):
+        rasterizer.open_page(rasterizer.pdf, 100, page)
+    assert not os.path.exists(rasterizer._path(key))
+    assert rasterizer._pins == {}
+
+
+def test_cached_page_is_not_rendered_twice(A, rasterizer):
+    first = rasterizer.open_page(rasterizer.pdf, 100, 1)
+    second = rasterizer.open_page(rasterizer.pdf, 100, 1)
+    assert rasterizer.renders == [1]
+    assert first.tobytes() == second.tobytes()
+
+
+def test_concurrent_readers_and_evictions(A, rasterizer):
+    errors = []
+
+    def reader(offset):
+        try:
+            for i in range(30):
+                rasterizer.open_page(rasterizer.pdf, 100, 1 + (i + offset) % 6)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(6)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert errors == [] and rasterizer._pins == {}
+
+
+def test_iter_document_images_bounds_documents_in_flight(A, monkeypatch):
+    monkeypatch.setitem(A.app_config, "raster", {"workers": 2, "cache_mb": 1, "queue_size": 3})
+    started = []
+
+    def fake_load(file_path, dpi):
+        started.append(file_path)
+        time.sleep(0.002)
+        if file_path == "f5":
+            raise ValueError("okunamadı")
+        return {"kind": "text", "text": file_path}
+
+    monkeypatch.setattr(A, "load_document_for_llm", fake_load)
+
+    async def consume():
+        seen = []
+        async for index, path, document, error in A.iter_document_images([f"f{i}" for i in range(40)]):
+            # Tüketici yavaş: hazırlanan belge sayısı tüketilenin ancak workers + queue_size kadar önünde olabilir
+            assert len(started) <= len(seen) + 1 + 2 + 3
+            seen.append((index, path, error is not None))
+            await asyncio.sleep(0.005)
+        return seen
+
+    seen = asyncio.run(consume())
+    assert sorted(index for index, _, _ in seen) == list(range(40))
+    assert [path for _, path, failed in seen if failed] == ["f5"]
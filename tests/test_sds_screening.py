@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize("cas", ["7732-18-5", "50-00-0", "64-17-5", "111-76-2", "9003-35-4", "1330-20-7"])
+def test_valid_cas_numbers(A, cas):
+    assert A.is_valid_cas_number(cas)
+
+
+@pytest.mark.parametrize("cas", ["7732-18-4", "64-71-5", "111-67-2", "12-3", "", "abc-de-f", "7732 18 5", None])
+def test_invalid_cas_numbers(A, cas):
+    assert not A.is_valid_cas_number(cas)
+
+
+def test_extract_cas_numbers_keeps_order_and_whole_numbers(A):
+    text = "Ethanol 64-17-5 (10%), water 7732-18-5; ethanol 64-17-5 again; 157577-99-6 only"
+    assert A.extract_cas_numbers(text) == ["64-17-5", "7732-18-5", "157577-99-6"]
+    assert "77-99-6" not in A.extract_cas_numbers(text)
+
+
+def sds(composition):
+    return {"kind": "text", "text": "1. IDENTIFICATION\nProduct name: TEST-100\n\n"
+                                    "SECTION 3: COMPOSITION/INFORMATION ON INGREDIENTS\n" + composition +
+                                    "\nSECTION 4: FIRST AID MEASURES\nRinse with water.\n"}
+
+
+def with_check_digit(body):
+    check = sum(int(d) * w for w, d in enumerate(reversed(body), 1)) % 10
+    return f"{body[:-2]}-{body[-2:]}-{check}"
+
+
+@pytest.fixture
+def listed(A, shipped_tax_snapshot, monkeypatch):
+    """Listede farklı vergi kayıtlarına çıkan iki geçerli CAS ve listede olmayan bir geçerli CAS."""
+    monkeypatch.setattr(A, "get_tax_snapshot", lambda as_of=None: shipped_tax_snapshot)
+    by_record = {}
+    for cas in shipped_tax_snapshot.cas_index:
+        if A.is_valid_cas_number(cas):
+            record = A.lookup_tax_by_cas(cas, shipped_tax_snapshot.records, shipped_tax_snapshot.cas_index)
+            by_record.setdefault((record["gtp"], record["tanim"]), cas)
+    first, second = list(by_record.values())[:2]
+    unlisted = next(c for c in (with_check_digit(str(n)) for n in range(9990000, 9999999))
+                    if c not in shipped_tax_snapshot.cas_index)
+    return first, second, unlisted
+
+
+def test_single_listed_cas_is_resolved_locally(A, listed):
+    cas = listed[0]
+    result, reason = A.screen_sds_locally(sds(f"Ingredient  {cas}  40-60 %"))
+    assert reason == "yerel"
+    assert result["main_cas"] == cas and result["product_name"] == "TEST-100"
+
+
+def test_bad_check_digit_and_missing_cas(A, listed):
+    cas = listed[0]
+    typo = cas[:-1] + str((int(cas[-1]) + 1) % 10)
+    assert A.screen_sds_locally(sds(f"Ingredient  {typo}  40-60 %")) == (None, "geçerli CAS bulunamadı")
+    assert A.screen_sds_locally(sds("Mixture of resins, no hazardous ingredients")) == (None, "geçerli CAS bulunamadı")
+
+
+def test_unlisted_cas_only(A, listed):
+    assert A.screen_sds_locally(sds(f"Resin  {listed[2]}  100 %")) == (None, "CAS'lar vergi listesinde yok")
+
+
+def test_listed_minor_component_is_not_reported_as_main(A, listed):
+    listed_cas, _, unlisted = listed
+    composition = f"Main resin      {unlisted}   60 - 80 %\nAdditive        {listed_cas}   < 1 %"
+    assert A.screen_sds_locally(sds(composition)) == (None, f"ana bileşen ({unlisted}) vergi listesinde yok")
+
+
+def test_several_cas_without_concentrations_are_ambiguous(A, listed):
+    listed_cas, _, unlisted = listed
+    composition = f"Resin    {unlisted}\nAdditive {listed_cas}"
+    assert A.screen_sds_locally(sds(composition)) == (None, "birden fazla CAS, ana bileşen belirsiz")
+
+
+def test_listed_main_component_wins_over_unlisted_minor(A, listed):
+    listed_cas, _, unlisted = listed
+    composition = f"Solvent   {listed_cas}  215-535-7  40 - 60 %\nDefoamer  {unlisted}  0,1 - 1 %"
+    result, reason = A.screen_sds_locally(sds(composition))
+    assert reason == "yerel" and result["main_cas"] == listed_cas
+
+
+def test_two_listed_records_need_a_clear_main_component(A, listed):
+    first, second, _ = listed
+    overlapping = f"A  {first}  10 - 30 %\nB  {second}  20 - 25 %"
+    assert A.screen_sds_locally(sds(overlapping)) == (None, "2 farklı vergi kaydı eşleşti (belirsiz)")
+    clear = f"A  {first}  ≥ 90 %\nB  {second}  1 - 5 %"
+    result, reason = A.screen_sds_locally(sds(clear))
+    assert reason == "yerel" and result["main_cas"] == first
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Xylene 1330-20-7 215-535-7 30 - 35 %", (30.0, 35.0)),
+    ("Ethanol 64-17-5 <1%", (0.0, 1.0)),
+    ("Butoxyethanol 111-76-2 ≥ 90%", (90.0, 100.0)),
+    ("Water 7732-18-5 12,5%", (12.5, 12.5)),
+    ("Isopropanol 67-63-0 1 to 5 %", (1.0, 5.0)),
+    ("Formaldehyde 50-00-0 200-001-8", None),
+])
+def test_parse_sds_concentration(A, line, expected):
+    assert A.parse_sds_concentration(line) == expected
+
+
+def test_local_screening_requires_text_layer(A):
+    assert A.screen_sds_locally({"kind": "image", "image": None}) == (None, "metin katmanı yok")
+
+
+def test_analyze_single_sds_local_first_skips_the_model(A, listed, monkeypatch):
+    calls = []
+
+    async def fake_extract(prompt, cache_name, document, stats=None, bypass_cache=False, cache_key=None):
+        calls.append(document)
+        return {"product_name": "Model", "main_cas": ""}
+
+    monkeypatch.setattr(A, "extract_document_json", fake_extract)
+    listed_cas, _, unlisted = listed
+
+    row, log = asyncio.run(A.analyze_single_sds("ABC-1 sds.pdf", {}, A.new_llm_stats(),
+                                                sds(f"Solvent {listed_cas} 40-60 %"), local_first=True))
+    assert row["ÇÖZÜM"] == "Yerel (CAS)" and row["CAS NR (REF:SDS)"] == listed_cas
+    assert row["G.T.İ.P. *"] not in ("HATA", "Eşleşme Yok")
+    assert calls == []
+
+    ambiguous = sds(f"Resin {unlisted} 60-80 %\nAdditive {listed_cas} < 1 %")
+    row, log = asyncio.run(A.analyze_single_sds("ABC-2 sds.pdf", {}, A.new_llm_stats(), ambiguous, local_first=True))
+    assert row["ÇÖZÜM"] == "Gemini" and len(calls) == 1
+    assert "vergi listesinde yok" in log
@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.mark.parametrize("raw, folded", [
+    ("İZOSİYANAT", "izosiyanat"),
+    ("IŞIK", "isik"),
+    ("ışık", "isik"),
+    ("Çözücü Şeffaf Ğ", "cozucu seffaf g"),
+    ("BYK®-333 Additive™", "byk-333 additive"),
+    ("Straße", "strasse"),
+    ("Epoxy Resin", "epoxy resin"),
+])
+def test_fold_search_text(A, raw, folded):
+    assert A.fold_search_text(raw) == folded
+
+
+def test_fold_keeps_spacing_and_punctuation_for_substring_search(A):
+    assert A.fold_search_text("Rheobyk-431, %40 çözelti") == "rheobyk-431, %40 cozelti"
+    assert A.fold_search_text(123) == "123"
+
+
+def test_turkish_dotted_and_dotless_i_match_each_other(A):
+    keys = {A.fold_search_text(word) for word in ("SİLİKON", "SILIKON", "silikon", "sılıkon")}
+    assert keys == {"silikon"}
+
+
+@pytest.mark.parametrize("raw, compact", [
+    ("Rheobyk-431", "rheobyk431"),
+    ("RHEOBYK 431", "rheobyk431"),
+    ("rheobyk_431®", "rheobyk431"),
+    ("3824.99.96.00.00", "382499960000"),
+    ("  Poli-Üretan  ", "poliuretan"),
+    ("—", ""),
+])
+def test_compact_search_key(A, raw, compact):
+    assert A.compact_search_key(raw) == compact
+
+
+def test_folding_is_idempotent(A):
+    for text in ("İÇERİK Şİşe ® ıı", "Rheobyk-431", "Ñandú"):
+        once = A.fold_search_text(text)
+        assert A.fold_search_text(once) == once
+        assert A.compact_search_key(A.compact_search_key(text)) == A.compact_search_key(text)
@@ -0,0 +1,100 @@
+import json
+import math
+
+import pytest
+
+
+RECORDS = [
+    {"gtp": "2901.10.00", "tanim": "Heksan (CAS 110-54-3) ve izomerleri"},
+    {"gtp": "2902.11.00", "tanim": "Sikloheksan"},
+    {"gtp": "2903.19.00", "tanim": "Dimetilheksan çözücü karışımı"},
+    {"gtp": "3907.30.00", "tanim": "Epoksi reçineleri, epoksi sertleştirici ile birlikte"},
+    {"gtp": "3907.30.00", "tanim": "Epoksi reçineleri"},
+    {"gtp": "3910.00.00", "tanim": "Silikonlar, ilk şekillerde (polisiloksan)"},
+    {"gtp": "3402.42.00", "tanim": "Noniyonik yüzey aktif maddeler, silikon esaslı"},
+    {"gtp": "3208.20.10", "tanim": "Akrilik polimer esaslı boya ve vernikler"},
+]
+
+
+def brute_force_bm25(A, records, query_terms, k1=1.5, b=0.75, partial_weight=0.5):
+    docs = [A.tokenize_tax_text(r["tanim"]) for r in records]
+    avg = sum(map(len, docs)) / len(docs)
+    vocabulary = {t for d in docs for t in d}
+    weights = {}
+    for q in set(query_terms):
+        if q in vocabulary:
+            weights[q] = max(1.0, weights.get(q, 0.0))
+        if len(q) >= 5:
+            for t in vocabulary:
+                if q in t and t != q:
+                    weights[t] = max(partial_weight, weights.get(t, 0.0))
+    scores = {}
+    for term, weight in weights.items():
+        df = sum(term in d for d in docs)
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5)) * weight
+        for pos, d in enumerate(docs):
+            tf = d.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(d) / avg)
+                scores[pos] = scores.get(pos, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+@pytest.mark.parametrize("query", ["heksan", "epoksi reçine sertleştirici", "silikon yüzey aktif", "akrilik boya", "bulunmayan"])
+def test_index_scores_match_brute_force(A, query):
+    index = A.TaxTermIndex(RECORDS)
+    terms = A.tokenize_tax_text(query, min_len=4)
+    expected = brute_force_bm25(A, RECORDS, terms)
+    got = index.search(terms, top_k=len(RECORDS))
+    assert {pos: pytest.approx(score) for score, pos in got} == expected
+    assert [score for score, _ in got] == sorted((score for score, _ in got), reverse=True)
+
+
+def test_exact_term_outranks_compound_expansion(A):
+    index = A.TaxTermIndex(RECORDS)
+    ranked = [pos for _, pos in index.search(["heksan"])]
+    assert ranked[0] == 0
+    assert set(ranked) == {0, 1, 2}
+
+
+def test_repeated_term_in_short_description_ranks_first(A):
+    index = A.TaxTermIndex(RECORDS)
+    ranked = [pos for _, pos in index.search(["epoksi"])]
+    assert ranked == [4, 3]
+
+
+def test_state_round_trip_searches_identically(A, shipped_tax_records):
+    index = A.TaxTermIndex(shipped_tax_records)
+    restored = A.TaxTermIndex.from_state(index.to_state())
+    for query in (["silikon"], ["epoksi", "reçine"], ["polietilen", "glikol"], ["heksan"]):
+        assert restored.search(query) == index.search(query)
+
+
+@pytest.fixture
+def tax_file(tmp_path):
+    path = tmp_path / "vergi.jsonl"
+    path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in RECORDS), encoding="utf-8")
+    return str(path)
+
+
+def test_context_interleaves_products_and_matches_descriptions_only(A, tax_file):
+    products = [{"name": "Epoksi sertleştirici", "ingredients": []},
+                {"name": "Silikon katkı", "ingredients": ["polisiloksan"]},
+                {"name": "3907", "ingredients": ["2902"]}]
+    lines = A.get_smart_tax_context(products, tax_file).splitlines()
+    assert lines[0].startswith("- Epoksi reçineleri, epoksi sertleştirici")
+    assert lines[1].startswith("- Silikonlar")
+    # GTIP kodundaki rakamlar ürün kelimeleriyle eşleşmez
+    assert all("Akrilik" not in line and "Heksan" not in line for line in lines)
+
+
+def test_context_respects_token_budget_and_has_fallback(A, tax_file):
+    products = [{"name": "epoksi silikon akrilik heksan", "ingredients": []}]
+    full = A.get_smart_tax_context(products, tax_file).splitlines()
+    budget = sum(A.estimate_token_count(line) for line in full[:2])
+    trimmed = A.get_smart_tax_context(products, tax_file, token_budget=budget).splitlines()
+    assert trimmed[:2] == full[:2]
+    assert sum(A.estimate_token_count(line) for line in trimmed) <= budget
+
+    none = A.get_smart_tax_context([{"name": "xyz", "ingredients": []}], tax_file)
+    assert "bulunamadı" in none
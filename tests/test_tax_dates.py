@@ -0,0 +1,74 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("2025-12-31 00:00:00", date(2025, 12, 31)),
+    ("31/12/2025", date(2025, 12, 31)),
+    ("31.12.2025", date(2025, 12, 31)),
+    ("31122025", date(2025, 12, 31)),
+    ("**31/12/2025**", date(2025, 12, 31)),
+    ("  2029-01-05  ", date(2029, 1, 5)),
+])
+def test_parse_review_date_accepts_known_formats(A, raw, expected):
+    assert A.parse_review_date(raw) == expected
+
+
+@pytest.mark.parametrize("raw", ["", "-", "nan", "31/02/2025", "Süresiz", "2025/12/31"])
+def test_parse_review_date_rejects_unknown_values(A, raw):
+    assert A.parse_review_date(raw) is None
+
+
+def test_normalize_review_date(A):
+    assert A.normalize_review_date("31.12.2025") == "2025-12-31"
+    assert A.normalize_review_date(None) == "-"
+    assert A.normalize_review_date("nan") == "-"
+    assert A.normalize_review_date(" Süresiz ") == "Süresiz"
+
+
+def test_format_review_date_status_boundaries(A):
+    today = date(2026, 1, 1)
+    assert "SÜRESİ DOLMUŞ" in A.format_review_date_status(today, today)
+    assert "KRİTİK" in A.format_review_date_status(today + timedelta(days=1), today)
+    assert "KRİTİK" in A.format_review_date_status(today + timedelta(days=A.TAX_EXPIRY_WARNING_DAYS), today)
+    assert A.format_review_date_status(today + timedelta(days=A.TAX_EXPIRY_WARNING_DAYS + 1), today) == "2027-01-02"
+
+
+def test_expiry_view_lists_expiring_records_in_date_order(A):
+    today = date(2026, 1, 1)
+    records = [
+        {"gtp": "1", "tanim": "a", "gecerlilik": "2030-01-01"},
+        {"gtp": "2", "tanim": "b", "gecerlilik": "2026-06-01"},
+        {"gtp": "3", "tanim": "c", "gecerlilik": "-"},
+        {"gtp": "4", "tanim": "d", "gecerlilik": "2025-06-01"},
+    ]
+    view = A.build_tax_expiry_view(records, today)
+    assert view["expiring"] == [(date(2025, 6, 1), 3), (date(2026, 6, 1), 1)]
+    assert view["displays"][0] == "2030-01-01"
+    assert view["displays"][2] == "-"
+
+
+def test_validity_display_finds_equal_record_copies(A):
+    records = [{"gtp": "1", "tanim": "a", "gecerlilik": "2000-01-01"}]
+    snapshot = A.TaxSnapshot(records, {}, None)
+    # Kopya nesne de (aynı içerik) hazır görünümden bulunur
+    assert "SÜRESİ DOLMUŞ" in A.tax_validity_display(dict(records[0]), snapshot)
+
+
+def test_expiry_view_is_built_once_under_concurrency(A, monkeypatch):
+    records = [{"gtp": str(i), "tanim": "x", "gecerlilik": "2030-01-01"} for i in range(50)]
+    snapshot = A.TaxSnapshot(records, {}, None)
+    builds = []
+    original = A.build_tax_expiry_view
+    monkeypatch.setattr(A, "build_tax_expiry_view", lambda recs, today: builds.append(1) or original(recs, today))
+
+    views = []
+    threads = [threading.Thread(target=lambda: views.append(A.get_tax_expiry_view(snapshot))) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1
+    assert all(v is views[0] for v in views)
@@ -0,0 +1,52 @@
+from difflib import SequenceMatcher
+
+import pytest
+
+
+def full_scan(A, texts, name, top_k=5):
+    """Trigram indeksinden önceki davranış: her kayıt için içerme + SequenceMatcher taraması."""
+    target = A.fold_search_text(name).strip()
+    if not target:
+        return []
+    results = []
+    for pos, text in enumerate(texts):
+        if target in text:
+            results.append((A.TAX_NAME_SUBSTRING_SCORE, 1.0, pos))
+            continue
+        ratio = SequenceMatcher(None, target, text).ratio()
+        if ratio > A.TAX_NAME_MIN_SIMILARITY:
+            results.append((int(ratio * A.TAX_NAME_SIMILARITY_WEIGHT), ratio, pos))
+    return sorted(results, key=lambda r: (-r[0], r[2]))[:top_k]
+
+
+@pytest.fixture(scope="module")
+def shipped_queries(shipped_tax_records):
+    """Gerçek listeden kısa ad sorguları: ilk kelimeler, harf hatası ve kırpılmış tanımlar."""
+    queries = [" ".join(rec["tanim"].split()[:3]) for rec in shipped_tax_records[::150]]
+    short = [rec["tanim"] for rec in shipped_tax_records if len(rec["tanim"]) < 60][::25]
+    for text in short:
+        middle = len(text) // 2
+        queries.append(text[:middle] + "x" + text[middle + 1:])
+        queries.append(text[:-3])
+    return [q for q in queries if q.strip()]
+
+
+def test_trigram_search_matches_full_scan_on_shipped_list(A, shipped_tax_records, shipped_queries):
+    index = A.TaxTrigramIndex(shipped_tax_records)
+    assert len(shipped_queries) > 30
+    for query in shipped_queries:
+        expected = full_scan(A, index.texts, query)
+        assert index.search(query, shortlist=0) == expected, query
+        assert index.search(query, shortlist=A.TAX_NAME_SHORTLIST) == expected, query
+
+
+def test_shortlist_can_drop_a_match_and_zero_disables_it(A, monkeypatch):
+    # Sahte adaylar sorguyla daha çok trigram paylaşır ama benzerlik eşiğinin altında kalır;
+    # gerçek benzer kayıt (oran 0.8) daha az trigram paylaşır.
+    records = [{"tanim": "abcdefgxyz"}, {"tanim": "axcdeyghij"}]
+    index = A.TaxTrigramIndex(records)
+    assert [pos for _, _, pos in index.search("abcdefghij", shortlist=1)] == []
+    assert [pos for _, _, pos in index.search("abcdefghij", shortlist=0)] == [1]
+
+    monkeypatch.setitem(A.app_config, "tax_name_shortlist", 0)
+    assert [pos for _, _, pos in index.search("abcdefghij")] == [1]
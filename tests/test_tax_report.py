@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.tax_pipeline import REPORT_COLS, legacy_report_frame, make_synthetic_inputs  # noqa: E402
+
+
+def assert_same_report(A, df_orders, df_ing, snapshot):
+    legacy_df, legacy_matched = legacy_report_frame(df_orders, df_ing, REPORT_COLS, snapshot)
+    vector_df, vector_matched = A.build_tax_report_vectorized(df_orders, df_ing, REPORT_COLS, snapshot)
+    assert vector_matched == legacy_matched
+    pd.testing.assert_frame_equal(vector_df.fillna("").astype(str).reset_index(drop=True),
+                                  legacy_df.reset_index(drop=True))
+
+
+def test_vectorized_report_matches_legacy_on_synthetic_orders(A, shipped_tax_snapshot):
+    df_orders, df_ing = make_synthetic_inputs(shipped_tax_snapshot, n_products=120, ingredients_per_product=4, n_orders=300)
+    assert_same_report(A, df_orders, df_ing, shipped_tax_snapshot)
+
+
+def test_vectorized_report_matches_legacy_on_edge_cases(A, shipped_tax_snapshot):
+    records = shipped_tax_snapshot.records
+    cas = next(iter(shipped_tax_snapshot.cas_index))
+    name = records[0]["tanim"][:20]
+    df_ing = pd.DataFrame([
+        {"Product code": "P1", "Type": "Product", "CAS": "", "Standard description": "", "Percent": ""},
+        {"Product code": "P1", "Type": "*", "CAS": f"({cas})", "Standard description": "x", "Percent": "10"},
+        {"Product code": "P1", "Type": "*", "CAS": "848", "Standard description": name.upper(), "Percent": "5"},
+        {"Product code": " P2 ", "Type": "*", "CAS": "", "Standard description": "su", "Percent": "85"},
+        {"Product code": "P3", "Type": "*", "CAS": "1-00-0", "Standard description": "listede olmayan madde", "Percent": "1"},
+    ], dtype=str)
+    df_orders = pd.DataFrame({
+        "Malzeme": ["P1", "P2", "P9", "P1", "P3"],
+        "Malzeme Tanım": ["Boya", "Su bazlı", "Kayıtsız", "Boya (tekrar)", "Diğer"],
+    }, dtype=str)
+    assert_same_report(A, df_orders, df_ing, shipped_tax_snapshot)
@@ -0,0 +1,100 @@
+import json
+import os
+import pickle
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+def test_snapshot_round_trip_keeps_records_and_indexes(A, tmp_path, shipped_tax_records):
+    jsonl = str(tmp_path / "vergi_listesi.jsonl")
+    write_jsonl(jsonl, shipped_tax_records)
+    signature = A.get_file_signature(jsonl)
+    A.write_tax_snapshot(shipped_tax_records, jsonl, signature)
+
+    loaded = A.load_tax_snapshot(jsonl, signature)
+    assert loaded is not None
+    assert loaded.records == shipped_tax_records
+    assert {k: list(v) for k, v in loaded.cas_index.items()} == A.build_tax_cas_index(shipped_tax_records)
+
+    built = A.TaxSnapshot(shipped_tax_records, A.build_tax_cas_index(shipped_tax_records), signature)
+    terms = A.tokenize_tax_text("hidrojene hint yağı etilen glikol")
+    assert loaded.derived("bm25", A.TaxTermIndex).search(terms) == built.derived("bm25", A.TaxTermIndex).search(terms)
+    assert (loaded.derived("trigram", A.TaxTrigramIndex).search("hint yağı")
+            == built.derived("trigram", A.TaxTrigramIndex).search("hint yağı"))
+
+
+def test_snapshot_is_ignored_when_tampered_stale_or_pickled(A, tmp_path):
+    records = [{"gtp": "2905.31", "tanim": "Etilen glikol CAS RN 107-21-1", "gv_oran": "0"}]
+    jsonl = str(tmp_path / "vergi_listesi.jsonl")
+    write_jsonl(jsonl, records)
+    signature = A.get_file_signature(jsonl)
+    snapshot_path = A.get_tax_snapshot_path(jsonl)
+
+    A.write_tax_snapshot(records, jsonl, signature)
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    with open(snapshot_path, "wb") as f:
+        f.write(data.replace(b"107-21-1", b"107-21-2"))
+    assert A.load_tax_snapshot(jsonl, signature) is None           # Gövde özeti tutmuyor
+
+    A.write_tax_snapshot(records, jsonl, signature)
+    assert A.load_tax_snapshot(jsonl, [1, 2]) is None              # JSONL değişmiş
+
+    with open(snapshot_path, "wb") as f:                           # Eski (pickle) biçim asla yüklenmez
+        pickle.dump({"format": A.TAX_SNAPSHOT_FORMAT}, f)
+    assert A.load_tax_snapshot(jsonl, signature) is None
+
+
+def test_database_rebuilds_snapshot_after_load_error(A, tmp_path):
+    records = [{"gtp": "2905.31", "tanim": "Etilen glikol CAS RN 107-21-1", "gv_oran": "0"}]
+    jsonl = str(tmp_path / "vergi_listesi.jsonl")
+    write_jsonl(jsonl, records)
+    with open(A.get_tax_snapshot_path(jsonl), "wb") as f:
+        f.write(b"\x80\x04 bozuk dosya")
+
+    snapshot = A.TaxDatabase(jsonl).snapshot()
+    assert snapshot.records == records
+    assert A.load_tax_snapshot(jsonl, A.get_file_signature(jsonl)).records == records
+
+
+def test_tax_database_is_memoized_per_path(A, tmp_path, monkeypatch):
+    monkeypatch.setattr(A, "_tax_databases", {})
+    monkeypatch.chdir(tmp_path)
+    first = A.get_tax_database(str(tmp_path / "liste_a.jsonl"))
+    assert A.get_tax_database("liste_a.jsonl") is first
+    assert A.get_tax_database(str(tmp_path / "alt" / ".." / "liste_a.jsonl")) is first
+    assert A.get_tax_database(str(tmp_path / "liste_b.jsonl")) is not first
+    assert A.get_tax_database(A.TAX_DB_FILE) is A.tax_db
+
+
+def test_tax_database_reloads_only_when_mtime_or_size_changes(A, tmp_path):
+    records = [{"gtp": "2905.31", "tanim": "Etilen glikol CAS RN 107-21-1", "gv_oran": "0"}]
+    jsonl = tmp_path / "vergi_listesi.jsonl"
+    write_jsonl(jsonl, records)
+    db = A.TaxDatabase(str(jsonl))
+
+    first = db.snapshot()
+    assert db.snapshot() is first
+    assert db.get_stats() == {"hits": 1, "misses": 1, "reloads": 0}
+
+    # Aynı içerik, yeni değişim zamanı
+    st = os.stat(jsonl)
+    os.utime(jsonl, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    second = db.snapshot()
+    assert second is not first and second.records == records
+
+    # Değişim zamanı aynı bırakılsa da boyut değişimi fark edilir
+    st = os.stat(jsonl)
+    write_jsonl(jsonl, records + [{"gtp": "2207.10", "tanim": "Etil alkol CAS RN 64-17-5", "gv_oran": "0"}])
+    os.utime(jsonl, ns=(st.st_atime_ns, st.st_mtime_ns))
+    third = db.snapshot()
+    assert third is not second and len(third.records) == 2 and "64-17-5" in third.cas_index
+
+    assert db.snapshot() is third
+    db.invalidate()
+    assert db.snapshot() is not third
+    assert db.get_stats() == {"hits": 2, "misses": 4, "reloads": 3}
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def tax_inputs(tmp_path, shipped_tax_snapshot):
+    """Sipariş ve bileşen dosyaları: birden çok parçaya bölünecek kadar satır, eşleşen/eşleşmeyen karışık."""
+    cas_keys = list(shipped_tax_snapshot.cas_index)
+    names = [r["tanim"][:20] for r in shipped_tax_snapshot.records[:30]]
+    ing_rows = []
+    for p in range(40):
+        ing_rows.append({"Product code": f"P{p}", "Type": "Product", "CAS": None, "Standard description": None, "Percent": None})
+        for k in range(3):
+            seed = p * 3 + k
+            ing_rows.append({"Product code": f"P{p}", "Type": "*",
+                             "CAS": cas_keys[seed % len(cas_keys)] if seed % 4 else f"{1000 + seed}-00-0",
+                             "Standard description": names[seed % len(names)], "Percent": str(10 * k)})
+    orders = pd.DataFrame({"Malzeme": [f"P{i % 47}" for i in range(90)],
+                           "Malzeme Tanım": [f"Ürün {i}" for i in range(90)]})
+    order_path, ing_path = tmp_path / "siparis.xlsx", tmp_path / "bilesen.xlsx"
+    orders.to_excel(order_path, index=False)
+    pd.DataFrame(ing_rows).to_excel(ing_path, index=False)
+
+    class Upload:
+        def __init__(self, path):
+            self.name = str(path)
+    return Upload(order_path), Upload(ing_path)
+
+
+def run_analysis(A, monkeypatch, tmp_path, uploads, min_stream_bytes):
+    out_dir = tmp_path / f"rapor_{min_stream_bytes}"
+    out_dir.mkdir()
+    monkeypatch.setattr(A, "BASE_DIR", str(out_dir))
+    monkeypatch.setattr(A, "TAX_STREAM_MIN_FILE_BYTES", min_stream_bytes)
+    log, path = A.process_tax_analysis_structured(*uploads, progress=None)
+    assert path, log
+    return log, pd.read_excel(path, dtype=str)
+
+
+def test_streaming_and_in_memory_paths_write_identical_reports(A, monkeypatch, tmp_path, tax_inputs, shipped_tax_snapshot):
+    monkeypatch.setattr(A, "get_tax_snapshot", lambda as_of=None: shipped_tax_snapshot)
+    monkeypatch.setattr(A, "TAX_STREAM_CHUNK_ROWS", 16)   # Her dosya birkaç parçada okunsun
+
+    memory_log, memory_report = run_analysis(A, monkeypatch, tmp_path, tax_inputs, 10 ** 12)
+    stream_log, stream_report = run_analysis(A, monkeypatch, tmp_path, tax_inputs, 0)
+
+    assert "Akışlı mod" in stream_log and "Akışlı mod" not in memory_log
+    assert len(memory_report) > 90
+    pd.testing.assert_frame_equal(stream_report, memory_report)
+    # Eşleşme sayısı da aynı olmalı
+    assert memory_log.split("Vergi Eşleşmesi:")[1] == stream_log.split("Vergi Eşleşmesi:")[1]
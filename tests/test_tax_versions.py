@@ -0,0 +1,152 @@
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+
+def rec(gtp, tanim, oran="0"):
+    return {"gtp": gtp, "tanim": tanim, "gv_oran": oran}
+
+
+def hashes(A, records):
+    return [A.record_content_hash(r) for r in records]
+
+
+def test_record_hash_ignores_field_order(A):
+    assert A.record_content_hash({"gtp": "1", "tanim": "a"}) == A.record_content_hash({"tanim": "a", "gtp": "1"})
+
+
+def test_diff_maps_kept_records_and_lists_added_positions(A):
+    old = [rec("1", "a"), rec("2", "b"), rec("3", "c")]
+    new = [rec("2", "b"), rec("4", "d"), rec("1", "a")]
+    pos_map, added = A.diff_tax_records(hashes(A, old), hashes(A, new))
+    assert pos_map == [2, 0, -1]
+    assert added == [1]
+
+
+def test_diff_pairs_duplicate_records_in_order(A):
+    old = [rec("1", "a"), rec("1", "a")]
+    new = [rec("1", "a")]
+    pos_map, added = A.diff_tax_records(hashes(A, old), hashes(A, new))
+    assert pos_map == [0, -1] and added == []
+
+
+def test_summary_counts_same_gtp_with_new_content_as_changed(A):
+    old = [rec("1", "a"), rec("2", "b"), rec("3", "c")]
+    new = [rec("1", "a"), rec("2", "b", oran="5"), rec("9", "z")]
+    pos_map, added = A.diff_tax_records(hashes(A, old), hashes(A, new))
+    assert A.summarize_tax_diff(old, new, pos_map, added) == {"added": 1, "changed": 1, "removed": 1}
+
+
+@pytest.fixture
+def store(A, tmp_path, monkeypatch):
+    # Gerçek vergi_listesi.jsonl ilk sürüm olarak içeri alınmasın
+    monkeypatch.setattr(A, "TAX_DB_FILE", str(tmp_path / "yok.jsonl"))
+    return A.TaxVersionStore(str(tmp_path / "surumler"))
+
+
+def test_as_of_lookup_and_unchanged_reupload(A, store):
+    v1, diff1, _ = store.add_version([rec("1", "a"), rec("2", "b")], "ocak.xlsx", date(2023, 1, 1))
+    v2, diff2, records = store.add_version([rec("1", "a"), rec("3", "c")], "temmuz.xlsx", date(2023, 7, 1))
+    assert diff1 == {"added": 2, "changed": 0, "removed": 0}
+    assert diff2 == {"added": 1, "changed": 0, "removed": 1}
+
+    assert store.find_version(date(2022, 12, 31)) is None
+    assert store.find_version(date(2023, 3, 1))["id"] == v1["id"]
+    assert store.find_version(date(2024, 1, 1))["id"] == v2["id"]
+    assert [r["gtp"] for r in store.snapshot_for(v1).records] == ["1", "2"]
+
+    # Havuzdan kurulan sürümler değişmeyen kaydı aynı nesne olarak paylaşır
+    assert store.version_records(v1)[0] is records[0]
+
+    same, diff, _ = store.add_version([rec("1", "a"), rec("3", "c")], "tekrar.xlsx", date(2023, 8, 1))
+    assert diff is None and same["id"] == v2["id"]
+
+
+def test_manifest_is_read_from_disk_only_when_it_changes(A, store):
+    store.add_version([rec("1", "a")], "ocak.xlsx", date(2023, 1, 1))
+    reads = store.manifest_reads
+    for _ in range(20):
+        store.find_version(date(2023, 6, 1))
+    assert store.manifest_reads == reads
+
+    # Başka bir süreç manifesti değiştirirse yeniden okunur
+    other = A.TaxVersionStore(store.directory)
+    other.add_version([rec("2", "b")], "temmuz.xlsx", date(2023, 7, 1))
+    assert store.find_version(date(2023, 8, 1))["filename"] == "temmuz.xlsx"
+    assert store.manifest_reads == reads + 1
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), encoding="utf-8")
+
+
+def test_current_list_shares_pool_objects_when_pool_is_loaded_first(A, store, tmp_path):
+    records = [rec("1", "a"), rec("2", "b"), rec("3", "c")]
+    version, _, pooled = store.add_version(records, "ocak.xlsx", date(2023, 1, 1))
+    tax_file = tmp_path / "vergi.jsonl"
+    write_jsonl(tax_file, records)
+
+    current = A.TaxDatabase(str(tax_file), share=store.share_records).snapshot()
+    assert all(a is b for a, b in zip(current.records, store.version_records(version)))
+
+
+def test_pool_adopts_current_list_objects_when_loaded_later(A, store, tmp_path):
+    records = [rec("1", "a"), rec("2", "b")]
+    store.add_version(records, "ocak.xlsx", date(2023, 1, 1))
+    store.add_version(records[:1] + [rec("9", "z")], "temmuz.xlsx", date(2023, 7, 1))
+    tax_file = tmp_path / "vergi.jsonl"
+    write_jsonl(tax_file, records[:1] + [rec("9", "z")])
+
+    fresh = A.TaxVersionStore(store.directory)          # Havuz henüz okunmadı
+    current = A.TaxDatabase(str(tax_file), share=fresh.share_records).snapshot()
+    old = fresh.version_records(fresh.find_version(date(2023, 2, 1)))
+    new = fresh.version_records(fresh.find_version(date(2023, 8, 1)))
+    assert old[0] is current.records[0] and new[1] is current.records[1]
+    assert old[1] == rec("2", "b")
+
+
+CAS = "64-17-5"
+
+
+@pytest.fixture
+def dated_lists(A, store, tmp_path, monkeypatch):
+    """Aynı CAS'ın 2023 başında ve ortasında farklı GTIP'e bağlandığı iki sürüm; güncel liste ikincisi."""
+    old = [{"gtp": "2207.10", "tanim": f"Etil alkol (CAS {CAS})", "gv_oran": "0"}]
+    new = [{"gtp": "2208.90", "tanim": f"Etanol, denatüre (CAS {CAS})", "gv_oran": "5"}]
+    store.add_version(old, "ocak.xlsx", date(2023, 1, 1))
+    store.add_version(new, "temmuz.xlsx", date(2023, 7, 1))
+    tax_file = tmp_path / "vergi.jsonl"
+    write_jsonl(tax_file, new)
+    monkeypatch.setattr(A, "TAX_DB_FILE", str(tax_file))
+    monkeypatch.setattr(A, "tax_versions", store)
+    monkeypatch.setattr(A, "tax_db", A.TaxDatabase(str(tax_file), share=store.share_records))
+
+
+def sds_text(cas):
+    return {"kind": "text", "text": f"Product name: ALKOL\nSECTION 3: COMPOSITION\nEthanol {cas} 100 %\nSECTION 4: FIRST AID\n"}
+
+
+def test_sds_screening_and_matching_use_the_requested_list_version(A, dated_lists, monkeypatch):
+    async def fake_extract(prompt, cache_name, document, stats=None, bypass_cache=False, cache_key=None):
+        return {"product_name": "ALKOL", "main_cas": CAS}
+    monkeypatch.setattr(A, "extract_document_json", fake_extract)
+
+    def gtip(local_first, as_of):
+        row, _ = asyncio.run(A.analyze_single_sds("X.pdf", {}, A.new_llm_stats(), sds_text(CAS),
+                                                  local_first=local_first, as_of=as_of))
+        return row["G.T.İ.P. *"], row["ÇÖZÜM"]
+
+    assert gtip(True, None) == ("2208.90", "Yerel (CAS)")
+    assert gtip(True, date(2023, 3, 1)) == ("2207.10", "Yerel (CAS)")
+    assert gtip(False, date(2023, 3, 1)) == ("2207.10", "Gemini")
+    assert gtip(False, date(2023, 9, 1)) == ("2208.90", "Gemini")
+
+
+def test_process_tax_analysis_rejects_dates_without_a_list(A, dated_lists, monkeypatch):
+    monkeypatch.setattr(A, "llm_model", object())
+    message, path = asyncio.run(A.process_tax_analysis(["X.pdf"], None, as_of_text="01.01.2020"))
+    assert path is None and "yürürlükte olan bir vergi listesi sürümü yok" in message
+    message, path = asyncio.run(A.process_tax_analysis(["X.pdf"], None, as_of_text="dün"))
+    assert path is None and "anlaşılamadı" in message
@@ -0,0 +1,122 @@
+import pytest
+from PIL import Image
+
+FILLER = "Product is a flammable liquid used as an industrial solvent in closed systems.\n" * 8
+
+SDS_EN = f"""SAFETY DATA SHEET
+Table of contents
+1. Identification ........................ 1
+3. Composition/information on ingredients .. 2
+4. First-aid measures .................... 3
+
+SECTION 1: Identification
+Product name: SOLVENT X
+{FILLER}
+SECTION 3: Composition/information on ingredients
+Ethanol        64-17-5    80 - 90 %
+Methanol       67-56-1    1 - 5 %
+
+SECTION 4: First aid measures
+Rinse with plenty of water.
+
+SECTION 16: Other information
+Ingredients: see section 3 composition above.
+"""
+
+SECTIONS = {
+    "tr": ("BÖLÜM 3: Bileşim/içindekiler hakkında bilgi", "BÖLÜM 4: İlk yardım önlemleri"),
+    "tr_upper": ("BÖLÜM 3: BİLEŞİM / İÇERİK", "BÖLÜM 4: İLK YARDIM"),
+    "de": ("ABSCHNITT 3: Zusammensetzung/Angaben zu Bestandteilen", "ABSCHNITT 4: Erste-Hilfe-Maßnahmen"),
+    "fr": ("RUBRIQUE 3: Composition/informations sur les composants", "RUBRIQUE 4: Premiers secours"),
+    "numbered": ("3. COMPOSITION / INFORMATION ON INGREDIENTS", "4. FIRST AID MEASURES"),
+}
+
+
+def test_text_layer_needs_enough_visible_characters(A):
+    short = "a b\n" * ((A.TEXT_LAYER_MIN_CHARS - 2) // 2) + "x"
+    assert sum(not ch.isspace() for ch in short) == A.TEXT_LAYER_MIN_CHARS - 1
+    assert not A.has_usable_text_layer(short)
+    assert A.has_usable_text_layer(short + "y")
+    assert not A.has_usable_text_layer(" \n\t" * 5000)
+
+
+def test_text_layer_with_broken_font_encoding_is_rejected(A):
+    assert A.has_usable_text_layer(SDS_EN + "(cid:12)" * 20)
+    assert not A.has_usable_text_layer(SDS_EN + "(cid:12)" * 21)
+    assert not A.has_usable_text_layer("#§$%&" * 200 + "abc")
+
+
+def test_composition_skips_table_of_contents_and_trailing_references(A):
+    composition = A.extract_sds_composition(SDS_EN)
+    assert composition.startswith("SECTION 3: Composition")
+    assert "64-17-5" in composition and "67-56-1" in composition
+    assert "First aid" not in composition and "...." not in composition
+
+
+@pytest.mark.parametrize("language", sorted(SECTIONS))
+def test_composition_headings_in_other_languages(A, language):
+    start, end = SECTIONS[language]
+    text = f"{start}\nEtanol   64-17-5   %80-90\n\n{end}\nBol su ile yıkayın.\n"
+    assert A.extract_sds_composition(text) == f"{start}\nEtanol   64-17-5   %80-90"
+
+
+def test_composition_without_section_4_is_limited(A):
+    text = "SECTION 3: Composition\n" + "Ethanol 64-17-5 80 %\n" * 1000
+    composition = A.extract_sds_composition(text)
+    assert composition.startswith("SECTION 3: Composition") and len(composition) <= 6000
+    assert A.extract_sds_composition(FILLER) == ""
+
+
+def test_payload_puts_composition_first_within_the_cap(A):
+    long_text = SDS_EN + "Additional regulatory text.\n" * 2000
+    payload = A.build_text_layer_payload(long_text)
+    headers = len("[BÖLÜM 3 - BİLEŞİM]\n") + len("\n\n[BELGENİN BAŞI]\n")
+    assert payload.startswith("[BÖLÜM 3 - BİLEŞİM]\nSECTION 3: Composition")
+    assert "Product name: SOLVENT X" in payload
+    assert len(payload) == A.TEXT_LAYER_MAX_CHARS + headers
+
+
+def test_payload_caps_huge_composition_to_half(A):
+    text = "SECTION 3: Composition\n" + "Ethanol 64-17-5 80 %\n" * 2000 + "SECTION 4: First aid\n" + "x" * 20000
+    payload = A.build_text_layer_payload(text)
+    composition = payload.split("\n\n[BELGENİN BAŞI]\n")[0]
+    assert len(composition) == len("[BÖLÜM 3 - BİLEŞİM]\n") + A.TEXT_LAYER_MAX_CHARS // 2
+    assert len(payload) <= A.TEXT_LAYER_MAX_CHARS + 64
+
+
+def test_payload_without_composition_is_the_capped_head(A):
+    text = FILLER * 100
+    assert A.build_text_layer_payload(text) == text[:A.TEXT_LAYER_MAX_CHARS]
+
+
+@pytest.fixture
+def loader(A, monkeypatch):
+    images = []
+
+    def fake_image(file_path, dpi):
+        images.append(file_path)
+        return Image.new("RGB", (10, 10), "white")
+    monkeypatch.setattr(A, "load_document_image", fake_image)
+    monkeypatch.setitem(A.app_config, "pdf_text_layer", True)
+
+    def use(text):
+        monkeypatch.setattr(A, "extract_pdf_text_layer", lambda file_path: text)
+        return images
+    return use
+
+
+def test_digital_pdf_is_sent_as_text(A, loader):
+    images = loader(SDS_EN)
+    document = A.load_document_for_llm("SDS.PDF")
+    assert document["kind"] == "text" and document["text"] == A.build_text_layer_payload(SDS_EN)
+    assert images == []
+
+
+def test_scanned_pdf_photos_and_disabled_setting_use_the_image(A, loader, monkeypatch):
+    images = loader("(cid:3)" * 100)
+    assert A.load_document_for_llm("tarama.pdf")["kind"] == "image"
+    loader(SDS_EN)
+    assert A.load_document_for_llm("foto.jpg")["kind"] == "image"
+    monkeypatch.setitem(A.app_config, "pdf_text_layer", False)
+    assert A.load_document_for_llm("SDS.pdf")["kind"] == "image"
+    assert images == ["tarama.pdf", "foto.jpg", "SDS.pdf"]